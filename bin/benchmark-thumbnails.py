@@ -0,0 +1,105 @@
+"""Compare the time and peak memory of making thumbnails of big images the
+way floof used to -- decoding the whole thing, then one antialiased resize --
+against `floof.lib.thumbnails.make_thumbnail`.
+
+Each run happens in a fresh process, so that its peak memory can be told
+apart from the others'.  Memory is the growth in peak RSS over that of a
+process which only opened the image.
+"""
+import multiprocessing
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import time
+
+try:
+    import Image
+except ImportError:
+    from PIL import Image
+
+from floof.lib import thumbnails
+
+SIZES = [(4000, 3000), (12000, 8000)]
+FORMATS = ['JPEG', 'PNG']
+THUMBNAIL_SIZE = 160
+
+
+def full_decode(image, size):
+    """The old way: crop and resize at full resolution."""
+    width, height = image.size
+    height = min(height, width * thumbnails.MAX_ASPECT_RATIO)
+    width = min(width, height * thumbnails.MAX_ASPECT_RATIO)
+    image = image.crop((0, 0, width, height))
+    if width > height:
+        new_size = (size, height * size // width)
+    else:
+        new_size = (width * size // height, size)
+    return image.resize(new_size, Image.ANTIALIAS)
+
+def open_only(image, size):
+    return image
+
+METHODS = [
+    ('open only', open_only),
+    ('full decode', full_decode),
+    ('make_thumbnail', thumbnails.make_thumbnail),
+]
+
+
+def _run(method, path, results):
+    image = Image.open(path)
+    start = time.time()
+    method(image, THUMBNAIL_SIZE)
+    elapsed = time.time() - start
+    # Kilobytes on Linux
+    results.put((elapsed, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss))
+
+def measure(method, path):
+    """Returns the time taken and peak memory used by `method` on the image at
+    `path`, in a process of its own.
+    """
+    results = multiprocessing.Queue()
+    process = multiprocessing.Process(
+        target=_run, args=(method, path, results))
+    process.start()
+    result = results.get()
+    process.join()
+    return result
+
+def make_image(path, size, format):
+    """Writes a noisy test image, so it doesn't compress to nothing."""
+    noise = Image.effect_noise(size, 64)
+    Image.merge('RGB', (noise, noise.transpose(Image.FLIP_LEFT_RIGHT),
+        noise.transpose(Image.FLIP_TOP_BOTTOM))).save(path, format)
+
+def main():
+    if hasattr(Image, 'MAX_IMAGE_PIXELS'):
+        Image.MAX_IMAGE_PIXELS = None
+
+    directory = tempfile.mkdtemp()
+    try:
+        print '{0:<20} {1:<16} {2:>10} {3:>12}'.format(
+            'image', 'method', 'time (s)', 'memory (MB)')
+        for size in SIZES:
+            for format in FORMATS:
+                path = os.path.join(directory, 'bench.' + format.lower())
+                make_image(path, size, format)
+                label = '{0}x{1} {2}'.format(size[0], size[1], format)
+
+                baseline = None
+                for name, method in METHODS:
+                    elapsed, peak = measure(method, path)
+                    if baseline is None:
+                        baseline = peak
+                        continue
+                    print '{0:<20} {1:<16} {2:>10.2f} {3:>12.1f}'.format(
+                        label, name, elapsed, (peak - baseline) / 1024)
+    finally:
+        shutil.rmtree(directory)
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        SIZES = [tuple(int(n) for n in arg.split('x')) for arg in sys.argv[1:]]
+    main()
@@ -0,0 +1,142 @@
+"""Run one of floof's offline maintenance jobs against a configured site.
+
+These are meant to be run by hand after a migration, or from cron.
+"""
+import logging
+import os
+import transaction
+import sys
+
+from paste.deploy import appconfig
+from sqlalchemy import engine_from_config
+from zope.sqlalchemy import ZopeTransactionExtension
+
+from floof import model
+import floof.lib.indexes
+
+log = logging.getLogger(__name__)
+
+
+def backfill_watchstream(conf):
+    """Rebuild every user's watchstream inbox from their watches."""
+    from floof.lib import watchstream
+    watchstream.backfill(model.session)
+
+def backfill_dhashes(conf):
+    """Perceptually hash every image that predates hashing."""
+    from floof.lib import imagehash, thumbnails
+    from floof.model.filestore import get_storage_factory
+    thumbnails.configure(conf)
+    storage = get_storage_factory(conf)()
+    processes = conf.get('backfill.processes')
+    imagehash.backfill(model.session, storage,
+        int(processes) if processes else None)
+
+def evict_renditions(conf):
+    """Throw out old renditions until they fit in the cache."""
+    from floof.lib import renditions
+    from floof.model.filestore import get_storage_factory
+    renditions.configure(conf)
+    renditions.evict(get_storage_factory(conf)())
+
+def generate_thumbnails(conf):
+    """Make any thumbnails that are missing."""
+    from floof.lib import thumbnails
+    thumbnails.configure(conf)
+    processes = conf.get('backfill.processes')
+    thumbnails.backfill(model.session, int(processes) if processes else None)
+
+def rebuild_leaderboards(conf):
+    """Recompute the top-rated art for each time window."""
+    from floof.lib import leaderboards
+    leaderboards.rebuild(model.session)
+
+def rebuild_postings(conf):
+    """Rebuild the tag and user posting lists used for gallery filtering."""
+    from floof.lib.indexes import postings
+    postings.rebuild(model.session)
+
+def rebuild_similar(conf):
+    """Recompute the "art like this" neighbours of every artwork."""
+    from floof.lib.indexes import similar
+    similar.rebuild(model.session)
+
+def rebuild_watch_graph(conf):
+    """Rebuild the adjacency index of who watches whom."""
+    from floof.lib.indexes import watchgraph
+    watchgraph.rebuild(model.session)
+
+def recompute_hot_scores(conf):
+    """Recompute every artwork's "trending" score."""
+    model.recompute_hot_scores(model.session, model.Artwork.__table__)
+
+def recount_galleries(conf):
+    """Correct any drift in the cached gallery and tag counts."""
+    from floof.lib import counts
+    counts.recount(model.session)
+
+def rebuild_tag_closure(conf):
+    """Recompute every tag's transitive implications."""
+    from floof.lib import tagrules
+    tagrules.rebuild_closure(model.session)
+
+def rebuild_tag_cooccurrence(conf):
+    """Recount which tags go together.  Needs NumPy."""
+    from floof.lib.indexes import cooccurrence
+    cooccurrence.rebuild(model.session)
+
+def rebuild_tag_completion(conf):
+    """Rebuild the tag names and usage counts used for completion."""
+    from floof.lib.indexes import tagcomplete
+    tagcomplete.rebuild(model.session)
+
+def rebuild_suggestions(conf):
+    """Refit the model behind the suggest sort.  Needs NumPy."""
+    from floof.lib.indexes import suggest
+    suggest.rebuild(model.session)
+
+
+JOBS = {
+    'backfill-dhashes': backfill_dhashes,
+    'backfill-watchstream': backfill_watchstream,
+    'evict-renditions': evict_renditions,
+    'generate-thumbnails': generate_thumbnails,
+    'rebuild-leaderboards': rebuild_leaderboards,
+    'rebuild-postings': rebuild_postings,
+    'rebuild-similar': rebuild_similar,
+    'rebuild-suggestions': rebuild_suggestions,
+    'rebuild-tag-closure': rebuild_tag_closure,
+    'rebuild-tag-completion': rebuild_tag_completion,
+    'rebuild-tag-cooccurrence': rebuild_tag_cooccurrence,
+    'rebuild-watch-graph': rebuild_watch_graph,
+    'recompute-hot-scores': recompute_hot_scores,
+    'recount-galleries': recount_galleries,
+}
+
+def usage():
+    print 'usage: python {0} config-file.ini#app-name job'.format(sys.argv[0])
+    print
+    print 'Available jobs:'
+    for name in sorted(JOBS):
+        print '  {0:<24} {1}'.format(name, JOBS[name].__doc__)
+
+if __name__ == '__main__':
+    if len(sys.argv) < 3 or sys.argv[1] in ('-h', '--help') \
+            or sys.argv[2] not in JOBS:
+        usage()
+        sys.exit(0)
+
+    # Get paster to interpret the passed config file
+    ini_spec = os.path.abspath(sys.argv[1])
+    conf = appconfig('config:' + ini_spec)
+
+    # Set up the SQLAlchemy environment
+    model.initialize(
+        engine_from_config(conf, 'sqlalchemy.'),
+        extension=ZopeTransactionExtension())
+
+    floof.lib.indexes.configure(conf)
+
+    JOBS[sys.argv[2]](conf)
+
+    transaction.commit()
@@ -4,6 +4,7 @@ import os
 import subprocess
 
 from pyramid_beaker import session_factory_from_settings
+from pyramid_beaker import set_cache_regions_from_settings
 from pyramid.authorization import ACLAuthorizationPolicy
 from pyramid.config import Configurator
 from pyramid.decorator import reify
@@ -25,6 +26,9 @@ from floof.resource import FloofRoot
 
 import floof.lib.debugging
 import floof.lib.helpers
+import floof.lib.indexes
+import floof.lib.renditions
+import floof.lib.thumbnails
 import floof.model
 import floof.routing
 import floof.views
@@ -184,6 +188,11 @@ def main(global_config, **settings):
         compile_sass(global_config['here'] + '/floof')
 
     ### Settings
+    # The thumbnail pool is forked, so start it before there are connections
+    # or threads to copy
+    floof.lib.thumbnails.configure(settings)
+    floof.lib.thumbnails.start()
+
     # Set up SQLAlchemy stuff
     engine = engine_from_config(settings, 'sqlalchemy.')
     floof.model.initialize(
@@ -200,6 +209,9 @@ def main(global_config, **settings):
     # Misc other crap
     settings['rating_radius'] = int(settings['rating_radius'])
     settings['filestore_factory'] = filestore.get_storage_factory(settings)
+    floof.lib.indexes.configure(settings)
+    floof.lib.renditions.configure(settings)
+    set_cache_regions_from_settings(settings)
 
     ### Configuratify
     # Session factory needs to subclass our mixin above.  Beaker's
@@ -11,6 +11,7 @@ from wtforms.ext.sqlalchemy.fields import QuerySelectMultipleField
 import pytz
 
 from floof import model
+from floof.lib import tagrules
 
 
 class FloofForm(form.Form):
@@ -114,7 +115,9 @@ class MultiTagField(fields.TextField):
             raise ValueError("Tags must be lowercase and alphanumeric")
 
         if value:
-            self.data = [x for x in value.strip().split()]
+            # Aliases are never stored; tag things with the real name
+            self.data = tagrules.canonical_names(
+                model.session, value.strip().split())
         else:
             self.data = []
 
@@ -0,0 +1,170 @@
+"""Cached sizes of countable galleries.
+
+Showing "page 3 of 70" needs the size of the gallery, and a COUNT over a big
+gallery is a scan on every page view.  Instead, the number of artworks with
+each single filter key -- one tag, one user relationship, one label, or just
+everything -- lives in the gallery_counts table.  A key's row is created the
+first time anyone asks for it, and from then on the write paths keep it
+current with `adjust`, which is a single UPDATE.
+
+Keys are the strings used by the posting index (see
+`floof.lib.indexes.postings`), plus `label_key` and `ALL_KEY`.
+
+Each tag's key is also mirrored in its own `usage_count`, which the tag
+directory sorts by.  That one is always kept, whether or not anyone has asked
+for the key.
+
+A new key is counted and inserted by one statement, so on SQLite, where
+writes take turns, nothing can slip in between.  Elsewhere, a write that was
+still uncommitted when the key was first counted has its `adjust` skip the
+key, so new keys are counted again on the first `get` after `RECOUNT_DELAY`,
+by which time any such write has finished.  The recount-galleries batch job
+puts right any other drift.
+"""
+from datetime import timedelta
+
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql import and_, exists, func, literal, not_, select
+from sqlalchemy.sql.expression import ClauseElement, Executable
+
+from floof import model
+from floof.lib.indexes import postings
+
+ALL_KEY = u'all'
+# How long after a key is first counted to count it again; longer than any
+# write transaction should take
+RECOUNT_DELAY = timedelta(minutes=5)
+
+def label_key(label_id):
+    return u'label:{0:d}'.format(label_id)
+
+def artwork_keys(artwork):
+    """Returns every count key that includes `artwork`.  As with the posting
+    index, its tags, users, and labels must already have been flushed.
+    """
+    keys = [ALL_KEY]
+    keys.extend(postings.artwork_keys(artwork))
+    keys.extend(label_key(label.id) for label in artwork.labels)
+    return keys
+
+
+def _count_query(key):
+    """Returns a SELECT that counts the artworks matching `key` from scratch."""
+    if key == ALL_KEY:
+        return select([func.count(model.Artwork.__table__.c.id)])
+
+    kind, _, ident = key.partition(u':')
+    ident = int(ident)
+    if kind == u'tag':
+        table = model.artwork_tags
+        return select([func.count(table.c.artwork_id)],
+            table.c.tag_id == ident)
+    elif kind == u'label':
+        table = model.artwork_labels
+        return select([func.count(table.c.artwork_id)],
+            table.c.label_id == ident)
+    elif kind in model.user_artwork_types:
+        table = model.UserArtwork.__table__
+        return select([func.count(table.c.artwork_id)],
+            (table.c.user_id == ident) & (table.c.relationship_type == kind))
+
+    raise ValueError("No such count key {0!r}".format(key))
+
+class _insert_count(Executable, ClauseElement):
+    """Counts `key` from scratch and inserts it, unless it's already there, in
+    a single INSERT ... SELECT.  Where the database has a way to say so,
+    losing a race to insert the same key is ignored rather than an error, so
+    the transaction needn't be rolled back to a savepoint.
+    """
+    def __init__(self, key, recount_time):
+        self.key = key
+        self.recount_time = recount_time
+
+@compiles(_insert_count)
+def _compile_insert_count(element, compiler, **kw):
+    table = model.GalleryCount.__table__
+    query = select([
+            literal(element.key, table.c.key.type),
+            _count_query(element.key).as_scalar(),
+            literal(element.recount_time, table.c.recount_time.type)],
+        not_(exists([table.c.key], table.c.key == element.key)))
+    return u'INSERT INTO {0} ({1}, {2}, {3}) {4}'.format(
+        compiler.preparer.format_table(table),
+        compiler.preparer.format_column(table.c.key),
+        compiler.preparer.format_column(table.c.count),
+        compiler.preparer.format_column(table.c.recount_time),
+        compiler.process(query))
+
+@compiles(_insert_count, 'postgresql')
+def _compile_insert_count_postgresql(element, compiler, **kw):
+    return _compile_insert_count(element, compiler, **kw) \
+        + u' ON CONFLICT DO NOTHING'
+
+def get(session, key):
+    """Returns the number of artworks matching `key`.  The first time a key is
+    asked for, it's counted and the result is kept.
+    """
+    # This all goes through Core rather than the ORM, so an earlier `adjust`
+    # in the same session can't leave a stale object in the identity map
+    table = model.GalleryCount.__table__
+    key = unicode(key)
+    now = model.now()
+    row = session.execute(select([table.c.count, table.c.recount_time],
+        table.c.key == key)).first()
+
+    if row is None:
+        session.execute(_insert_count(key, now + RECOUNT_DELAY))
+    elif row.recount_time is not None and row.recount_time <= now:
+        session.execute(table.update()
+            .where(and_(table.c.key == key, table.c.recount_time != None))
+            .values(count=_count_query(key).as_scalar(), recount_time=None))
+    else:
+        return row.count
+
+    return session.execute(
+        select([table.c.count], table.c.key == key)).scalar()
+
+def _tag_ids(keys):
+    """Returns the tag ids among some count keys."""
+    tag_ids = []
+    for key in keys:
+        kind, _, ident = unicode(key).partition(u':')
+        if kind == u'tag':
+            tag_ids.append(int(ident))
+    return tag_ids
+
+def adjust(session, added_keys=(), removed_keys=()):
+    """Updates the counts after a single artwork gains or loses some keys.
+    Keys nobody has asked for yet are left alone, except for tags' usage
+    counts.
+    """
+    table = model.GalleryCount.__table__
+    tags = model.Tag.__table__
+    for keys, delta in ((added_keys, 1), (removed_keys, -1)):
+        if not keys:
+            continue
+        session.execute(table.update()
+            .where(table.c.key.in_([unicode(key) for key in keys]))
+            .values(count=table.c.count + delta))
+
+        tag_ids = _tag_ids(keys)
+        if tag_ids:
+            session.execute(tags.update()
+                .where(tags.c.id.in_(tag_ids))
+                .values(usage_count=tags.c.usage_count + delta))
+
+def recount(session):
+    """Recounts every key that's been counted before, and every tag's usage
+    count.
+    """
+    table = model.GalleryCount.__table__
+    for key, in session.execute(select([table.c.key])).fetchall():
+        session.execute(table.update()
+            .where(table.c.key == key)
+            .values(count=_count_query(key).as_scalar(), recount_time=None))
+
+    tags = model.Tag.__table__
+    artwork_tags = model.artwork_tags
+    session.execute(tags.update().values(usage_count=
+        select([func.count(artwork_tags.c.artwork_id)],
+            artwork_tags.c.tag_id == tags.c.id).as_scalar()))
@@ -5,34 +5,46 @@ of easy SQL wrappers.
 Intended to be used and usable from basically all over the place.  You probably
 want the `GallerySieve` class.
 """
-from datetime import timedelta
+from calendar import timegm
+from collections import namedtuple
+from datetime import datetime, time, timedelta
+import hashlib
+import os
+import random
 
-from sqlalchemy.orm.exc import NoResultFound
-from sqlalchemy.sql import case, or_
-import wtforms.form, wtforms.fields
+from beaker.cache import Cache, cache_regions
+import pytz
+from sqlalchemy.orm import joinedload, joinedload_all, lazyload
+from sqlalchemy.sql import and_, func, select
+import transaction
+import wtforms.form, wtforms.fields, wtforms.validators
 
+from floof.lib import counts
+from floof.lib import leaderboards
 from floof.lib import pager
+from floof.lib import tagquery
+from floof.lib import tagrules
+from floof.lib.indexes import cooccurrence
+from floof.lib.indexes import postings
+from floof.lib.indexes import watchgraph
+try:
+    from floof.lib.indexes import suggest
+except ImportError:
+    # No NumPy; the suggest sort falls back to upload time
+    suggest = None
 from floof import model
 
 # TODO: labels (is there a favorites ticket?)
-# TODO: "art like this" on art page
-# TODO: another special search, elsewhere, for friend-of-friends (watches of everyone in label x)
 
 class GalleryForm(wtforms.form.Form):
     """Form used all over the place for "searching" (really filtering) through
     art.
     """
-    # TODO replace me with a special tag filter field that somehow interacts
-    # correctly with the function below.  syntax should include:
-    # - arbitrary boolean queries
-    #   a | b?  a OR b?  OR(a b)??
-    # - then bogus tags can just error back to the form, if that makes sense.
-    #   or just show nothing, with a warning.  not sure which is less useful.
+    # Parsed by floof.lib.tagquery; see there for the syntax.  Bogus queries
+    # and unknown names error back to the form.
     # TODO this includes user searchin.  so what to do about uploader, if
     # anything?
     tags = wtforms.fields.TextField(u'Tags')
-    # TODO maybe arbitrary-ish date search here?  center+radius.  I often find
-    # myself wanting to look for stuff that's "about six months old"
     time_radius = wtforms.fields.SelectField(u'Uploaded within',
         choices=[
             (u'all',    u'—'),
@@ -46,6 +58,24 @@ class GalleryForm(wtforms.form.Form):
         ],
         default=u'all',
     )
+    # Arbitrary windows, for stuff that's "about six months old": either a
+    # date give or take some time, or a range of dates.  Dates are in the
+    # user's timezone
+    uploaded_around = wtforms.fields.DateField(u'Uploaded around',
+        [wtforms.validators.Optional()])
+    around_radius = wtforms.fields.SelectField(u'Give or take',
+        choices=[
+            (u'24h',    u'a day'),
+            (u'7d',     u'a week'),
+            (u'30d',    u'a month'),
+            (u'90d',    u'three months'),
+        ],
+        default=u'7d',
+    )
+    uploaded_from = wtforms.fields.DateField(u'Uploaded from',
+        [wtforms.validators.Optional()])
+    uploaded_to = wtforms.fields.DateField(u'Uploaded until',
+        [wtforms.validators.Optional()])
     my_rating = wtforms.fields.SelectField(u'My rating',
         choices=[
             (u'all',    u'—'),
@@ -61,10 +91,11 @@ class GalleryForm(wtforms.form.Form):
     sort = wtforms.fields.SelectField(u'Sort by',
         choices=[
             (u'uploaded_time',  u'time uploaded'),
-            (u'rating',         u'rating (restricted to the last 24h)'),
+            (u'rating',         u'rating'),
             (u'rating_count',   u'number of ratings'),
-            # TODO implement me
-            #(u'suggest',        u"how much I'd like it"),
+            (u'trending',       u'popular lately'),
+            (u'suggest',        u"how much I'd like it"),
+            (u'random',         u'random'),
         ],
         default=u'uploaded_time',
     )
@@ -77,6 +108,11 @@ class GalleryForm(wtforms.form.Form):
         default=u'thumbnails',
     )
 
+    def validate_uploaded_to(form, field):
+        if field.data and form.uploaded_from.data \
+                and field.data < form.uploaded_from.data:
+            raise ValueError(u"Can't end before it starts")
+
 # Definitions of the time_radius options, expressed as timedelta params
 TIME_RADII = {
     u'30m':    dict(minutes=30),
@@ -88,9 +124,150 @@ TIME_RADII = {
     u'365d':   dict(days=365),
 }
 
+# Sorting by rating without a leaderboard to join to only looks this far back,
+# so it never sorts every artwork there is
+RATING_SORT_RADIUS = timedelta(hours=24)
+
 
 PAGE_SIZE = 64  # XXX
 
+# Relations each display mode touches for every artwork, per the defs in
+# art/lib.mako.  They're loaded along with the page, rather than one lazy load
+# per artwork.  Keep these in sync with the templates!
+DISPLAY_LOADER_OPTIONS = {
+    u'thumbnails': (
+        joinedload('uploader'),
+        # Users always eagerly load their roles, which a gallery never needs
+        lazyload('uploader.roles'),
+    ),
+    u'succinct': (),
+    u'detailed': (
+        joinedload_all('resource.discussion'),
+    ),
+}
+
+# Tag and user filters are intersected using the in-memory posting lists when
+# they're available.  If the intersection is bigger than this, the filters are
+# handed to the database instead, since a giant IN list is worse than EXISTS
+MAX_POSTINGS_IDS = 2000
+
+# The friends-of-friends filter only lists this many users in an IN clause, to
+# stay well under SQLite's oldest limit of 999 bound parameters; past that,
+# it's left to subqueries
+MAX_FRIENDS_OF_FRIENDS = 500
+
+# Countable galleries filtered by something without a cached count are counted
+# only this far.  Past that, the cached counts give an upper bound instead
+MAX_EXACT_COUNT = 1000
+
+# The suggest sort ranks this many of the newest matching artworks
+MAX_SUGGEST_CANDIDATES = 1000
+
+# The random sort checks this many random ids against the filters, however
+# many it shows, so a pick always costs the same
+RANDOM_CANDIDATES = 500
+
+# Number of tags suggested for narrowing down a tag search
+REFINEMENT_COUNT = 8
+
+
+### Result caching
+
+# Gallery pages are cached as lists of artwork ids, in this Beaker cache region
+# if it's configured; see `GallerySieve._fetch`
+CACHE_REGION = 'gallery'
+# The generations that invalidate them (see `invalidate_cache`) live in this
+# region, which should be shared by every process, even if the pages aren't.
+# Without it, they go in the pages' region
+GENERATION_REGION = 'gallery_generations'
+
+def _get_cache(name=CACHE_REGION):
+    """Returns the Beaker cache for the named region, or None if there isn't
+    one configured.
+    """
+    region = cache_regions.get(name)
+    if not region or not region.get('enabled', True):
+        return None
+    return Cache._get_cache(__name__ + '.' + name, region)
+
+def _get_generations():
+    return _get_cache(GENERATION_REGION) or _get_cache(CACHE_REGION)
+
+def _new_generation():
+    return os.urandom(8).encode('hex')
+
+def _generation(generations, scope):
+    return generations.get('generation:' + scope, createfunc=_new_generation)
+
+def invalidate_cache(*scopes):
+    """Throws away the cached gallery pages that depend on any of the given
+    scopes, once the current transaction commits.  Every gallery depends on
+    'artwork'; 'ratings', 'tags', and 'watches' only affect galleries that
+    sort or filter on them.
+
+    Each scope has a generation that's part of the cache key, so this just
+    picks a new one.  Other processes only notice if the generations are in a
+    shared backend (like file or ext:memcached), which is what
+    `GENERATION_REGION` is for.
+    """
+    generations = _get_generations()
+    if generations is None:
+        return
+
+    def hook(success):
+        if not success:
+            return
+        for scope in scopes:
+            generations.put('generation:' + scope, _new_generation())
+
+    transaction.get().addAfterCommitHook(hook)
+
+def _quantize(dt, delta):
+    """Rounds `dt` down to a multiple of a hundredth of `delta`, or of a
+    minute, whichever is larger.  Time filters that do this give the same
+    query for a while, so their results can be cached.
+    """
+    quantum = max(60, int(delta.total_seconds()) // 100)
+    timestamp = timegm(dt.utctimetuple())
+    return datetime.fromtimestamp(timestamp - timestamp % quantum, pytz.utc)
+
+# Read-only stand-ins for the ORM objects, used when a sieve is asked for a
+# projection.  They hold only what art/lib.mako's gallery defs use, plus the
+# sort columns the keyset pager seeks on.  Field names match the ORM
+# attributes, so routes and templates can't tell the difference
+UserRow = namedtuple('UserRow',
+    ['id', 'name', 'display_name', 'has_trivial_display_name'])
+DiscussionRow = namedtuple('DiscussionRow', ['comment_count'])
+ArtworkRow = namedtuple('ArtworkRow', [
+    'id', 'title', 'hash', 'media_type',
+    'uploaded_time', 'rating_score', 'rating_count', 'hot_score',
+    'uploader', 'discussion', 'leaderboard_score',
+])
+
+_artwork_row_columns = [
+    model.Artwork.id, model.Artwork.title, model.Artwork.hash,
+    model.Artwork.media_type, model.Artwork.uploaded_time,
+    model.Artwork.rating_score, model.Artwork.rating_count,
+    model.Artwork.hot_score,
+]
+_user_row_columns = [
+    model.User.id, model.User.name, model.User.display_name,
+    model.User.has_trivial_display_name,
+]
+
+def _make_artwork_row(row, leaderboard_score=None):
+    """Builds an `ArtworkRow` out of a flat result row, as selected by
+    `GallerySieve._projection_query`.
+    """
+    n = len(_artwork_row_columns)
+    m = n + len(_user_row_columns)
+    discussion = None
+    if len(row) > m:
+        discussion = DiscussionRow(*row[m:])
+    return ArtworkRow(*row[:n], uploader=UserRow(*row[n:m]),
+        discussion=discussion, leaderboard_score=leaderboard_score)
+
+
 class GallerySieve(object):
     """Handles filtering art by various criteria.  Different places within the
     site show different chunks of artwork, but ought to function similarly;
@@ -107,10 +284,8 @@ class GallerySieve(object):
     combined arbitrarily; they'll be ANDed together.
     """
 
-    default_order_clause = model.Artwork.uploaded_time.desc()
-    temporal_column_name = 'uploaded_time'
-
-    def __init__(self, session=None, user=None, formdata=None, countable=False):
+    def __init__(self, session=None, user=None, formdata=None, countable=False,
+            projection=False):
         """Parameters:
 
         `session`
@@ -134,6 +309,10 @@ class GallerySieve(object):
             next page link if there are more items to see.  The intention is
             that this be set to True only for "real" gallery, such as the
             artwork a single user owns.
+        `projection`
+            If set to True, the pager will contain read-only `ArtworkRow`s
+            instead of ORM objects, loaded with only the columns the gallery
+            templates need.  Use this when the page just renders the gallery.
         """
         if not session:
             session = model.session
@@ -141,10 +320,49 @@ class GallerySieve(object):
         self.session = session
         self.user = user
         self.countable = countable
+        self.projection = projection
         self.display_mode = 'thumbnails'
 
-        self.query = session.query(model.Artwork) \
-            .order_by(self.default_order_clause)
+        # List of (posting key, equivalent SQL clause) for tag-like filters;
+        # applied all at once by evaluate().  A tuple of keys matches any of
+        # them
+        self._posting_filters = []
+        # Ids of the plain tags being filtered by
+        self._tag_ids = []
+        # The matching artwork ids, if the posting index was used, and the
+        # keys of the filters they account for
+        self._posting_ids = None
+        self._posting_keys = set()
+
+        # Keys (see floof.lib.counts) of the filters that have cached counts;
+        # tuples of posting keys for the filters that match any of several
+        # tags, which only the posting index can count; and whether there are
+        # any other filters
+        self._count_keys = []
+        self._union_keys = []
+        self._ad_hoc = False
+
+        # Hashable descriptions of every filter and the sort order, which make
+        # up the cache key
+        self._cache_parts = []
+
+        # Every ordering is descending by some column, then by id to break
+        # ties; the id is what makes keyset paging work
+        self.query = session.query(model.Artwork)
+        self.id_column = model.Artwork.id
+        self.order_column = None
+        # Id of the user to rank suggestions for, when sorting that way
+        self._suggest_for = None
+        # Leaderboard window to sort by, when sorting by rating
+        self._leaderboard = None
+        # That window's score, as a labelled column on every row, once the
+        # query is joined to it; see _rank_by_leaderboard
+        self._board_score = None
+        # Whether sorting by rating had to fall back to RATING_SORT_RADIUS
+        self.rating_sort_limited = False
+        # Whether to show a random sample instead of sorting
+        self._random = False
+        self._set_order_column(model.Artwork.uploaded_time)
 
         self.form = GalleryForm(formdata)
         self.original_formdata = formdata or {}
@@ -159,14 +377,39 @@ class GallerySieve(object):
         self.display_mode = form.display.data
 
         if form.tags.data:
-            self.filter_by_tag_query(form.tags.data)
+            try:
+                unknown = self.filter_by_tag_query(form.tags.data)
+            except tagquery.TagQueryError as e:
+                # Better to show nothing than to quietly ignore half the query
+                form.tags.errors.append(unicode(e))
+                self.filter_nothing()
+            else:
+                for name in unknown:
+                    form.tags.errors.append(
+                        u"No such tag or user: {0}".format(name))
 
         # TODO: allow "popular per day" a la e621?
-        # TODO: or for "popular recently", use popularity * age for falloff?
         if form.time_radius.data != u'all':
             self.filter_by_recency(
                 timedelta(**TIME_RADII[form.time_radius.data]))
 
+        if form.uploaded_around.data:
+            # Give or take from midday
+            self.filter_by_upload_window(
+                self._start_of_day(form.uploaded_around.data)
+                    + timedelta(hours=12),
+                timedelta(**TIME_RADII[form.around_radius.data]))
+
+        if form.uploaded_from.data or form.uploaded_to.data:
+            start = end = None
+            if form.uploaded_from.data:
+                start = self._start_of_day(form.uploaded_from.data)
+            if form.uploaded_to.data:
+                # Inclusive, so up to the start of the next day
+                end = self._start_of_day(
+                    form.uploaded_to.data + timedelta(days=1))
+            self.filter_by_upload_range(start, end)
+
         if form.my_rating.data != u'all' and self.user:
             # This is done here instead of via a method until someone comes up
             # with a decent method interface.
@@ -174,6 +417,8 @@ class GallerySieve(object):
             my_rating_subq = self.session.query(model.ArtworkRating) \
                 .filter_by(user=self.user) \
                 .subquery()
+            self._ad_hoc = True
+            self._cache_parts.append(('my_rating', self.user.id, rating_spec))
 
             if rating_spec == u'none':
                 # Filtering by NO rating is a little different.  Need to
@@ -203,36 +448,80 @@ class GallerySieve(object):
 
         self.order_by(form.sort.data)
         if form.sort.data == u'rating':
-            # Only allow the past 24 hours when sorting by absolute rating
-            self.filter_by_recency(timedelta(hours=24))
+            # Use the precomputed top list for the time radius, if possible;
+            # see _rank_by_leaderboard
+            self._leaderboard = form.time_radius.data
 
 
     ### Independent filter methods
 
     def filter_by_age(self, dt):
         """Find art uploaded at or before `dt`."""
+        self._ad_hoc = True
+        self._cache_parts.append(('age', dt.isoformat()))
         self.query = self.query.filter(model.Artwork.uploaded_time <= dt)
 
     def filter_by_recency(self, delta):
-        """Find art uploaded no earlier than `delta` before now."""
-        self.query = self.query.filter(
-            model.Artwork.uploaded_time >= model.now() - delta)
+        """Find art uploaded no earlier than `delta` before now.  The cutoff
+        is rounded down slightly, so the query doesn't change every second.
+        """
+        cutoff = _quantize(model.now() - delta, delta)
+        self._ad_hoc = True
+        self._cache_parts.append(('since', cutoff.isoformat()))
+        self.query = self.query.filter(model.Artwork.uploaded_time >= cutoff)
+
+    def filter_by_upload_range(self, start=None, end=None):
+        """Find art uploaded at or after `start` and before `end`.  Either may
+        be None to leave that end open.
+
+        Both bounds are on `uploaded_time`, so in upload order this is a single
+        range scan over its index, and keyset paging seeks within it.
+        """
+        self._ad_hoc = True
+        self._cache_parts.append(('between',
+            start and start.isoformat(), end and end.isoformat()))
+        if start is not None:
+            self.query = self.query.filter(model.Artwork.uploaded_time >= start)
+        if end is not None:
+            self.query = self.query.filter(model.Artwork.uploaded_time < end)
+
+    def filter_by_upload_window(self, center, radius):
+        """Find art uploaded no more than `radius` before or after `center`."""
+        self.filter_by_upload_range(center - radius, center + radius)
+
+    def _start_of_day(self, day):
+        """Returns midnight at the start of a date, in the user's timezone."""
+        tz = getattr(self.user, 'timezone', None) or pytz.utc
+        return tz.localize(datetime.combine(day, time()))
+
+    def filter_nothing(self):
+        """Find no art at all."""
+        self._ad_hoc = True
+        self._cache_parts.append(('nothing',))
+        # Artwork ids are never NULL
+        self.query = self.query.filter(model.Artwork.id == None)
 
     ### Tag filter methods
 
     def filter_by_user(self, rel, user):
         """Filter the gallery by a user relationship: by/for/of.
         """
-        self.query = self.query.filter(
+        self._filter_by_user_id(rel, user.id)
+
+    def _filter_by_user_id(self, rel, user_id):
+        self._count_keys.append(postings.user_key(rel, user_id))
+        self._cache_parts.append(('user', rel, user_id))
+        self._posting_filters.append((
+            postings.user_key(rel, user_id),
             model.Artwork.user_artwork.any(
                 relationship_type=rel,
-                user_id=user.id,
-            )
-        )
+                user_id=user_id,
+            ),
+        ))
 
     def filter_by_tag(self, tag):
-        """Filter the gallery by a named tag.  Special tags (e.g., by:foo) are
-        not allowed.
+        """Filter the gallery by a named tag, or any tag that implies it.
+        Special tags (e.g., by:foo) are not allowed.
         """
         if ' ' in tag:
             raise ValueError("Tags cannot contain spaces; is this a list of tags?")
@@ -242,87 +531,444 @@ class GallerySieve(object):
         # This will raise NoResultFound with a bogus tag -- as it should, since
         # this is called from our code, not directly on user input
         tag = self.session.query(model.Tag).filter_by(name=tag).one()
+        implying = tagrules.implying_tag_ids(self.session, [tag.id])
+        if tag.id in implying:
+            self._filter_by_implied_tag_id(tag.id, implying[tag.id])
+        else:
+            self._filter_by_tag_id(tag.id)
 
-        self.query = self.query.filter(
-            model.Artwork.tag_objs.any(id=tag.id)
-            )
+    def _filter_by_tag_id(self, tag_id):
+        self._tag_ids.append(tag_id)
+        self._count_keys.append(postings.tag_key(tag_id))
+        self._cache_parts.append(('tag', tag_id))
+        self._posting_filters.append((
+            postings.tag_key(tag_id),
+            model.Artwork.tag_objs.any(id=tag_id),
+        ))
+
+    def refinements(self, limit=REFINEMENT_COUNT):
+        """Returns the names of up to `limit` tags that often go with the ones
+        being filtered by, for narrowing things down further.  Needs the tag
+        co-occurrence index; without it, there are no suggestions.
+        """
+        if not self._tag_ids:
+            return []
+        index = cooccurrence.get_index()
+        if index is None:
+            return []
+
+        tag_ids = index.refinements(self._tag_ids, limit)
+        if not tag_ids:
+            return []
+        names = dict(self.session.query(model.Tag.id, model.Tag.name)
+            .filter(model.Tag.id.in_(tag_ids)))
+        return [names[tag_id] for tag_id in tag_ids if tag_id in names]
+
+    def _filter_by_implied_tag_id(self, tag_id, implying_ids):
+        """Filter by a tag or any of the tags that imply it.  The posting
+        index can take the union of their lists; no one cached count covers
+        it, though.
+        """
+        tag_ids = sorted(implying_ids | set([tag_id]))
+        keys = tuple(postings.tag_key(ident) for ident in tag_ids)
+        self._tag_ids.append(tag_id)
+        self._union_keys.append(keys)
+        self._cache_parts.append(('tag', tuple(tag_ids)))
+        self._posting_filters.append((
+            keys,
+            model.Artwork.id.in_(select([model.artwork_tags.c.artwork_id],
+                model.artwork_tags.c.tag_id.in_(tag_ids))),
+        ))
+
+    def _apply_posting_filters(self):
+        """Applies all the pending tag and user filters.  If the posting index
+        is available, they're intersected in memory and become a single IN
+        clause; otherwise, each becomes its own EXISTS clause.
+        """
+        filters, self._posting_filters = self._posting_filters, []
+        if not filters:
+            return
+
+        index = postings.get_index()
+        if index:
+            # None means there are too many to be worth decoding
+            ids = index.intersect([key for key, clause in filters],
+                MAX_POSTINGS_IDS)
+            if ids is not None:
+                if not ids:
+                    self.filter_nothing()
+                    return
+                elif len(ids) <= MAX_POSTINGS_IDS:
+                    self._posting_ids = ids
+                    self._posting_keys = set(key for key, clause in filters)
+                    self.query = self.query.filter(model.Artwork.id.in_(ids))
+                    return
+
+        for key, clause in filters:
+            self.query = self.query.filter(clause)
 
     def filter_by_tag_query(self, tag_query):
         """Filter by an arbitrary Boolean set of tags.  The query itself is a
-        string, which this method is responsible for parsing.
+        string; see `floof.lib.tagquery` for the syntax.
 
-        Current syntax is just a space-delimited list of tags.
+        Raises `TagQueryError` if the query is malformed or too expensive.
+        Names that don't exist are treated as matching nothing, and returned
+        as a list so the caller can complain about them.
         """
-        for tag in tag_query.split():
-            try:
-                if u':' in tag:
-                    rel, _, username = tag.partition(':')
-                    user = self.session.query(model.User).filter_by(name=username).one()
-                    self.filter_by_user(rel, user)
+        tree = tagquery.parse(tag_query)
+        tree, unknown = tagquery.resolve(self.session, tree)
+
+        if tree is tagquery.NOTHING:
+            self.filter_nothing()
+            return unknown
+        elif tree is tagquery.EVERYTHING:
+            return unknown
+
+        # Plain lists of tags can go through the posting index like any other
+        # tag filter; anything fancier is compiled to a single subquery
+        idents = tagquery.conjunction(tree)
+        if idents is not None:
+            for ident in idents:
+                if ident.rel is None:
+                    self._filter_by_tag_id(ident.id)
                 else:
-                    self.filter_by_tag(tag)
-            except NoResultFound:
-                # XXX ???
-                pass
+                    self._filter_by_user_id(ident.rel, ident.id)
+        else:
+            self._ad_hoc = True
+            self._cache_parts.append(('tagquery', tagquery.canonical(tree)))
+            self.query = self.query.filter(
+                model.Artwork.id.in_(tagquery.compile(tree)))
+
+        return unknown
 
     ### Special filter methods; only one of these can exist in a form at a time
 
     def filter_by_watches(self, user):
-        """Filter the gallery down to only things `user` is watching."""
+        """Filter the gallery down to only things `user` is watching.
+
+        This reads the materialized inbox maintained by floof.lib.watchstream,
+        rather than working out the watches on the fly.
+        """
         # XXX make this work for multiple users
-        self.query = self.query.filter(or_(
-            # Check for by/for/of watching
-            # XXX need an index on relationship_type, badly!
-            model.Artwork.id.in_(
-                self.session.query(model.UserArtwork.artwork_id)
-                    .join((model.UserWatch, model.UserArtwork.user_id == model.UserWatch.other_user_id))
-                    .filter(model.UserWatch.user_id == user.id)
-                    .filter(case(
-                        value=model.UserArtwork.relationship_type,
-                        whens={
-                            u'by': model.UserWatch.watch_by,
-                            u'for': model.UserWatch.watch_for,
-                            u'of': model.UserWatch.watch_of,
-                        },
-                    ))
-            ),
-            # Check for upload watching
-            model.Artwork.uploader_user_id.in_(
-                self.session.query(model.UserWatch.other_user_id)
-                    .filter(model.UserWatch.user_id == user.id)
-                    .filter(model.UserWatch.watch_upload == True)  # gross
-            ),
-        ))
+        self._ad_hoc = True
+        self._cache_parts.append(('watches', user.id))
+        self.query = self.query.join((model.WatchstreamEntry, and_(
+            model.WatchstreamEntry.artwork_id == model.Artwork.id,
+            model.WatchstreamEntry.user_id == user.id,
+        )))
+
+    def filter_by_friends_of_friends(self, user):
+        """Filter the gallery down to art by people that the people `user`
+        watches are watching, leaving out anyone `user` already watches.
+
+        The watch graph index (see floof.lib.indexes.watchgraph) turns this
+        into a single list of users, up to `MAX_FRIENDS_OF_FRIENDS` of them;
+        otherwise, it's a pair of nested subqueries on user_watches.
+        """
+        self._ad_hoc = True
+        self._cache_parts.append(('friends_of_friends', user.id))
+
+        user_artwork = model.UserArtwork.__table__
+        index = watchgraph.get_index()
+        user_ids = None
+        if index is not None:
+            user_ids = index.friends_of_friends(user.id)
+            if not user_ids:
+                self.filter_nothing()
+                return
+
+        if user_ids is not None and len(user_ids) <= MAX_FRIENDS_OF_FRIENDS:
+            by_them = user_artwork.c.user_id.in_(user_ids)
+        else:
+            watches = model.UserWatch.__table__
+            watched = select([watches.c.other_user_id],
+                watches.c.user_id == user.id)
+            their_watched = select([watches.c.other_user_id],
+                watches.c.user_id.in_(watched))
+            by_them = and_(
+                user_artwork.c.user_id.in_(their_watched),
+                ~user_artwork.c.user_id.in_(watched),
+                user_artwork.c.user_id != user.id,
+            )
+
+        self.query = self.query.filter(model.Artwork.id.in_(
+            select([user_artwork.c.artwork_id], and_(
+                user_artwork.c.relationship_type == u'by', by_them))))
 
     def filter_by_label(self, label):
         """Filter by a user's particular label.
 
         This method DOES NOT CHECK that the label is viewable; do that yourself.
         """
+        self._count_keys.append(counts.label_key(label.id))
+        self._cache_parts.append(('label', label.id))
         self.query = self.query.filter(
             model.Artwork.labels.any(id=label.id))
 
 
     def order_by(self, order):
         """Changes the sort order.  May be one of "uploaded_time", "rating",
-        "rating_count".
+        "rating_count", "trending", "suggest", "random".
 
-        The default is "uploaded_time".
+        The default is "uploaded_time".  "trending" is popularity with a
+        falloff for age; see `model.hot_score`.  "suggest" only works for a logged-in
+        user with a suggestion model built (see floof.lib.indexes.suggest);
+        otherwise it's the same as the default.  "random" is a single page
+        picked by `sample_ids`.
         """
-        self.temporal_column_name = None
-
-        if order == 'uploaded_time':
+        self._suggest_for = None
+        self._leaderboard = None
+        self._random = False
+        if order == 'random':
+            self._random = True
+            order_column = model.Artwork.uploaded_time
+        elif order == 'suggest':
+            # Candidates are fetched newest first, then ranked in Python
+            if self.user and suggest is not None:
+                self._suggest_for = self.user.id
+            order_column = model.Artwork.uploaded_time
+        elif order == 'uploaded_time':
             order_column = model.Artwork.uploaded_time
-            self.temporal_column_name = 'uploaded_time'
         elif order == 'rating':
             order_column = model.Artwork.rating_score
         elif order == 'rating_count':
             order_column = model.Artwork.rating_count
+        elif order == 'trending':
+            order_column = model.Artwork.hot_score
         else:
             raise ValueError("No such ordering {0}".format(order))
 
+        self._set_order_column(order_column)
+
+    def _rank_by_leaderboard(self):
+        """Swaps sorting by rating for a join to the precomputed leaderboard
+        for the form's time radius, when there is one and nothing but the time
+        radius is being filtered on.  The result is only the top
+        `leaderboards.LEADERBOARD_SIZE`, but it's an index scan no matter how
+        much art there is.
+
+        Otherwise, the artwork table is sorted directly, but only as far back
+        as `RATING_SORT_RADIUS`.
+        """
+        window = self._leaderboard
+        # A filtered gallery wants its own best art, not the site's
+        if any(part[0] != 'since' for part in self._cache_parts) \
+                or not leaderboards.is_built(self.session, window):
+            radius = TIME_RADII.get(window)
+            if radius is None or timedelta(**radius) > RATING_SORT_RADIUS:
+                self.filter_by_recency(RATING_SORT_RADIUS)
+                self.rating_sort_limited = True
+            return
+
+        self.query = self._join_leaderboard(self.query)
+        # The board only holds the top so many, so a cached count won't do
+        self._ad_hoc = True
+        self._cache_parts.append(('leaderboard', window))
+        # The pager seeks on whatever it's sorted by, which is this score and
+        # not the artwork's all-time one, so it goes on every row too
+        self._board_score = model.RatingLeaderboard.rating_score \
+            .label('leaderboard_score')
+        self._set_order_column(self._board_score)
+
+    def _join_leaderboard(self, query):
+        entry = model.RatingLeaderboard
+        return query.join((entry, and_(
+            entry.artwork_id == model.Artwork.id,
+            entry.window == self._leaderboard)))
+
+    @property
+    def ranked_by_leaderboard(self):
+        """Whether the results are cut off at the leaderboard's size.  Only
+        known once evaluated.
+        """
+        return self._board_score is not None
+
+    def _set_order_column(self, order_column):
+        """Sorts by `order_column`, then by id, both descending, with any NULLs
+        last.  Each ordering has a matching composite index on the artwork
+        table.
+        """
+        self.order_column = order_column
         self.query = self.query.order_by(None) \
-            .order_by(order_column.desc(), self.default_order_clause)
+            .order_by(*pager.KeysetPager.order_by(
+                order_column, self.id_column))
+
+
+    def _page_query(self, query):
+        """Returns `query`, altered to load what the current display mode
+        needs: either `ArtworkRow` columns or ORM objects with the right
+        relations.
+        """
+        if self.projection:
+            query = self._projection_query(query)
+        else:
+            query = query.options(*DISPLAY_LOADER_OPTIONS[self.display_mode])
+
+        if self._board_score is not None:
+            query = query.add_columns(self._board_score)
+        return query
+
+    def _make_row(self, row):
+        """Turns a result of `_page_query` into what the gallery shows: an
+        `ArtworkRow` or an `Artwork`, with the leaderboard score tacked on
+        when sorting by one.
+        """
+        if self._board_score is None:
+            if self.projection:
+                return _make_artwork_row(row)
+            return row
+
+        score = row[-1]
+        if self.projection:
+            return _make_artwork_row(row[:-1], leaderboard_score=score)
+        artwork = row[0]
+        artwork.leaderboard_score = score
+        return artwork
+
+    def _projection_query(self, query):
+        """Returns `query`, selecting only the columns needed to build
+        `ArtworkRow`s for the current display mode.
+        """
+        query = query.join(model.Artwork.uploader)
+        columns = _artwork_row_columns + _user_row_columns
+        if self.display_mode == u'detailed':
+            query = query.join(model.Artwork.resource) \
+                .join(model.Resource.discussion)
+            columns = columns + [model.Discussion.comment_count]
+
+        return query.with_entities(*columns)
+
+
+    def _cache_key(self, position):
+        """Builds the cache key for one page of this gallery.  It covers the
+        filters, the sort, the page's position, and the generation of every
+        scope the result depends on; see `invalidate_cache`.
+        """
+        scopes = set(['artwork'])
+        for part in self._cache_parts:
+            if part[0] in ('tag', 'tagquery'):
+                scopes.add('tags')
+            elif part[0] == 'my_rating':
+                scopes.add('ratings')
+            elif part[0] in ('watches', 'friends_of_friends'):
+                scopes.add('watches')
+        if self.order_column.key != 'uploaded_time':
+            scopes.add('ratings')
+
+        generations = _get_generations()
+        state = (
+            sorted(set(self._cache_parts)),
+            self.order_column.key,
+            position,
+            [(scope, _generation(generations, scope))
+                for scope in sorted(scopes)],
+        )
+        return hashlib.sha1(repr(state)).hexdigest()
+
+    def _fetch(self, query, position):
+        """Pager hook that caches the ids on each page.  Only the ids are
+        cached; on a hit, just those rows are loaded, by primary key.
+        """
+        cache = _get_cache()
+        if cache is None:
+            return query.all()
+
+        key = self._cache_key(position)
+        ids = cache.get(key, createfunc=lambda: [
+            artwork_id for (artwork_id,)
+            in query.with_entities(model.Artwork.id)])
+        return self._load_rows(ids)
+
+    def _load_rows(self, ids):
+        """Loads the page's rows for the given artwork ids, in that order."""
+        if not ids:
+            return []
+
+        query = self.session.query(model.Artwork) \
+            .filter(model.Artwork.id.in_(ids))
+        if self._board_score is not None:
+            query = self._join_leaderboard(query)
+        rows_by_id = dict((self._make_row(row).id, row)
+            for row in self._page_query(query))
+        # Anything that's vanished since is skipped
+        return [rows_by_id[artwork_id] for artwork_id in ids
+            if artwork_id in rows_by_id]
+
+    def _rank_suggestions(self):
+        """Returns the ids of the newest matching artworks, ordered by how
+        much the user is predicted to like them.  Returns None if there's no
+        model, or it knows nothing about the user.
+        """
+        index = suggest.get_index()
+        if index is None:
+            return None
+
+        ids = [artwork_id for (artwork_id,) in self.query
+            .with_entities(model.Artwork.id)
+            .limit(MAX_SUGGEST_CANDIDATES)]
+        scores = index.scores(self._suggest_for, ids)
+        if scores is None:
+            return None
+
+        # Sorting is stable, so ties stay newest first
+        ranked = sorted(xrange(len(ids)), key=lambda i: -scores[i])
+        return [ids[i] for i in ranked]
+
+    def sample_ids(self, count):
+        """Returns the ids of up to `count` matching artworks, picked at
+        random, without sorting the whole gallery by random().
+
+        A fixed number of candidates, `RANDOM_CANDIDATES`, are drawn at random:
+        from the ids the posting index found, if it has narrowed things down,
+        or else from the whole range of artwork ids.  A single query then keeps
+        whichever match the rest of the filters, by primary key.  That costs
+        the same however much art there is, but gaps in the ids and selective
+        filters the posting index doesn't cover may come up short.
+        """
+        self._apply_posting_filters()
+        if self._posting_ids is not None:
+            ids = list(self._posting_ids)
+            candidates = random.sample(ids, min(RANDOM_CANDIDATES, len(ids)))
+        else:
+            artwork = model.Artwork.__table__
+            lowest, highest = self.session.execute(
+                select([func.min(artwork.c.id), func.max(artwork.c.id)])
+            ).first()
+            if lowest is None:
+                return []
+            id_range = xrange(lowest, highest + 1)
+            candidates = random.sample(id_range,
+                min(RANDOM_CANDIDATES, len(id_range)))
+
+        if not candidates:
+            return []
+        matching = set(artwork_id for (artwork_id,) in self.query
+            .order_by(None)
+            .with_entities(model.Artwork.id)
+            .filter(model.Artwork.id.in_(candidates)))
+        return [artwork_id for artwork_id in candidates
+            if artwork_id in matching][:count]
+
+    def _item_count(self, query):
+        """Works out the size of the gallery without an unbounded COUNT.
+        Returns a tuple of the count and whether it's only an upper bound.
+        """
+        keys = set(self._count_keys) or set([counts.ALL_KEY])
+        if not self._ad_hoc:
+            if len(keys) == 1 and not self._union_keys:
+                key, = keys
+                return counts.get(self.session, key), False
+            elif self._posting_ids is not None and self._posting_keys \
+                    >= set(self._count_keys) | set(self._union_keys):
+                # The posting index already found everything
+                return len(self._posting_ids), False
+
+        count = query.order_by(None).limit(MAX_EXACT_COUNT + 1).count()
+        if count <= MAX_EXACT_COUNT:
+            return count, False
+
+        # Any of the filters alone matches at least as much as all of them
+        return min(counts.get(self.session, key) for key in keys), True
 
 
     ### The fruits of our labors
@@ -332,36 +978,67 @@ class GallerySieve(object):
 
         A word on how the paging works:
         - If the sieve is created with countable=True, you'll get a regular
-          numeric pager, regardless of anything else.
-        - If the sieve is created with countable=False, you'll get a numeric
-          pager that trails off at the end.
-        - If the sieve is created with countable=False AND is sorted by time
-          AND the user has gone back "too far", the "next" link will switch to
-          time-based paging instead.
+          numeric pager.  The total comes from the cached counts in
+          floof.lib.counts where possible; see `_item_count`.
+        - If the sieve is created with countable=False, you'll get a keyset
+          pager, which seeks on the sort column and artwork id.  It can't show
+          a list of pages, but any page is as cheap to fetch as the first.
+        - Suggestion order always gets a numeric pager over a ranked list of
+          the newest `MAX_SUGGEST_CANDIDATES` artworks.
+        - Random order gets a `SamplePager`: one page of `sample_ids`, which
+          is never cached.
+
+        Whatever relations the current display mode needs are loaded along
+        with the page; see `DISPLAY_LOADER_OPTIONS`.  With `projection` on,
+        they're joined into a single flat SELECT instead.
+
+        If the 'gallery' cache region is configured, the ids on each page are
+        cached; see `_fetch`.
         """
+        if self._leaderboard is not None:
+            self._rank_by_leaderboard()
+        self._apply_posting_filters()
+
+        if self._random:
+            items = [self._make_row(row)
+                for row in self._load_rows(self.sample_ids(PAGE_SIZE))]
+            return pager.SamplePager(items, formdata=self.original_formdata)
+
+        query = self._page_query(self.query)
         common_kw = dict(
-            query=self.query,
+            query=query,
             page_size=PAGE_SIZE,
             formdata=self.original_formdata,
+            row_factory=self._make_row,
+            fetch=self._fetch,
         )
 
-        if self.countable:
+        ranked = None
+        if self._suggest_for is not None:
+            ranked = self._rank_suggestions()
+        if ranked is not None:
+            # The pager just slices the ranked list
+            def fetch(query, position):
+                _, skip, page_size = position
+                return self._load_rows(ranked[skip:skip + page_size + 1])
+
+            common_kw['fetch'] = fetch
+            return pager.DiscretePager(
+                countable=self.countable,
+                item_count=len(ranked),
+                **common_kw
+            )
+        elif self.countable:
+            item_count, is_estimate = self._item_count(query)
             return pager.DiscretePager(
                 countable=True,
+                item_count=item_count,
+                item_count_is_estimate=is_estimate,
                 **common_kw
             )
         else:
-            # Only use temporal paging if we actually can, AND if the formdata
-            # has a timeskip key already
-            if self.temporal_column_name and \
-                'timeskip' in self.original_formdata:
-
-                return pager.TemporalPager(
-                    column_name='uploaded_time',
-                    **common_kw
-                )
-
-            return pager.DiscretePager(
-                countable=False,
+            return pager.KeysetPager(
+                order_column=self.order_column,
+                id_column=self.id_column,
                 **common_kw
             )
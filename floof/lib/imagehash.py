@@ -0,0 +1,195 @@
+"""Perceptual hashing, for noticing when an upload is a repost of something
+we already have.
+
+`Artwork.hash` only catches byte-identical files.  Instead, each image gets a
+64-bit *difference hash*: shrink it to 9x8 greyscale pixels and record
+whether each pixel is brighter than its right-hand neighbour.  Re-encoding,
+resizing, and small edits barely move it, so near-duplicates are images whose
+hashes differ in only a few bits.
+
+Hashes are stored in `MediaImage.dhash` as 16 hex digits.  Each worker keeps
+them all in a BK-tree, which finds everything within a small Hamming distance
+without comparing against every image; it's filled in lazily and picks up new
+uploads by id.
+"""
+from __future__ import absolute_import
+
+from contextlib import closing
+import logging
+import multiprocessing
+import threading
+
+try:
+    import Image
+except ImportError:
+    from PIL import Image
+
+from floof import model
+from floof.lib import thumbnails
+
+log = logging.getLogger(__name__)
+
+HASH_WIDTH = 8
+HASH_HEIGHT = 8
+# Hashes this many bits apart or fewer are reported as likely duplicates
+MAX_DISTANCE = 6
+
+
+def dhash(image):
+    """Returns the difference hash of a PIL image, as an int.
+
+    If `image` hasn't been loaded yet, JPEGs are decoded in greyscale at a
+    fraction of their size, which is plenty for 9x8 pixels; that changes the
+    image's mode and size, so pass a freshly opened copy if those matter.
+    """
+    image.draft('L', (HASH_WIDTH * 8, HASH_HEIGHT * 8))
+    # Shrinking first means PIL does nearly all the work in C
+    small = image.convert('L').resize(
+        (HASH_WIDTH + 1, HASH_HEIGHT), Image.ANTIALIAS)
+    pixels = list(small.getdata())
+
+    value = 0
+    for row in xrange(HASH_HEIGHT):
+        start = row * (HASH_WIDTH + 1)
+        for col in xrange(start, start + HASH_WIDTH):
+            value = (value << 1) | (pixels[col] > pixels[col + 1])
+    return value
+
+def hash_file(settings, path):
+    """Returns the difference hash of the image file at `path`.  Only JPEGs
+    can be decoded small, so uploads run this on the thumbnail pool, out of
+    the web process; see `floof.lib.thumbnails.run`.
+    """
+    return dhash(Image.open(path))
+
+def to_hex(value):
+    return u'{0:016x}'.format(value)
+
+def from_hex(text):
+    return int(text, 16)
+
+def distance(a, b):
+    """Returns the Hamming distance between two hashes."""
+    return bin(a ^ b).count('1')
+
+
+class BKTree(object):
+    """A Burkhard-Keller tree over hashes, keyed by Hamming distance.
+
+    Each node's children are keyed by their distance from it, so by the
+    triangle inequality a search within `radius` of some hash only needs to
+    descend into children whose key is within `radius` of the node's own
+    distance.  Several items with the same hash share a node.
+    """
+
+    def __init__(self):
+        self.root = None
+        self.size = 0
+
+    def add(self, value, item):
+        self.size += 1
+        if self.root is None:
+            self.root = (value, [item], {})
+            return
+
+        node = self.root
+        while True:
+            node_value, items, children = node
+            d = distance(value, node_value)
+            if d == 0:
+                items.append(item)
+                return
+            if d not in children:
+                children[d] = (value, [item], {})
+                return
+            node = children[d]
+
+    def search(self, value, radius):
+        """Returns a list of (distance, item) for every item within `radius`
+        of `value`, closest first.
+        """
+        found = []
+        pending = [self.root] if self.root is not None else []
+        while pending:
+            node_value, items, children = pending.pop()
+            d = distance(value, node_value)
+            if d <= radius:
+                found.extend((d, item) for item in items)
+            for child_distance, child in children.iteritems():
+                if d - radius <= child_distance <= d + radius:
+                    pending.append(child)
+
+        found.sort()
+        return found
+
+
+_tree = BKTree()
+_tree_last_id = 0
+_tree_lock = threading.Lock()
+
+def _refresh(session):
+    """Adds any images hashed since the last call to this worker's tree."""
+    global _tree_last_id
+
+    with _tree_lock:
+        rows = session.query(model.MediaImage.id, model.MediaImage.dhash) \
+            .filter(model.MediaImage.id > _tree_last_id) \
+            .filter(model.MediaImage.dhash != None) \
+            .order_by(model.MediaImage.id) \
+            .all()
+        for artwork_id, hex_hash in rows:
+            _tree.add(from_hex(hex_hash), artwork_id)
+            _tree_last_id = artwork_id
+
+def find_similar(session, value, radius=MAX_DISTANCE):
+    """Returns the ids of existing images whose hash is within `radius` of
+    `value`, closest first.
+
+    Images hashed by the backfill after this worker has seen newer uploads are
+    missed until it restarts.
+    """
+    _refresh(session)
+    return [artwork_id for d, artwork_id in _tree.search(value, radius)]
+
+
+### Backfill
+
+def _hash_url(job):
+    artwork_id, url = job
+    try:
+        with closing(thumbnails.fetch(url)) as original:
+            image = Image.open(original)
+            if thumbnails.too_many_pixels(image):
+                return artwork_id, None
+            return artwork_id, dhash(image)
+    except IOError:
+        # Includes URLError, and PIL not understanding the file
+        return artwork_id, None
+
+def backfill(session, storage, processes=None):
+    """Hashes every image that doesn't have a hash yet, fetching them from
+    `storage` across a pool of `processes` processes (by default, one per
+    CPU).
+    """
+    jobs = []
+    for artwork_id, file_hash in session.query(
+            model.MediaImage.id, model.MediaImage.hash) \
+            .filter(model.MediaImage.dhash == None):
+        url = storage.url(u'artwork', file_hash)
+        if url is None:
+            log.warning("Artwork {0} is missing from storage".format(artwork_id))
+            continue
+        jobs.append((artwork_id, url))
+
+    pool = multiprocessing.Pool(processes)
+    try:
+        for artwork_id, value in pool.imap_unordered(_hash_url, jobs, 16):
+            if value is None:
+                log.warning("Couldn't hash artwork {0}".format(artwork_id))
+                continue
+            session.query(model.MediaImage) \
+                .filter_by(id=artwork_id) \
+                .update({'dhash': to_hex(value)}, synchronize_session=False)
+    finally:
+        pool.close()
+        pool.join()
@@ -0,0 +1,260 @@
+"""Precomputed, read-mostly indexes kept in files shared by every worker
+process.
+
+Each index is rebuilt wholesale by an offline job (see bin/floof-batch.py) and
+written out as a new *generation*: a read-only base file, ``name.G``, plus an
+append-only journal, ``name.G.journal``.  Workers memory-map the base file, so
+the OS page cache holds a single copy no matter how many processes read it.
+Changes made between rebuilds are appended to the journal once their
+transaction commits, and every worker replays whatever it hasn't seen yet
+before using the index.
+
+The journal for a new generation is created *before* the rebuild reads the
+database, and writers always append to the newest journal, so no change can
+fall between the snapshot and the journal.  Some changes may appear in both;
+journal entries must therefore be idempotent.
+
+Indexes are disabled entirely unless the `index.directory` setting is given,
+in which case everything here quietly does nothing and callers should fall
+back to asking the database.
+"""
+from __future__ import absolute_import
+
+import errno
+import logging
+import mmap
+import os
+import re
+import struct
+import tempfile
+
+import transaction
+
+log = logging.getLogger(__name__)
+
+_directory = None
+
+def configure(settings):
+    """Points the indexes at the directory named by the `index.directory`
+    setting, creating it if necessary.  Call once at startup.
+    """
+    global _directory
+
+    directory = settings.get('index.directory')
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory)
+    _directory = directory
+
+def enabled():
+    return _directory is not None
+
+
+### Generations
+
+def _generation_path(name, generation):
+    return os.path.join(_directory, '{0}.{1:d}'.format(name, generation))
+
+def _journal_path(name, generation):
+    return _generation_path(name, generation) + '.journal'
+
+def current_generation(name):
+    """Returns the newest generation number for which there's a journal, or
+    None if the index has never been built.
+    """
+    pattern = re.compile(r'^{0}\.(\d+)\.journal$'.format(re.escape(name)))
+    generations = []
+    for filename in os.listdir(_directory):
+        match = pattern.match(filename)
+        if match:
+            generations.append(int(match.group(1)))
+
+    if not generations:
+        return None
+    return max(generations)
+
+def begin_rebuild(name):
+    """Starts a new generation of the named index by creating its (empty)
+    journal.  Returns the new generation number, to be passed to
+    `finish_rebuild` once the base file has been computed.
+
+    This MUST be called before reading anything from the database.
+    """
+    if not enabled():
+        raise RuntimeError("Can't build indexes without index.directory")
+
+    generation = (current_generation(name) or 0) + 1
+    open(_journal_path(name, generation), 'ab').close()
+    return generation
+
+def finish_rebuild(name, generation, chunks):
+    """Atomically writes out the base file for `generation`, whose contents
+    are the byte strings in `chunks`.  Generations older than the previous
+    one are deleted; workers still mapping them are unaffected.
+    """
+    fd, temppath = tempfile.mkstemp(dir=_directory, prefix='.' + name)
+    with os.fdopen(fd, 'wb') as f:
+        for chunk in chunks:
+            f.write(chunk)
+    os.rename(temppath, _generation_path(name, generation))
+
+    for old in range(1, generation - 1):
+        for path in (_generation_path(name, old), _journal_path(name, old)):
+            try:
+                os.remove(path)
+            except OSError as e:
+                if e.errno != errno.ENOENT:
+                    raise
+
+
+### Journal
+
+def append_journal(name, lines):
+    """Appends `lines` (byte strings, without newlines) to the newest journal
+    of the named index.  Does nothing if the index has never been built.
+    """
+    if not enabled() or not lines:
+        return
+
+    generation = current_generation(name)
+    if generation is None:
+        return
+
+    # A single O_APPEND write keeps concurrent writers from interleaving
+    data = ''.join(line + '\n' for line in lines)
+    fd = os.open(_journal_path(name, generation),
+        os.O_WRONLY | os.O_APPEND | os.O_CREAT)
+    try:
+        os.write(fd, data)
+    finally:
+        os.close(fd)
+
+def append_journal_after_commit(name, lines):
+    """Arranges for `lines` to be appended to the named index's journal if and
+    only if the current transaction commits successfully.
+    """
+    if not enabled() or not lines:
+        return
+
+    def hook(success):
+        if not success:
+            return
+        try:
+            append_journal(name, lines)
+        except (IOError, OSError):
+            # The next rebuild will catch up; don't blow up a finished request
+            log.exception("Failed to append to the {0} journal".format(name))
+
+    transaction.get().addAfterCommitHook(hook)
+
+
+### Reading
+
+_uint = struct.Struct('<I')
+
+class MappedInts(object):
+    """A read-only array of little-endian unsigned 32-bit ints in a memory
+    mapping, starting at `offset`.  Indexing and `bisect` read straight from
+    the mapping, so it isn't copied into every worker.
+    """
+
+    def __init__(self, mapping, offset, count):
+        self.mapping = mapping
+        self.offset = offset
+        self.count = count
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, i):
+        return _uint.unpack_from(self.mapping, self.offset + 4 * i)[0]
+
+    def slice(self, start, stop):
+        """Returns a tuple of the ints from `start` up to `stop`."""
+        return struct.unpack_from('<{0:d}I'.format(stop - start),
+            self.mapping, self.offset + 4 * start)
+
+    @property
+    def end(self):
+        """The offset just past the last int."""
+        return self.offset + 4 * self.count
+
+    @staticmethod
+    def pack(ints):
+        """Returns the bytes for a sequence of ints, for writing out."""
+        return struct.pack('<{0:d}I'.format(len(ints)), *ints)
+
+
+class MappedIndex(object):
+    """Base class for a worker's view of a shared index.
+
+    Subclasses set `name` and implement `_load`, which is given the
+    memory-mapped base file (or None if it's empty) and should reset any
+    in-memory state, and `_apply`, which is given each journal line in order.
+    Call `refresh` before each use; it's cheap when nothing has changed.
+    """
+
+    name = None
+
+    def __init__(self):
+        self.generation = None
+        # Generations are only numbered within a directory
+        self.directory = None
+        self._mapping = None
+        self._journal_offset = 0
+
+    @property
+    def loaded(self):
+        return self.generation is not None
+
+    def refresh(self):
+        """Picks up a new generation if one has been built, then replays any
+        new journal lines.  Returns True if the index is usable.
+        """
+        if not enabled():
+            return False
+
+        generation = current_generation(self.name)
+        if generation is None:
+            return False
+
+        if generation != self.generation or _directory != self.directory:
+            if not os.path.exists(_generation_path(self.name, generation)):
+                # Still being built; keep using what we have
+                return self.loaded
+            self._open(generation)
+
+        self._replay()
+        return True
+
+    def _open(self, generation):
+        with open(_generation_path(self.name, generation), 'rb') as f:
+            if os.fstat(f.fileno()).st_size:
+                mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            else:
+                mapping = None
+
+        # The old mapping isn't closed explicitly: arrays or buffers taken from
+        # it may still be in use, and it goes away with the last reference
+        self._mapping = mapping
+        self.generation = generation
+        self.directory = _directory
+        self._journal_offset = 0
+        self._load(mapping)
+
+    def _replay(self):
+        with open(_journal_path(self.name, self.generation), 'rb') as f:
+            f.seek(self._journal_offset)
+            data = f.read()
+
+        # Only consume complete lines; a writer might be mid-append
+        end = data.rfind('\n') + 1
+        for line in data[:end].splitlines():
+            if line:
+                self._apply(line)
+        self._journal_offset += end
+
+    def _load(self, mapping):
+        raise NotImplementedError
+
+    def _apply(self, line):
+        raise NotImplementedError
@@ -0,0 +1,210 @@
+"""Which tags tend to go together, for "related tags" and for suggesting ways
+to narrow down a tag search.
+
+The tag-by-tag co-occurrence matrix -- how many artworks have both of each
+pair of tags -- is a self-join of artwork_tags, far too slow to run per page
+view.  Instead the rebuild-tag-cooccurrence batch job counts every pair at
+once with NumPy and keeps the `RELATED_PER_TAG` strongest partners of each
+tag, ranked by Jaccard similarity (artworks with both tags over artworks with
+either) so that ubiquitous tags don't crowd out everything else.
+
+The base file is laid out as:
+
+- the magic string ``FLCO1\\n``
+- a header: number of tags, number of related pairs kept
+- the sorted ids of every tag in use
+- for each of those, the offset of their first related tag; plus one final
+  offset for the end
+- every related tag's id, grouped by tag and strongest first within each group
+- for each of those, the number of artworks with both tags
+
+All numbers are little-endian unsigned 32-bit ints, the same as NumPy's
+``<u4``; reading the file doesn't need NumPy, but building it does.  Tagging
+between rebuilds isn't journaled, since a few stale pairs barely matter here.
+"""
+from __future__ import absolute_import
+
+from bisect import bisect_left
+from collections import defaultdict
+import struct
+
+from floof import model
+from floof.lib import indexes
+
+NAME = 'cooccurrence'
+MAGIC = 'FLCO1\n'
+_header = struct.Struct('<2I')
+
+RELATED_PER_TAG = 50
+# Roughly this many pairs are counted at a time, to bound the size of the
+# temporary arrays
+CHUNK_SIZE = 1 << 20
+
+
+class CooccurrenceIndex(indexes.MappedIndex):
+    """A worker's view of the co-occurrence matrix.  Use the module-level
+    `get_index` rather than constructing this yourself.
+    """
+
+    name = NAME
+
+    def _load(self, mapping):
+        self._tag_ids = None
+        self._offsets = self._related = self._together = None
+
+        if mapping is None:
+            return
+        if mapping[0:len(MAGIC)] != MAGIC:
+            raise ValueError("{0} is not a co-occurrence matrix".format(NAME))
+
+        tag_count, pair_count = _header.unpack_from(mapping, len(MAGIC))
+        ints = indexes.MappedInts
+        self._tag_ids = ints(mapping, len(MAGIC) + _header.size, tag_count)
+        self._offsets = ints(mapping, self._tag_ids.end, tag_count + 1)
+        self._related = ints(mapping, self._offsets.end, pair_count)
+        self._together = ints(mapping, self._related.end, pair_count)
+
+    def _apply(self, line):
+        pass
+
+    def related(self, tag_id, limit=10):
+        """Returns up to `limit` (tag id, number of artworks with both tags)
+        pairs for the tags most often seen with `tag_id`, strongest first.
+        """
+        if self._tag_ids is None:
+            return []
+        pos = bisect_left(self._tag_ids, tag_id)
+        if pos >= len(self._tag_ids) or self._tag_ids[pos] != tag_id:
+            return []
+
+        start, stop = self._offsets.slice(pos, pos + 2)
+        stop = min(stop, start + limit)
+        return zip(self._related.slice(start, stop),
+            self._together.slice(start, stop))
+
+    def refinements(self, tag_ids, limit=10):
+        """Returns up to `limit` ids of tags that would usefully narrow down a
+        search for all of `tag_ids`: those related to the most of them, then
+        those that co-occur with them most often.
+        """
+        tag_ids = set(tag_ids)
+        hits = defaultdict(int)
+        together = defaultdict(int)
+        for tag_id in tag_ids:
+            for other_id, count in self.related(tag_id, RELATED_PER_TAG):
+                if other_id not in tag_ids:
+                    hits[other_id] += 1
+                    together[other_id] += count
+
+        ranked = sorted(hits,
+            key=lambda other_id: (-hits[other_id], -together[other_id],
+                other_id))
+        return ranked[:limit]
+
+
+_index = CooccurrenceIndex()
+
+def get_index():
+    """Returns the current worker's co-occurrence matrix, or None if there
+    isn't one available.
+    """
+    if _index.refresh() and _index._tag_ids is not None:
+        return _index
+    return None
+
+
+### Building
+
+def count_pairs(artwork_col, tag_col, tag_count):
+    """Counts how many artworks have each pair of tags.  `artwork_col` and
+    `tag_col` are parallel arrays of artwork-tag rows, sorted by artwork, with
+    tags numbered from zero to `tag_count`.
+
+    Returns parallel arrays of (first tag, second tag, count), for every pair
+    of distinct tags that appear together at all, sorted by first tag.
+    """
+    import numpy
+
+    # Each artwork's tags are a contiguous run of rows; pairing every row
+    # with every row in its run makes size ** 2 pairs per run
+    starts = numpy.flatnonzero(
+        numpy.r_[True, artwork_col[1:] != artwork_col[:-1]])
+    sizes = numpy.diff(numpy.r_[starts, len(artwork_col)])
+    pair_totals = numpy.cumsum(sizes ** 2)
+
+    keys = []
+    run = 0
+    while run < len(starts):
+        # A chunk of runs, but always at least one, however big
+        done = pair_totals[run - 1] if run else 0
+        stop = max(run + 1,
+            numpy.searchsorted(pair_totals, done + CHUNK_SIZE, 'right'))
+        run_starts, run_sizes = starts[run:stop], sizes[run:stop]
+        run = stop
+
+        # For each row: its run's start and size
+        row_starts = numpy.repeat(run_starts, run_sizes)
+        row_sizes = numpy.repeat(run_sizes, run_sizes)
+        rows = numpy.arange(run_starts[0], run_starts[-1] + run_sizes[-1])
+
+        # Row i is repeated once per row in its run, and paired with each
+        left = numpy.repeat(rows, row_sizes)
+        nth = numpy.arange(len(left)) - numpy.repeat(
+            numpy.cumsum(row_sizes) - row_sizes, row_sizes)
+        right = numpy.repeat(row_starts, row_sizes) + nth
+
+        distinct = left != right
+        keys.append(tag_col[left[distinct]].astype(numpy.int64) * tag_count
+            + tag_col[right[distinct]])
+
+    if keys:
+        keys, counts = numpy.unique(numpy.concatenate(keys),
+            return_counts=True)
+    else:
+        keys = numpy.zeros(0, dtype=numpy.int64)
+        counts = numpy.zeros(0, dtype=numpy.int64)
+    return keys // tag_count, keys % tag_count, counts
+
+def rebuild(session):
+    """Recounts the whole matrix.  Needs NumPy."""
+    import numpy
+
+    generation = indexes.begin_rebuild(NAME)
+
+    table = model.artwork_tags
+    rows = session.execute(
+        table.select().order_by(table.c.artwork_id, table.c.tag_id)) \
+        .fetchall()
+    if rows:
+        artwork_col, tag_col = (numpy.array(col) for col in zip(*[
+            (row.artwork_id, row.tag_id) for row in rows]))
+    else:
+        artwork_col = tag_col = numpy.zeros(0, dtype=numpy.int64)
+
+    tag_ids, tag_idx = numpy.unique(tag_col, return_inverse=True)
+    tag_count = len(tag_ids)
+    usage = numpy.bincount(tag_idx, minlength=tag_count)
+
+    first, second, together = count_pairs(artwork_col, tag_idx, tag_count)
+
+    # Strongest first within each tag, then keep the top few
+    jaccard = together / (usage[first] + usage[second] - together
+        ).astype(numpy.float64)
+    order = numpy.lexsort((second, -jaccard, first))
+    first, second, together = first[order], second[order], together[order]
+
+    group_starts = numpy.searchsorted(first, numpy.arange(tag_count))
+    rank = numpy.arange(len(first)) - group_starts[first]
+    kept = rank < RELATED_PER_TAG
+    first, second, together = first[kept], second[kept], together[kept]
+    offsets = numpy.searchsorted(first, numpy.arange(tag_count + 1))
+
+    uint = numpy.dtype('<u4')
+    indexes.finish_rebuild(NAME, generation, [
+        MAGIC,
+        _header.pack(tag_count, len(first)),
+        tag_ids.astype(uint).tostring(),
+        offsets.astype(uint).tostring(),
+        tag_ids[second].astype(uint).tostring(),
+        together.astype(uint).tostring(),
+    ])
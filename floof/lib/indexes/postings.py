@@ -0,0 +1,216 @@
+"""Posting lists mapping each tag and each by/for/of user to the ids of the
+artwork they apply to.
+
+`GallerySieve` uses this to intersect tag and user filters in memory, before
+the database ever sees them.  Keys look like ``tag:12`` or ``by:3``.
+
+The base file is laid out as:
+
+- the magic string ``FLPL1\\n``
+- a key table: one ``key count offset length\\n`` line per key, ending with a
+  blank line
+- the posting lists themselves.  Each is a sorted list of ids, stored as the
+  differences between successive ids, each encoded as a base-128 varint.
+  Dense tags compress to about one byte per artwork.
+"""
+from __future__ import absolute_import
+
+from array import array
+
+from floof import model
+from floof.lib import indexes
+
+NAME = 'postings'
+MAGIC = 'FLPL1\n'
+
+def encode_sorted(ids):
+    """Delta- and varint-encodes a sorted sequence of non-negative ints."""
+    out = bytearray()
+    previous = 0
+    for id in ids:
+        delta = id - previous
+        previous = id
+        while delta >= 0x80:
+            out.append((delta & 0x7f) | 0x80)
+            delta >>= 7
+        out.append(delta)
+    return str(out)
+
+def decode_sorted(data):
+    """Reverses `encode_sorted`, returning an array of ints."""
+    ids = array('L')
+    current = 0
+    delta = 0
+    shift = 0
+    for byte in bytearray(data):
+        delta |= (byte & 0x7f) << shift
+        if byte & 0x80:
+            shift += 7
+        else:
+            current += delta
+            ids.append(current)
+            delta = 0
+            shift = 0
+    return ids
+
+
+def tag_key(tag_id):
+    return 'tag:{0:d}'.format(tag_id)
+
+def user_key(relationship_type, user_id):
+    return '{0}:{1:d}'.format(relationship_type, user_id)
+
+
+class PostingsIndex(indexes.MappedIndex):
+    """A worker's view of the posting lists.  Use the module-level
+    `get_index` rather than constructing this yourself.
+    """
+
+    name = NAME
+
+    def _load(self, mapping):
+        self._table = {}
+        self._added = {}
+        self._removed = {}
+
+        if mapping is None:
+            return
+        if mapping[0:len(MAGIC)] != MAGIC:
+            raise ValueError("{0} is not a posting list file".format(NAME))
+
+        pos = len(MAGIC)
+        while True:
+            end = mapping.find('\n', pos)
+            line = mapping[pos:end]
+            pos = end + 1
+            if not line:
+                break
+
+            key, count, offset, length = line.split(' ')
+            self._table[key] = (int(count), int(offset), int(length))
+
+        self._data_start = pos
+
+    def _apply(self, line):
+        op, key, id = line.split(' ')
+        id = int(id)
+        if op == '+':
+            self._added.setdefault(key, set()).add(id)
+            self._removed.get(key, set()).discard(id)
+        elif op == '-':
+            self._removed.setdefault(key, set()).add(id)
+            self._added.get(key, set()).discard(id)
+
+    def estimate(self, key):
+        """Returns roughly how many ids are under `key`, without decoding."""
+        count = self._table.get(key, (0, 0, 0))[0]
+        return count + len(self._added.get(key, ()))
+
+    def get(self, key):
+        """Returns the set of artwork ids under `key`."""
+        ids = set()
+        if key in self._table:
+            count, offset, length = self._table[key]
+            start = self._data_start + offset
+            ids.update(decode_sorted(self._mapping[start:start + length]))
+
+        ids.update(self._added.get(key, ()))
+        ids.difference_update(self._removed.get(key, ()))
+        return ids
+
+    def union(self, keys):
+        """Returns the set of artwork ids present under any of `keys`."""
+        ids = set()
+        for key in keys:
+            ids |= self.get(key)
+        return ids
+
+    def intersect(self, keys, limit=None):
+        """Returns the set of artwork ids present under every one of `keys`.
+        Any of `keys` may instead be a tuple of keys, which stands for the ids
+        under any of them.  Starts from the smallest list, so a rare tag keeps
+        this cheap.
+
+        If even the smallest list has more than `limit` ids, returns None
+        without decoding anything, since the caller can't use that many.
+        """
+        terms = [key if isinstance(key, tuple) else (key,) for key in keys]
+        estimates = dict((term, sum(self.estimate(key) for key in term))
+            for term in terms)
+        terms.sort(key=estimates.get)
+        if limit is not None and terms and estimates[terms[0]] > limit:
+            return None
+
+        result = None
+        for term in terms:
+            ids = self.union(term)
+            if result is None:
+                result = ids
+            else:
+                result &= ids
+            if not result:
+                break
+
+        return result or set()
+
+
+_index = PostingsIndex()
+
+def get_index():
+    """Returns the current worker's posting index, or None if there isn't one
+    available.
+    """
+    if _index.refresh():
+        return _index
+    return None
+
+
+### Maintenance
+
+def artwork_keys(artwork):
+    """Returns every posting key that should contain `artwork`.  The artwork's
+    tags and users must already have been flushed.
+    """
+    keys = [tag_key(tag.id) for tag in artwork.tag_objs]
+    keys.extend(user_key(user_artwork.relationship_type, user_artwork.user_id)
+        for user_artwork in artwork.user_artwork)
+    return keys
+
+def record_changes(artwork_id, added_keys=(), removed_keys=()):
+    """Journals changes to an artwork's tags or users, once the current
+    transaction commits.
+    """
+    lines = ['+ {0} {1:d}'.format(key, artwork_id) for key in added_keys]
+    lines.extend('- {0} {1:d}'.format(key, artwork_id)
+        for key in removed_keys)
+    indexes.append_journal_after_commit(NAME, lines)
+
+def rebuild(session):
+    """Rebuilds the posting lists from scratch."""
+    generation = indexes.begin_rebuild(NAME)
+
+    postings = {}
+    for artwork_id, tag_id in session.query(
+            model.artwork_tags.c.artwork_id, model.artwork_tags.c.tag_id):
+        postings.setdefault(tag_key(tag_id), []).append(artwork_id)
+
+    for artwork_id, user_id, relationship_type in session.query(
+            model.UserArtwork.artwork_id,
+            model.UserArtwork.user_id,
+            model.UserArtwork.relationship_type):
+        postings.setdefault(user_key(relationship_type, user_id), []) \
+            .append(artwork_id)
+
+    table = []
+    blobs = []
+    offset = 0
+    for key in sorted(postings):
+        ids = sorted(postings[key])
+        blob = encode_sorted(ids)
+        table.append('{0} {1:d} {2:d} {3:d}\n'.format(
+            key, len(ids), offset, len(blob)))
+        blobs.append(blob)
+        offset += len(blob)
+
+    indexes.finish_rebuild(NAME, generation,
+        [MAGIC] + table + ['\n'] + blobs)
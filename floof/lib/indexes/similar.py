@@ -0,0 +1,296 @@
+"""Precomputed "art like this": each artwork's nearest neighbours by the
+overlap of their tags and credited users.
+
+Every artwork's set of posting keys (see `floof.lib.indexes.postings`) is
+boiled down to a MinHash signature, whose entries agree between two artworks
+with probability equal to the Jaccard similarity of their sets.  Signatures
+are cut into bands, and artworks sharing any band land in the same LSH
+bucket; only artworks sharing a bucket are ever compared.
+
+The rebuild-similar batch job finds the top `NEIGHBOURS` for every artwork
+this way.  Tag changes and uploads made since are journaled with the
+artwork's new keys, and a worker answering for an affected artwork re-ranks
+using the current signatures, so nothing is shown as similar that no longer
+is.  `SimilarIndex.built` and `SimilarIndex.pending` say how stale the rest
+is.
+
+The base file is laid out as:
+
+- the magic string ``FLSIM1\\n``
+- a header: neighbours per artwork, number of artworks, build time as a Unix
+  timestamp, number of bucket entries
+- the sorted artwork ids
+- each artwork's neighbour ids, best first, padded with zeroes
+- each artwork's signature
+- the bucket entries: every (band hash, artwork id) pair, sorted, as two
+  parallel arrays
+
+All numbers are little-endian unsigned 32-bit ints.
+"""
+from __future__ import absolute_import
+
+from bisect import bisect_left, bisect_right
+import datetime
+import heapq
+import random
+import struct
+import time
+import zlib
+
+import pytz
+
+from floof import model
+from floof.lib import indexes
+from floof.lib.indexes import postings
+
+NAME = 'similar'
+MAGIC = 'FLSIM1\n'
+_header = struct.Struct('<4I')
+
+NEIGHBOURS = 12
+BANDS = 16
+ROWS = 2
+NUM_HASHES = BANDS * ROWS
+# Only this many of the artworks nearest in upload order are compared from
+# any one bucket, so a tag on half the site doesn't make the job quadratic
+MAX_BUCKET = 100
+
+# Largest prime below 2**32
+_PRIME = 4294967291
+
+def _permutations():
+    # Seeded, so that every process agrees on what a signature is
+    rng = random.Random(0x5eed)
+    return [(rng.randrange(1, _PRIME), rng.randrange(_PRIME))
+        for i in range(NUM_HASHES)]
+
+_PERMUTATIONS = _permutations()
+
+
+def signature(keys):
+    """Returns the MinHash signature of a set of keys, or None if it's empty."""
+    hashes = [zlib.crc32(key) & 0xffffffff for key in keys]
+    if not hashes:
+        return None
+    return tuple(min((a * h + b) % _PRIME for h in hashes)
+        for a, b in _PERMUTATIONS)
+
+def band_hashes(sig):
+    """Returns the LSH bucket of each band of a signature."""
+    band_struct = struct.Struct('<{0:d}I'.format(ROWS + 1))
+    return [
+        zlib.crc32(band_struct.pack(band, *sig[band * ROWS:(band + 1) * ROWS]))
+            & 0xffffffff
+        for band in range(BANDS)]
+
+def similarity(sig1, sig2):
+    """Estimates the Jaccard similarity of two sets from their signatures."""
+    return sum(1 for x, y in zip(sig1, sig2) if x == y) / float(NUM_HASHES)
+
+
+class SimilarIndex(indexes.MappedIndex):
+    """A worker's view of the neighbour lists.  Use the module-level
+    `get_index` rather than constructing this yourself.
+    """
+
+    name = NAME
+
+    def _load(self, mapping):
+        self.built = None
+        self._ids = self._neighbours = self._signatures = None
+        self._bucket_hashes = self._bucket_ids = None
+        # Artwork id => current signature, for everything journaled
+        self._changed = {}
+        # Band hash => artwork ids, for the same
+        self._changed_buckets = {}
+
+        if mapping is None:
+            return
+        if mapping[0:len(MAGIC)] != MAGIC:
+            raise ValueError("{0} is not a similarity index".format(NAME))
+
+        self._width, count, built, entries = _header.unpack_from(
+            mapping, len(MAGIC))
+        self.built = datetime.datetime.fromtimestamp(built, pytz.utc)
+
+        ints = indexes.MappedInts
+        self._ids = ints(mapping, len(MAGIC) + _header.size, count)
+        self._neighbours = ints(mapping, self._ids.end, count * self._width)
+        self._signatures = ints(mapping, self._neighbours.end,
+            count * NUM_HASHES)
+        self._bucket_hashes = ints(mapping, self._signatures.end, entries)
+        self._bucket_ids = ints(mapping, self._bucket_hashes.end, entries)
+
+    def _apply(self, line):
+        parts = line.split(' ')
+        artwork_id = int(parts[1])
+        sig = signature(parts[2:])
+
+        old = self._changed.get(artwork_id)
+        if old is not None:
+            for band_hash in band_hashes(old):
+                self._changed_buckets[band_hash].discard(artwork_id)
+
+        self._changed[artwork_id] = sig
+        if sig is not None:
+            for band_hash in band_hashes(sig):
+                self._changed_buckets.setdefault(band_hash, set()) \
+                    .add(artwork_id)
+
+    @property
+    def pending(self):
+        """How many artworks have changed since the index was built."""
+        return len(self._changed)
+
+    def _position(self, artwork_id):
+        if self._ids is None:
+            return None
+        pos = bisect_left(self._ids, artwork_id)
+        if pos < len(self._ids) and self._ids[pos] == artwork_id:
+            return pos
+        return None
+
+    def _signature(self, artwork_id):
+        if artwork_id in self._changed:
+            return self._changed[artwork_id]
+        pos = self._position(artwork_id)
+        if pos is None:
+            return None
+        return self._signatures.slice(
+            pos * NUM_HASHES, (pos + 1) * NUM_HASHES)
+
+    def _bucket(self, band_hash):
+        """Returns the newest artwork ids in a bucket, as of the build."""
+        start = bisect_left(self._bucket_hashes, band_hash)
+        stop = bisect_right(self._bucket_hashes, band_hash, start)
+        return self._bucket_ids.slice(max(start, stop - MAX_BUCKET), stop)
+
+    def neighbours(self, artwork_id, limit=NEIGHBOURS):
+        """Returns the ids of the artworks most like `artwork_id`, most
+        similar first.
+        """
+        stored = []
+        pos = self._position(artwork_id)
+        if pos is not None:
+            stored = [neighbour_id for neighbour_id in self._neighbours.slice(
+                pos * self._width, (pos + 1) * self._width) if neighbour_id]
+        if not self._changed:
+            return stored[:limit]
+
+        # The stored ranking still stands unless this artwork or one of its
+        # neighbours has changed since the build, or something changed has
+        # landed in one of its buckets
+        sig = self._signature(artwork_id)
+        if sig is None:
+            return []
+
+        bands = band_hashes(sig)
+        nearby = set()
+        for band_hash in bands:
+            nearby.update(self._changed_buckets.get(band_hash, ()))
+        nearby.discard(artwork_id)
+        if artwork_id not in self._changed and not nearby and not any(
+                neighbour_id in self._changed for neighbour_id in stored):
+            return stored[:limit]
+
+        candidates = set(stored) | nearby
+        if artwork_id in self._changed and self._ids is not None:
+            for band_hash in bands:
+                candidates.update(self._bucket(band_hash))
+        candidates.discard(artwork_id)
+
+        scored = []
+        for candidate in candidates:
+            other = self._signature(candidate)
+            if other is None:
+                continue
+            score = similarity(sig, other)
+            if score > 0:
+                scored.append((score, candidate))
+        return [candidate for score, candidate in heapq.nlargest(limit, scored)]
+
+
+_index = SimilarIndex()
+
+def get_index():
+    """Returns the current worker's similarity index, or None if there isn't
+    one available.
+    """
+    if _index.refresh():
+        return _index
+    return None
+
+
+### Maintenance
+
+def record_changes(artwork):
+    """Journals an artwork's current tags and users, once the current
+    transaction commits.  Call after any change to either, with both flushed.
+    """
+    keys = postings.artwork_keys(artwork)
+    indexes.append_journal_after_commit(NAME,
+        [' '.join(['~', str(artwork.id)] + keys)])
+
+def rebuild(session):
+    """Rebuilds every artwork's neighbour list from scratch."""
+    generation = indexes.begin_rebuild(NAME)
+    built = int(time.time())
+
+    features = {}
+    for artwork_id, tag_id in session.query(
+            model.artwork_tags.c.artwork_id, model.artwork_tags.c.tag_id):
+        features.setdefault(artwork_id, set()).add(postings.tag_key(tag_id))
+
+    for artwork_id, user_id, relationship_type in session.query(
+            model.UserArtwork.artwork_id,
+            model.UserArtwork.user_id,
+            model.UserArtwork.relationship_type):
+        features.setdefault(artwork_id, set()).add(
+            postings.user_key(relationship_type, user_id))
+
+    ids = sorted(features)
+    signatures = {}
+    bands = {}
+    buckets = {}
+    for artwork_id in ids:
+        sig = signatures[artwork_id] = signature(features[artwork_id])
+        bands[artwork_id] = band_hashes(sig)
+        for band_hash in bands[artwork_id]:
+            # ids are visited in order, so buckets come out sorted
+            buckets.setdefault(band_hash, []).append(artwork_id)
+
+    # Candidates come from the signatures, but are ranked exactly
+    neighbours = []
+    for artwork_id in ids:
+        candidates = set()
+        for band_hash in bands[artwork_id]:
+            bucket = buckets[band_hash]
+            if len(bucket) > MAX_BUCKET:
+                i = bisect_left(bucket, artwork_id)
+                start = max(0, i - MAX_BUCKET // 2)
+                bucket = bucket[start:start + MAX_BUCKET]
+            candidates.update(bucket)
+        candidates.discard(artwork_id)
+
+        mine = features[artwork_id]
+        best = heapq.nlargest(NEIGHBOURS, (
+            (len(mine & features[other]) / float(len(mine | features[other])),
+                other)
+            for other in candidates))
+        row = [other for score, other in best]
+        neighbours.extend(row + [0] * (NEIGHBOURS - len(row)))
+
+    entries = sorted((band_hash, artwork_id)
+        for band_hash, bucket in buckets.iteritems()
+        for artwork_id in bucket)
+
+    pack = indexes.MappedInts.pack
+    indexes.finish_rebuild(NAME, generation, [
+        MAGIC,
+        _header.pack(NEIGHBOURS, len(ids), built, len(entries)),
+        pack(ids),
+        pack(neighbours),
+        pack([value for artwork_id in ids for value in signatures[artwork_id]]),
+        pack([band_hash for band_hash, artwork_id in entries]),
+        pack([artwork_id for band_hash, artwork_id in entries]),
+    ])
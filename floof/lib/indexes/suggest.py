@@ -0,0 +1,230 @@
+"""The model behind the "suggest" gallery sort: a guess at how much each user
+would like each piece of art, based on everyone's ratings.
+
+The ratings matrix, users by artwork, is factorized offline by alternating
+least squares into a short vector per user and per artwork, such that their
+dot product approximates the rating.  The rebuild-suggestions batch job writes
+the factors out as a new generation of a shared index (see
+`floof.lib.indexes`), and each worker memory-maps it and scores candidates
+with one matrix-vector product.
+
+Rebuilds are warm-started from the previous generation's factors, so running
+the job regularly from cron only needs a few iterations to take in new
+ratings, users, and art.
+
+NumPy is needed both to build and to read the model.  Without it, this module
+can't be imported and the suggest sort quietly falls back to upload time.
+"""
+from __future__ import absolute_import
+
+import struct
+
+import numpy
+
+from floof.lib import indexes
+from floof import model
+
+NAME = 'suggest'
+MAGIC = 'FLSUGG1\n'
+# rank, number of users, number of artworks, unused
+_header = struct.Struct('<4I')
+
+# Length of each factor vector
+RANK = 16
+# Regularization, scaled by how many ratings each row has
+REGULARIZATION = 0.05
+COLD_ITERATIONS = 12
+WARM_ITERATIONS = 4
+# Ratings are folded into the normal equations this many at a time, to bound
+# the size of the temporary outer products
+CHUNK_SIZE = 65536
+
+
+class SuggestIndex(indexes.MappedIndex):
+    """A worker's view of the factor model.  Use the module-level `get_index`
+    rather than constructing this yourself.
+    """
+
+    name = NAME
+
+    def _load(self, mapping):
+        self.rank = 0
+        self.user_ids = self.user_factors = None
+        self.artwork_ids = self.artwork_factors = None
+
+        if mapping is None:
+            return
+        if mapping[0:len(MAGIC)] != MAGIC:
+            raise ValueError("{0} is not a suggestion model".format(self.name))
+
+        rank, user_count, artwork_count, _ = _header.unpack_from(
+            mapping, len(MAGIC))
+        offset = [len(MAGIC) + _header.size]
+        def take(dtype, count):
+            array = numpy.frombuffer(mapping, dtype, count, offset[0])
+            offset[0] += array.nbytes
+            return array
+
+        self.rank = rank
+        self.user_ids = take(numpy.uint32, user_count)
+        self.user_factors = take(numpy.float32, user_count * rank) \
+            .reshape(user_count, rank)
+        self.artwork_ids = take(numpy.uint32, artwork_count)
+        self.artwork_factors = take(numpy.float32, artwork_count * rank) \
+            .reshape(artwork_count, rank)
+
+    def _apply(self, line):
+        # Ratings made between rebuilds are simply picked up by the next one
+        pass
+
+    def user_vector(self, user_id):
+        """Returns the factors for the given user, or None if they hadn't
+        rated anything as of the last rebuild.
+        """
+        if self.user_ids is None:
+            return None
+        pos = numpy.searchsorted(self.user_ids, user_id)
+        if pos >= len(self.user_ids) or self.user_ids[pos] != user_id:
+            return None
+        return self.user_factors[pos]
+
+    def scores(self, user_id, artwork_ids):
+        """Returns a float array of the predicted rating `user_id` would give
+        each of `artwork_ids`, or None if the model knows nothing about the
+        user.  Artwork nobody had rated as of the last rebuild scores zero,
+        the same as a neutral rating.
+        """
+        vector = self.user_vector(user_id)
+        if vector is None:
+            return None
+
+        wanted = numpy.asarray(artwork_ids, dtype=numpy.uint32)
+        result = numpy.zeros(len(wanted), dtype=numpy.float32)
+        if not len(self.artwork_ids) or not len(wanted):
+            return result
+
+        pos = numpy.searchsorted(self.artwork_ids, wanted)
+        pos = numpy.minimum(pos, len(self.artwork_ids) - 1)
+        found = self.artwork_ids[pos] == wanted
+        result[found] = self.artwork_factors[pos[found]].dot(vector)
+        return result
+
+
+_index = SuggestIndex()
+
+def get_index():
+    """Returns the current worker's suggestion model, or None if there isn't
+    one available.
+    """
+    if _index.refresh() and _index.user_ids is not None:
+        return _index
+    return None
+
+
+### Building
+
+def _solve(fixed, rows, cols, ratings, row_count):
+    """One half of an ALS iteration: holding the `fixed` factors of one side
+    constant, solves the regularized least squares problem for every row on
+    the other side at once.  `rows`, `cols`, and `ratings` are parallel arrays
+    of the known entries.
+    """
+    rank = fixed.shape[1]
+    gram = numpy.zeros((row_count, rank, rank))
+    rhs = numpy.zeros((row_count, rank))
+    for start in xrange(0, len(rows), CHUNK_SIZE):
+        chunk = slice(start, start + CHUNK_SIZE)
+        factors = fixed[cols[chunk]]
+        numpy.add.at(gram, rows[chunk],
+            factors[:, :, numpy.newaxis] * factors[:, numpy.newaxis, :])
+        numpy.add.at(rhs, rows[chunk], factors * ratings[chunk, numpy.newaxis])
+
+    # Weight the regularization by each row's number of ratings; rows with
+    # none still need something on the diagonal to be solvable
+    weights = numpy.maximum(numpy.bincount(rows, minlength=row_count), 1)
+    gram += REGULARIZATION * weights[:, numpy.newaxis, numpy.newaxis] \
+        * numpy.eye(rank)
+    return numpy.linalg.solve(gram, rhs)
+
+def factorize(user_idx, artwork_idx, ratings, user_factors, artwork_factors,
+        iterations):
+    """Runs ALS on the given ratings, starting from the given factors.
+    Returns the new (user_factors, artwork_factors).
+    """
+    for i in xrange(iterations):
+        user_factors = _solve(artwork_factors, user_idx, artwork_idx, ratings,
+            len(user_factors))
+        artwork_factors = _solve(user_factors, artwork_idx, user_idx, ratings,
+            len(artwork_factors))
+    return user_factors, artwork_factors
+
+def _initial_factors(ids, previous_ids, previous_factors, random):
+    """Returns starting factors for `ids`: the previous generation's where
+    there are any, and small random values otherwise.  Also returns how many
+    were reused.
+    """
+    factors = random.normal(scale=0.1, size=(len(ids), RANK))
+    if previous_ids is None or not len(previous_ids):
+        return factors, 0
+
+    pos = numpy.searchsorted(previous_ids, ids)
+    pos = numpy.minimum(pos, len(previous_ids) - 1)
+    found = previous_ids[pos] == ids
+    factors[found] = previous_factors[pos[found]]
+    return factors, int(found.sum())
+
+def rebuild(session):
+    """Rebuilds the model from every rating, warm-starting from the current
+    generation if there is one.
+    """
+    # Grab the current model first; once the new generation exists, it's the
+    # one a fresh process would try to load
+    previous = get_index()
+    if previous is not None and previous.rank != RANK:
+        previous = None
+
+    generation = indexes.begin_rebuild(NAME)
+
+    rows = session.query(
+        model.ArtworkRating.user_id,
+        model.ArtworkRating.artwork_id,
+        model.ArtworkRating.rating,
+    ).all()
+    if rows:
+        user_col, artwork_col, ratings = (
+            numpy.array(col) for col in zip(*rows))
+    else:
+        user_col = artwork_col = numpy.zeros(0, dtype=numpy.uint32)
+        ratings = numpy.zeros(0)
+    user_ids, user_idx = numpy.unique(user_col, return_inverse=True)
+    artwork_ids, artwork_idx = numpy.unique(artwork_col, return_inverse=True)
+    user_ids = user_ids.astype(numpy.uint32)
+    artwork_ids = artwork_ids.astype(numpy.uint32)
+
+    random = numpy.random.RandomState(generation)
+    user_factors, reused_users = _initial_factors(user_ids,
+        previous and previous.user_ids,
+        previous and previous.user_factors, random)
+    artwork_factors, reused_artwork = _initial_factors(artwork_ids,
+        previous and previous.artwork_ids,
+        previous and previous.artwork_factors, random)
+
+    # Mostly-familiar data only needs a nudge
+    if reused_users + reused_artwork > (len(user_ids) + len(artwork_ids)) // 2:
+        iterations = WARM_ITERATIONS
+    else:
+        iterations = COLD_ITERATIONS
+
+    if len(ratings):
+        user_factors, artwork_factors = factorize(user_idx, artwork_idx,
+            ratings.astype(numpy.float64), user_factors, artwork_factors,
+            iterations)
+
+    indexes.finish_rebuild(NAME, generation, [
+        MAGIC,
+        _header.pack(RANK, len(user_ids), len(artwork_ids), 0),
+        user_ids.tostring(),
+        user_factors.astype(numpy.float32).tostring(),
+        artwork_ids.tostring(),
+        artwork_factors.astype(numpy.float32).tostring(),
+    ])
@@ -0,0 +1,147 @@
+"""Tag name completion, for suggesting existing tags instead of letting typos
+become new ones.
+
+Each worker keeps every tag name in a sorted list, so the names starting with
+some prefix are a contiguous slice found by bisection, plus how many artworks
+use each tag, to rank them.  The best few completions of very short prefixes,
+which match a big slice, are remembered.
+
+The rebuild-tag-completion batch job writes out every tag's name and usage
+count.  Tagging and untagging journal the tags' new usage counts once their
+transaction commits, so every worker sees them on its next completion.  Until
+the index has been built, completions come straight from the database.
+
+The base file is the magic string ``FLTC1\\n``, then a line of
+``name usage-count`` for every tag, sorted by name.  Journal lines look the
+same, after a ``=``.
+"""
+from __future__ import absolute_import
+
+from bisect import bisect_left, insort
+import heapq
+import threading
+
+from floof import model
+from floof.lib import indexes
+
+NAME = 'tagcomplete'
+MAGIC = 'FLTC1\n'
+
+# Prefixes this short have their completions remembered
+SHORT_PREFIX = 2
+LIMIT = 10
+
+
+class TagCompleter(indexes.MappedIndex):
+    """A sorted list of tag names and their usage counts.  Use the
+    module-level functions rather than constructing this yourself.
+    """
+
+    name = NAME
+
+    def __init__(self):
+        super(TagCompleter, self).__init__()
+        self._lock = threading.Lock()
+
+    def refresh(self):
+        # Request threads share one completer, so nothing may read the list
+        # while another thread is loading or replaying into it
+        with self._lock:
+            return super(TagCompleter, self).refresh()
+
+    def _load(self, mapping):
+        self.names = []
+        self.counts = {}
+        self._short = {}
+
+        if mapping is None:
+            return
+        if mapping[0:len(MAGIC)] != MAGIC:
+            raise ValueError("{0} is not a tag completion list".format(NAME))
+
+        for line in mapping[len(MAGIC):].splitlines():
+            name, count = line.decode('utf8').split(u' ')
+            self.names.append(name)
+            self.counts[name] = int(count)
+
+    def _apply(self, line):
+        op, name, count = line.decode('utf8').split(u' ')
+        if name not in self.counts:
+            insort(self.names, name)
+        self.counts[name] = int(count)
+        for length in xrange(SHORT_PREFIX + 1):
+            self._short.pop(name[:length], None)
+
+    def complete(self, prefix, limit=LIMIT):
+        """Returns up to `limit` (name, usage count) pairs for the tags
+        starting with `prefix`, most used first.
+        """
+        with self._lock:
+            remember = len(prefix) <= SHORT_PREFIX and limit <= LIMIT
+            if remember and prefix in self._short:
+                return self._short[prefix][:limit]
+
+            start = bisect_left(self.names, prefix)
+            stop = bisect_left(self.names, prefix + u'\uffff', start)
+            # Most used first, then alphabetical
+            best = heapq.nsmallest(remember and LIMIT or limit,
+                ((self.names[i], self.counts[self.names[i]])
+                    for i in xrange(start, stop)),
+                key=lambda pair: (-pair[1], pair[0]))
+
+            if remember:
+                self._short[prefix] = best
+            return best[:limit]
+
+
+_completer = TagCompleter()
+
+def get_index():
+    """Returns the current worker's completion list, or None if there isn't
+    one available.
+    """
+    if _completer.refresh():
+        return _completer
+    return None
+
+def complete(session, prefix, limit=LIMIT):
+    """Returns up to `limit` (name, usage count) pairs for the tags starting
+    with `prefix`, most used first.
+    """
+    index = get_index()
+    if index is not None:
+        return index.complete(prefix, limit)
+
+    return session.query(model.Tag.name, model.Tag.usage_count) \
+        .filter(model.Tag.name.startswith(prefix)) \
+        .order_by(model.Tag.usage_count.desc(), model.Tag.name) \
+        .limit(limit) \
+        .all()
+
+
+### Maintenance
+
+def record_usage(session, names):
+    """Journals the usage counts of the tags called `names`, once the current
+    transaction commits.  Call it after they've been adjusted; see
+    `floof.lib.counts.adjust`.
+    """
+    if not names or not indexes.enabled():
+        return
+
+    rows = session.query(model.Tag.name, model.Tag.usage_count) \
+        .filter(model.Tag.name.in_(set(names)))
+    indexes.append_journal_after_commit(NAME, [
+        u'= {0} {1:d}'.format(name, count).encode('utf8')
+        for name, count in rows])
+
+def rebuild(session):
+    """Rebuilds the completion list from scratch."""
+    generation = indexes.begin_rebuild(NAME)
+
+    # Sorted here rather than by the database, whose collation may not
+    # agree with bisect's
+    rows = sorted(session.query(model.Tag.name, model.Tag.usage_count))
+    indexes.finish_rebuild(NAME, generation, [MAGIC] + [
+        u'{0} {1:d}\n'.format(name, count).encode('utf8')
+        for name, count in rows])
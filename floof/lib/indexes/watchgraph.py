@@ -0,0 +1,160 @@
+"""Who watches whom, as an adjacency structure for walking more than one step.
+
+Friend-of-friend questions -- whose art do the people I watch watch, and who
+should I watch next -- are a self-join of user_watches per step, which gets
+out of hand fast.  Instead the whole graph is kept in compressed sparse row
+form, where each watcher's targets are a contiguous run of one big array, so
+expanding a set of users is one slice each.
+
+The base file is laid out as:
+
+- the magic string ``FLWG1\\n``
+- a header: number of watchers, number of watches
+- the sorted ids of every user who watches anyone
+- for each of those, the offset of their first target; plus one final offset
+  for the end
+- every watched user's id, grouped by watcher and sorted within each group
+
+All numbers are little-endian unsigned 32-bit ints.  Watches and unwatches
+since the build are journaled as ``+ watcher watched`` or ``- watcher
+watched``.
+"""
+from __future__ import absolute_import
+
+from bisect import bisect_left
+from collections import defaultdict
+import struct
+
+from floof import model
+from floof.lib import indexes
+
+NAME = 'watchgraph'
+MAGIC = 'FLWG1\n'
+_header = struct.Struct('<2I')
+
+
+class WatchGraphIndex(indexes.MappedIndex):
+    """A worker's view of the watch graph.  Use the module-level `get_index`
+    rather than constructing this yourself.
+    """
+
+    name = NAME
+
+    def _load(self, mapping):
+        self._watchers = self._offsets = self._targets = None
+        self._added = defaultdict(set)
+        self._removed = defaultdict(set)
+
+        if mapping is None:
+            return
+        if mapping[0:len(MAGIC)] != MAGIC:
+            raise ValueError("{0} is not a watch graph".format(NAME))
+
+        watcher_count, watch_count = _header.unpack_from(mapping, len(MAGIC))
+        ints = indexes.MappedInts
+        self._watchers = ints(mapping, len(MAGIC) + _header.size,
+            watcher_count)
+        self._offsets = ints(mapping, self._watchers.end, watcher_count + 1)
+        self._targets = ints(mapping, self._offsets.end, watch_count)
+
+    def _apply(self, line):
+        op, user_id, other_user_id = line.split(' ')
+        user_id = int(user_id)
+        other_user_id = int(other_user_id)
+        if op == '+':
+            self._added[user_id].add(other_user_id)
+            self._removed[user_id].discard(other_user_id)
+        elif op == '-':
+            self._removed[user_id].add(other_user_id)
+            self._added[user_id].discard(other_user_id)
+
+    def watched(self, user_id):
+        """Returns the set of ids of the users `user_id` watches."""
+        result = set()
+        if self._watchers is not None:
+            pos = bisect_left(self._watchers, user_id)
+            if pos < len(self._watchers) and self._watchers[pos] == user_id:
+                start, stop = self._offsets.slice(pos, pos + 2)
+                result.update(self._targets.slice(start, stop))
+
+        if user_id in self._added:
+            result |= self._added[user_id]
+        if user_id in self._removed:
+            result -= self._removed[user_id]
+        return result
+
+    def _second_hop(self, user_id):
+        """Returns the users `user_id` watches, and how many of those watch
+        each other user they don't.
+        """
+        watched = self.watched(user_id)
+        counts = defaultdict(int)
+        for middle_id in watched:
+            for other_id in self.watched(middle_id):
+                counts[other_id] += 1
+
+        counts.pop(user_id, None)
+        for other_id in watched:
+            counts.pop(other_id, None)
+        return watched, counts
+
+    def friends_of_friends(self, user_id):
+        """Returns the set of ids of users watched by someone `user_id`
+        watches, other than `user_id` and whoever they already watch.
+        """
+        watched, counts = self._second_hop(user_id)
+        return set(counts)
+
+    def suggestions(self, user_id, limit=10):
+        """Returns up to `limit` ids of users that `user_id` might like to
+        watch: the friends of friends that the most of their watches watch.
+        """
+        watched, counts = self._second_hop(user_id)
+        ranked = sorted(counts.iteritems(), key=lambda item: (-item[1], item[0]))
+        return [other_id for other_id, count in ranked[:limit]]
+
+
+_index = WatchGraphIndex()
+
+def get_index():
+    """Returns the current worker's watch graph, or None if there isn't one
+    available.
+    """
+    if _index.refresh():
+        return _index
+    return None
+
+
+### Maintenance
+
+def record_watch(user_id, other_user_id, watching=True):
+    """Journals a watch (or, with `watching` false, an unwatch), once the
+    current transaction commits.
+    """
+    indexes.append_journal_after_commit(NAME, ['{0} {1:d} {2:d}'.format(
+        '+' if watching else '-', user_id, other_user_id)])
+
+def rebuild(session):
+    """Rebuilds the watch graph from scratch."""
+    generation = indexes.begin_rebuild(NAME)
+
+    watchers = []
+    offsets = []
+    targets = []
+    for user_id, other_user_id in session.query(
+                model.UserWatch.user_id, model.UserWatch.other_user_id) \
+            .order_by(model.UserWatch.user_id, model.UserWatch.other_user_id):
+        if not watchers or watchers[-1] != user_id:
+            watchers.append(user_id)
+            offsets.append(len(targets))
+        targets.append(other_user_id)
+    offsets.append(len(targets))
+
+    pack = indexes.MappedInts.pack
+    indexes.finish_rebuild(NAME, generation, [
+        MAGIC,
+        _header.pack(len(watchers), len(targets)),
+        pack(watchers),
+        pack(offsets),
+        pack(targets),
+    ])
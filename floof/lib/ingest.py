@@ -0,0 +1,76 @@
+"""Reading uploads in, once.
+
+An upload needs its MIME type sniffed, its sha256 taken, its size counted,
+and its bytes put somewhere the filestore can pick them up.  Doing each of
+those with its own pass over the file reads a big upload several times over,
+so `ingest` does them all in a single streaming read, spooling the bytes to a
+temporary file as it goes.  Everything afterwards works from that file's
+path.
+
+The spool file should live on the same filesystem as the filestore's own
+temporary files, so that handing it over later can be a rename rather than
+another copy; see `FileStorage.spool_directory`.
+"""
+from __future__ import absolute_import
+
+import errno
+import hashlib
+import os
+import tempfile
+
+import magic
+
+# `magic` only needs the first few bytes to recognize a format
+SNIFF_SIZE = 1024
+CHUNK_SIZE = 524288  # .5 MiB
+
+
+class IngestedFile(object):
+    """An upload that's been read in.  The spooled copy is at `path` until
+    `discard` is called, or until it's been moved somewhere else.
+    """
+
+    def __init__(self, path, mimetype, hash, size):
+        self.path = path
+        self.mimetype = mimetype
+        self.hash = hash
+        self.size = size
+
+    def discard(self):
+        """Deletes the spooled copy, if it's still there."""
+        try:
+            os.remove(self.path)
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+
+
+def ingest(fileobj, directory=None):
+    """Reads `fileobj` to the end, spooling it to a new file in `directory`
+    (or the system default temporary directory) along the way.  Returns an
+    `IngestedFile`, whose spooled copy the caller must eventually discard.
+    """
+    hasher = hashlib.sha256()
+    size = 0
+    head = ''
+
+    fd, path = tempfile.mkstemp(prefix='ingest-', dir=directory)
+    try:
+        with os.fdopen(fd, 'wb') as spool:
+            while True:
+                chunk = fileobj.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+
+                if len(head) < SNIFF_SIZE:
+                    head += chunk[:SNIFF_SIZE - len(head)]
+                hasher.update(chunk)
+                size += len(chunk)
+                spool.write(chunk)
+    except:
+        os.remove(path)
+        raise
+
+    mimetype = magic.Magic(mime=True).from_buffer(head).decode('ascii')
+    return IngestedFile(path, mimetype, hasher.hexdigest().decode('ascii'),
+        size)
@@ -0,0 +1,105 @@
+"""Precomputed top-rated art for each time window.
+
+Sorting everything by rating means an ORDER BY over the whole artwork table,
+and "best of the last week" can't use any one index for both the time range
+and the order.  Instead, the top `LEADERBOARD_SIZE` rated artworks uploaded in
+each window live in the rating_leaderboards table, and `GallerySieve` sorts
+by rating by joining to one window's rows.
+
+Windows are named like `GalleryForm.time_radius`'s choices.  Each rating
+change calls `record_rating`, which updates or inserts the artwork's entry in
+every window it's in and drops whatever falls off the bottom.  Art also ages
+out of the shorter windows, which the gallery hides by filtering on upload
+time; the rebuild-leaderboards batch job, run from cron, refills the gaps
+this leaves.
+"""
+from datetime import timedelta
+
+from sqlalchemy.sql import and_, exists, func, select
+
+from floof import model
+
+LEADERBOARD_SIZE = 1000
+
+# None means all time
+WINDOWS = {
+    u'24h':  timedelta(hours=24),
+    u'7d':   timedelta(days=7),
+    u'30d':  timedelta(days=30),
+    u'90d':  timedelta(days=90),
+    u'365d': timedelta(days=365),
+    u'all':  None,
+}
+
+
+def _in_window(window, uploaded_time, now):
+    delta = WINDOWS[window]
+    return delta is None or uploaded_time >= now - delta
+
+def is_built(session, window):
+    """Returns whether `window` has a leaderboard to sort by."""
+    if window not in WINDOWS:
+        return False
+    table = model.RatingLeaderboard.__table__
+    return session.execute(
+        select([exists().where(table.c.window == window)])).scalar()
+
+def record_rating(session, artwork):
+    """Brings every leaderboard up to date with `artwork`'s current score.
+    Call after any change to its ratings.
+    """
+    table = model.RatingLeaderboard.__table__
+    now = model.now()
+    for window in WINDOWS:
+        if not _in_window(window, artwork.uploaded_time, now):
+            continue
+
+        this_entry = and_(table.c.window == window,
+            table.c.artwork_id == artwork.id)
+        if artwork.rating_score is None:
+            session.execute(table.delete().where(this_entry))
+            continue
+
+        updated = session.execute(table.update().where(this_entry)
+            .values(rating_score=artwork.rating_score)).rowcount
+        if updated:
+            continue
+
+        # Not on the board yet; get on it if there's room or it's better than
+        # the current bottom entry, which then gets bumped
+        size, lowest = session.execute(
+            select([func.count(), func.min(table.c.rating_score)],
+                table.c.window == window)).first()
+        if size >= LEADERBOARD_SIZE and artwork.rating_score <= lowest:
+            continue
+
+        session.execute(table.insert().values(window=window,
+            artwork_id=artwork.id, rating_score=artwork.rating_score))
+        if size >= LEADERBOARD_SIZE:
+            bottom_id = session.execute(
+                select([table.c.artwork_id], table.c.window == window)
+                .order_by(table.c.rating_score, table.c.artwork_id)
+                .limit(1)).scalar()
+            session.execute(table.delete().where(and_(
+                table.c.window == window, table.c.artwork_id == bottom_id)))
+
+def rebuild(session):
+    """Recomputes every leaderboard from scratch."""
+    table = model.RatingLeaderboard.__table__
+    artwork = model.Artwork.__table__
+    now = model.now()
+    for window, delta in WINDOWS.iteritems():
+        query = select([artwork.c.id, artwork.c.rating_score],
+                artwork.c.rating_score != None) \
+            .order_by(artwork.c.rating_score.desc(), artwork.c.id.desc()) \
+            .limit(LEADERBOARD_SIZE)
+        if delta is not None:
+            query = query.where(artwork.c.uploaded_time >= now - delta)
+
+        rows = session.execute(query).fetchall()
+        session.execute(table.delete().where(table.c.window == window))
+        if rows:
+            session.execute(table.insert(), [
+                dict(window=window, artwork_id=artwork_id,
+                    rating_score=rating_score)
+                for artwork_id, rating_score in rows])
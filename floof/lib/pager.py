@@ -8,6 +8,9 @@ from datetime import datetime
 import math
 
 import pytz
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql import and_, or_
+from sqlalchemy.sql.expression import ColumnElement, nullslast
 
 def _datetime_to_query(dt):
     """Converts a datetime to some arbitrary and unspecified format appropriate
@@ -57,7 +60,9 @@ class DiscretePager(object):
     pager_type = 'discrete'
     maximum_skip = 1000
 
-    def __init__(self, query, page_size, formdata={}, radius=3, countable=False):
+    def __init__(self, query, page_size, formdata={}, radius=3, countable=False,
+            row_factory=None, fetch=None, item_count=None,
+            item_count_is_estimate=False):
         """Create a pager.  The current page is taken from 'skip' in the given
         `formdata`.
 
@@ -74,9 +79,21 @@ class DiscretePager(object):
           will only show the following page number (if appropriate) and an
           ellipsis.  Additionally, no OFFSET greater than this object's
           `maximum_skip` will ever be allowed.
+
+        `row_factory`, if given, is called on each result to produce the items
+        actually shown.
+
+        `fetch`, if given, is called to run the query instead of `.all()`.  It
+        gets the limited query and a tuple describing the page's position, and
+        must return the same results the query would.  This is a hook for
+        caching.
+
+        `item_count` lets the caller supply the total for a countable pager,
+        if it has a cheaper way to find it than counting the query.  Set
+        `item_count_is_estimate` if the number is only an upper bound.
         """
         self.formdata = formdata.copy()
-        self.formdata.pop('timeskip', None)  # get rid of cruft, just in case
+        self.formdata.pop('seek', None)  # get rid of cruft, just in case
 
         self.page_size = page_size
         self.radius = radius
@@ -90,8 +107,12 @@ class DiscretePager(object):
             self.skip = 0
 
         self.countable = countable
+        self.item_count_is_estimate = False
         if self.countable:
-            self.item_count = query.count()
+            if item_count is None:
+                item_count = query.count()
+            self.item_count = item_count
+            self.item_count_is_estimate = item_count_is_estimate
             self.last_page = int(math.ceil(
                 self.item_count / self.page_size - 1))
 
@@ -106,7 +127,13 @@ class DiscretePager(object):
 
         # Get one extra, for figuring out where the next page starts, and
         # whether one exists
-        self.items = query.limit(page_size + 1).offset(self.skip).all()
+        query = query.limit(page_size + 1).offset(self.skip)
+        if fetch:
+            self.items = fetch(query, ('skip', self.skip, page_size))
+        else:
+            self.items = query.all()
+        if row_factory:
+            self.items = [row_factory(row) for row in self.items]
         self.visible_count = len(self.items)
         self.next_item = None
         if len(self.items) > page_size:
@@ -172,16 +199,6 @@ class DiscretePager(object):
             formdata['skip'] = int(round(skip))
         return formdata
 
-    def formdata_for_temporal(self, column_name):
-        """Returns the provided `formdata`, with a 'timeskip' key for the first
-        item on the following page.  Used by `GallerySieve` for switching to
-        temporal paging after so many results.
-        """
-        formdata = self.formdata.copy()
-        formdata['timeskip'] = _datetime_to_query(
-            getattr(self.next_item, column_name))
-        return formdata
-
     @property
     def is_last_page(self):
         return self.next_item is None
@@ -204,64 +221,237 @@ class DiscretePager(object):
         return False
 
 
-class TemporalPager(object):
-    """A pager that skips by time, rather than number of items.  The advantage
-    is that a client can browse back arbitrarily far without the O(n) cost that
-    LIMIT clauses impose.  The downside is that it's not feasible to show a
-    list of pages any more, so it's difficult to express where the user is
-    within the items or even to provide a "back one page" link.
+def _seek_to_query(value, ident):
+    """Converts a (sort value, id) pair to a string for round-tripping through
+    a query.
+
+    The value is prefixed with a single character describing its type, so it
+    can be reconstructed without knowing anything about the column it came
+    from.
+    """
+    if value is None:
+        encoded = u'n'
+    elif isinstance(value, datetime):
+        encoded = u't' + _datetime_to_query(value)
+    elif isinstance(value, float):
+        encoded = u'f' + repr(value).decode('ascii')
+    elif isinstance(value, basestring):
+        encoded = u's' + value
+    else:
+        encoded = u'i{0:d}'.format(value)
+
+    return u"{0}~{1:d}".format(encoded, ident)
+
+def _seek_from_query(seek):
+    """Converts the above format back to a (sort value, id) pair.
+
+    Returns None if `seek` is missing or junk.
+    """
+    if not seek or u'~' not in seek:
+        return None
+
+    encoded, _, ident = seek.rpartition(u'~')
+    kind, encoded = encoded[0:1], encoded[1:]
+
+    try:
+        ident = int(ident)
+        if kind == u'n':
+            value = None
+        elif kind == u't':
+            value = _datetime_from_query(encoded)
+            if value is None:
+                return None
+        elif kind == u'f':
+            value = float(encoded)
+        elif kind == u'i':
+            value = int(encoded)
+        elif kind == u's':
+            value = encoded
+        else:
+            return None
+    except ValueError:
+        # As with timestamps, this is our own value; ignore it if mangled
+        return None
+
+    return value, ident
+
+
+class KeysetPager(object):
+    """A pager that seeks to a position in the results, rather than skipping
+    over some number of them.  Results must be sorted by some column and then
+    by a unique id column, both in the same direction; a page is identified by
+    the (sort value, id) of the last item on the page before it.
+
+    The advantage is that every page costs the same as the first, given an
+    index on (sort column, id): the database jumps straight to the right spot
+    instead of counting its way there as OFFSET does.  The downside, as with
+    any seeking pager, is that there's no list of pages or "back" link.
 
     The API is similar to `DiscretePager` above, but not interchangeable.
 
-    This class uses the 'timeskip' query parameter rather than 'skip', to help
+    This class uses the 'seek' query parameter rather than 'skip', to help
     tell which type of pager is being used.
     """
 
-    pager_type = 'temporal'
+    pager_type = 'keyset'
     item_count = None
 
-    def __init__(self, query, page_size, column_name, formdata={}):
+    def __init__(self, query, page_size, order_column, id_column, formdata={},
+            row_factory=None, fetch=None, descending=True):
         """Create a pager.
 
-        `column_name` is the name of the datetime column in the query, to be
-        used for adding the offset and figuring out where the next page starts.
+        `order_column` and `id_column` are the ORM attributes the query is
+        sorted by, in that order and both descending -- or, if `descending` is
+        false, both ascending.  Each item must have attributes with the same
+        names, so the next page can be found.  That includes items produced by
+        `row_factory`.
+
+        When descending, `order_column` may be nullable, with NULLs sorting
+        last; use `order_by` to sort the query so they do on every database.
+        Ascending order doesn't support NULLs.
 
         Other arguments are the same as for `DiscretePager`.
         """
         self.formdata = formdata.copy()
         self.formdata.pop('skip', None)  # get rid of cruft, just in case
 
-        # Find the column for the table in question
-        table = query.column_descriptions[0]['expr']
-        time_column = getattr(table, column_name)
-
-        self.timeskip = _datetime_from_query(
-            self.formdata.pop('timeskip', None))
-        if self.timeskip:
-            query = query.filter(time_column <= self.timeskip)
-
-        # Get one extra, for figuring out where the next page starts, and
-        # whether one exists
-        self.items = query.limit(page_size + 1).all()
+        self.order_key = order_column.key
+        self.id_key = id_column.key
+
+        self.seek = _seek_from_query(self.formdata.pop('seek', None))
+        if self.seek:
+            if descending:
+                clause = self._seek_clause(order_column, id_column, *self.seek)
+            else:
+                clause = self._seek_clause_ascending(
+                    order_column, id_column, *self.seek)
+            query = query.filter(clause)
+
+        # Get one extra, to find out whether there's another page
+        query = query.limit(page_size + 1)
+        if fetch:
+            self.items = fetch(query, ('seek', self.seek, page_size))
+        else:
+            self.items = query.all()
+        if row_factory:
+            self.items = [row_factory(row) for row in self.items]
         self.visible_count = len(self.items)
         self.next_item = None
-        self.next_item_timeskip = None
+        self.next_seek = None
         if len(self.items) > page_size:
             self.next_item = self.items.pop()
-            self.next_item_timeskip = getattr(self.next_item, column_name)
+            last_item = self.items[-1]
+            self.next_seek = (
+                getattr(last_item, self.order_key),
+                getattr(last_item, self.id_key),
+            )
 
         self.page_size = page_size
 
+    @staticmethod
+    def order_by(order_column, id_column, descending=True):
+        """Returns the ORDER BY clauses for a query this pager can page
+        through.
+
+        Descending order puts NULLs last, as the seek clause expects.  SQLite
+        and MySQL do that anyway, but PostgreSQL puts them first, so there
+        nullable columns are sorted NULLS LAST; see `_desc_nulls_last`.
+        Anywhere else it's a plain DESC, which the (column, id) index can
+        provide.
+        """
+        if not descending:
+            return [order_column.asc(), id_column.asc()]
+
+        if _is_nullable(order_column):
+            return [_desc_nulls_last(order_column), id_column.desc()]
+        return [order_column.desc(), id_column.desc()]
+
+    @staticmethod
+    def _seek_clause(order_column, id_column, value, ident):
+        """Builds the WHERE clause for everything strictly after the given
+        (value, id) pair, in descending order.
+        """
+        if value is None:
+            # Already into the NULLs at the end
+            return and_(order_column == None, id_column < ident)
+
+        # The redundant <= lets the database use a plain range scan on the
+        # sort column's index
+        clause = and_(
+            order_column <= value,
+            or_(order_column < value, id_column < ident),
+        )
+        return or_(clause, order_column == None)
+
+    @staticmethod
+    def _seek_clause_ascending(order_column, id_column, value, ident):
+        """Same as above, but for ascending order."""
+        return and_(
+            order_column >= value,
+            or_(order_column > value, id_column > ident),
+        )
+
     def __iter__(self):
         return iter(self.items)
 
-    def formdata_for(self, timeskip):
+    def formdata_for(self, seek):
         formdata = self.formdata.copy()
-        # timeskip=None doesn't get put in the query
-        if timeskip:
-            formdata['timeskip'] = _datetime_to_query(timeskip)
+        # seek=None doesn't get put in the query
+        if seek:
+            formdata['seek'] = _seek_to_query(*seek)
         return formdata
 
     @property
     def is_last_page(self):
         return self.next_item is None
+
+
+def _is_nullable(column):
+    """Returns whether an ORM attribute, a table column, or a label of either
+    can be NULL.
+    """
+    prop = getattr(column, 'property', None)
+    if prop is not None:
+        column = prop.columns[0]
+    # Labels, including one of an ORM attribute
+    element = getattr(column, 'element', None)
+    if element is not None:
+        return _is_nullable(element)
+    return getattr(column, 'nullable', True)
+
+class _desc_nulls_last(ColumnElement):
+    """Sorts by a column, descending, with NULLs last.  Only PostgreSQL needs
+    telling, and not every database understands NULLS LAST.
+    """
+    def __init__(self, column):
+        self.column = column
+
+@compiles(_desc_nulls_last)
+def _compile_desc_nulls_last(element, compiler, **kw):
+    return compiler.process(element.column.desc(), **kw)
+
+@compiles(_desc_nulls_last, 'postgresql')
+def _compile_desc_nulls_last_postgresql(element, compiler, **kw):
+    return compiler.process(nullslast(element.column.desc()), **kw)
+
+
+class SamplePager(object):
+    """Not really a pager: a single page of items picked at random, from which
+    the only way onwards is another pick.  Has enough of the API of the
+    pagers above for the gallery templates.
+    """
+
+    pager_type = 'sample'
+    item_count = None
+    is_last_page = True
+
+    def __init__(self, items, formdata={}):
+        self.formdata = formdata.copy()
+        self.formdata.pop('skip', None)
+        self.formdata.pop('seek', None)
+
+        self.items = items
+        self.visible_count = len(items)
+
+    def __iter__(self):
+        return iter(self.items)
@@ -0,0 +1,241 @@
+"""Smaller copies of artwork, for showing art at something less than full size
+without sending the whole original.
+
+A rendition is the original scaled down to one of `WIDTHS` pixels wide, and is
+served through the filestore route like any other file, as class `rendition`
+with a key of ``hash-width``.  Templates can offer every rendition narrower
+than the original in a ``srcset`` (see `srcset`) and let the browser pick.
+
+Nothing makes renditions ahead of time.  The first request for one queues it
+on the thumbnail pool and is sent the original meanwhile, as is every other
+request until it's done.  Whoever queues it first holds a *claim*, an empty
+file in the filestore's spool directory, so other processes sharing that
+directory don't make it again.
+
+Renditions can always be made again, so the filestore only keeps so many:
+the evict-renditions batch job, run from cron, throws out the least recently
+used ones whenever they add up to more than the `rendition.cache_size`
+setting, in bytes.  That needs a filestore that can list what it holds, which
+for now means local storage.
+"""
+from __future__ import absolute_import
+
+from contextlib import closing
+from cStringIO import StringIO
+import errno
+import logging
+import os
+import tempfile
+import time
+import traceback
+
+try:
+    import Image
+except ImportError:
+    from PIL import Image
+
+from floof.lib import thumbnails
+from floof.model.filestore import get_storage_factory
+
+log = logging.getLogger(__name__)
+
+CLASS = u'rendition'
+WIDTHS = (160, 320, 800, 1600)
+
+CACHE_SIZE = 1073741824  # 1 GiB
+# Eviction goes this far below the limit, so it isn't needed again right away
+LOW_WATER = 0.9
+# A claim on making a rendition this many seconds old is assumed abandoned
+CLAIM_TIMEOUT = 300
+
+
+def key_for(hash, width):
+    return u'{0}-{1:d}'.format(hash, width)
+
+def parse_key(key):
+    """Returns the (hash, width) in a rendition's key.  Raises ValueError if
+    it isn't one.
+    """
+    hash, _, width = key.rpartition(u'-')
+    if not hash or not width.isdigit() or int(width) not in WIDTHS:
+        raise ValueError("Not a rendition key: {0!r}".format(key))
+    return hash, int(width)
+
+def widths_for(artwork):
+    """Returns the rendition widths worth having for `artwork`: those narrower
+    than the original.  GIFs get none, since shrinking one keeps only its
+    first frame.
+    """
+    if artwork.mime_type == u'image/gif':
+        return []
+    return [width for width in WIDTHS if width < artwork.width]
+
+def srcset(request, artwork):
+    """Returns a ``srcset`` attribute value offering every useful rendition of
+    `artwork`, plus the original.
+    """
+    candidates = [
+        (request.route_url('filestore', class_=CLASS,
+            key=key_for(artwork.hash, width)), width)
+        for width in widths_for(artwork)]
+    candidates.append((request.route_url('filestore', class_=u'artwork',
+        key=artwork.hash), artwork.width))
+    return u', '.join(u'{0} {1:d}w'.format(url, width)
+        for url, width in candidates)
+
+
+### Making them
+
+def make_rendition(image, width):
+    """Scales `image` down to `width` pixels wide.  Returns a new image."""
+    full_width, full_height = image.size
+    new_size = (width, max(1, full_height * width // full_width))
+    return thumbnails.shrink(image, image.size, new_size)
+
+def generate(settings, hash, mimetype, width):
+    """Makes and stores one rendition, unless it already exists.  Runs on the
+    thumbnail pool, by way of `_make`.
+    """
+    storage_factory = get_storage_factory(settings)
+    key = key_for(hash, width)
+    if storage_factory().exists(CLASS, key):
+        return
+
+    url = storage_factory().url(u'artwork', hash)
+    if url is None:
+        raise IOError("Artwork {0} is missing from storage".format(hash))
+    original = thumbnails.fetch(url, storage_factory().spool_directory)
+    with closing(original):
+        image = Image.open(original)
+        if thumbnails.too_many_pixels(image, settings['max_pixels']):
+            raise ValueError("Artwork {0} is too big to decode".format(hash))
+
+        buf = StringIO()
+        make_rendition(image, width).save(buf, thumbnails.FORMATS[mimetype])
+    buf.seek(0)
+    thumbnails.store(storage_factory, CLASS, key, buf)
+
+def _claim_path(storage, key):
+    directory = storage.spool_directory or tempfile.gettempdir()
+    return os.path.join(directory, u'{0}-{1}.claim'.format(CLASS, key))
+
+def _claim(storage, key):
+    """Claims the making of the rendition with this `key`, on behalf of every
+    process sharing the spool directory.  Returns whether it's ours.
+    """
+    path = _claim_path(storage, key)
+    for attempt in range(2):
+        try:
+            os.close(os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+            return True
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+
+        # Someone has it; take it over if they seem to have given up
+        try:
+            if time.time() - os.path.getmtime(path) < CLAIM_TIMEOUT:
+                return False
+            os.remove(path)
+        except OSError:
+            # Released or taken over in the meantime
+            pass
+    return False
+
+def _release(storage, key):
+    try:
+        os.remove(_claim_path(storage, key))
+    except OSError as e:
+        if e.errno != errno.ENOENT:
+            raise
+
+def _make(settings, hash, mimetype, width):
+    """Makes a rendition on the pool, then gives up the claim on it.  Returns
+    the key and a traceback if it failed.
+    """
+    key = key_for(hash, width)
+    try:
+        generate(settings, hash, mimetype, width)
+    except Exception:
+        return key, traceback.format_exc()
+    finally:
+        _release(get_storage_factory(settings)(), key)
+    return key, None
+
+def _finished(result):
+    key, error = result
+    if error:
+        log.error("Couldn't make rendition {0}:\n{1}".format(key, error))
+
+
+### Keeping them
+
+class RenditionCache(object):
+    """The renditions in a filestore, made on demand and thrown away when
+    there are too many.  Use the module-level functions rather than
+    constructing this yourself.
+    """
+
+    def __init__(self, max_bytes=CACHE_SIZE):
+        self.max_bytes = max_bytes
+
+    def ensure(self, storage, artwork, width):
+        """Returns whether the rendition of `artwork` at `width` is in
+        `storage`.  If it isn't, it's queued to be made, unless someone else
+        is already making it.
+        """
+        key = key_for(artwork.hash, width)
+        if storage.exists(CLASS, key):
+            storage.touch(CLASS, key)
+            return True
+
+        if _claim(storage, key):
+            thumbnails.submit(_make, _finished,
+                artwork.hash, artwork.mime_type, width)
+            # Without a pool, it's been made already
+            return storage.exists(CLASS, key)
+        return False
+
+    def evict(self, storage):
+        """Deletes the least recently used renditions until they fit in
+        `max_bytes`, if they don't already.  Returns how many it deleted.
+        This looks at every rendition, so leave it to the batch job.
+        """
+        try:
+            entries = list(storage.usage(CLASS))
+        except NotImplementedError:
+            log.warning("This filestore can't limit the size of renditions")
+            return 0
+
+        total = sum(size for key, size, used_at in entries)
+        if total <= self.max_bytes:
+            return 0
+
+        deleted = 0
+        entries.sort(key=lambda entry: entry[2])
+        for key, size, used_at in entries:
+            if total <= self.max_bytes * LOW_WATER:
+                break
+            storage.delete(CLASS, key)
+            total -= size
+            deleted += 1
+        return deleted
+
+
+_cache = RenditionCache()
+
+def configure(settings):
+    """Sets the cache's size from the `rendition.cache_size` setting.  Call
+    once at startup.
+    """
+    _cache.max_bytes = int(settings.get('rendition.cache_size', CACHE_SIZE))
+
+def ensure(storage, artwork, width):
+    """Returns whether the rendition of `artwork` at `width` is in `storage`,
+    queueing it to be made if not.
+    """
+    return _cache.ensure(storage, artwork, width)
+
+def evict(storage):
+    """Shrinks the renditions in `storage` to fit the cache."""
+    return _cache.evict(storage)
@@ -0,0 +1,487 @@
+"""Parsing and compiling the tag query language used to filter galleries.
+
+The syntax is meant to be what you'd type without thinking about it:
+
+    dragon fox              both tags; juxtaposition means AND
+    dragon & fox            same; AND also works
+    dragon | fox            either tag; OR also works
+    dragon -fox             dragon, but not fox; ! and NOT also work
+    (dragon | fox) by:foo   grouping; by:, for:, and of: match users
+
+NOT binds tightest, then AND, then OR.  Tags are lowercase, so the uppercase
+operator keywords can't collide with them.
+
+A query goes through three steps.  `parse` builds a tree of names.
+`resolve` looks up every name at once, following tag aliases; it folds away
+the unknown ones, and widens each tag to also match the tags that imply it
+(see `floof.lib.tagrules`).  `compile` turns what's left into a single SELECT
+of artwork ids.  Runs of plain tags become one grouped ``HAVING COUNT`` over
+the association table, and negation becomes ``EXCEPT``, so the database sees
+a handful of set operations rather than an EXISTS per term.
+"""
+import re
+
+from sqlalchemy.sql import and_, or_, select, func, except_, intersect, union
+
+from floof import model
+from floof.lib import tagrules
+
+# Queries with more names than this are refused outright
+MAX_TERMS = 24
+# Nesting depth of parentheses and NOTs
+MAX_DEPTH = 8
+# Rough budget of set operations a compiled query may cost; see `cost`
+MAX_COST = 40
+# What a bare NOT costs: it means "every artwork except", which is a full scan
+COMPLEMENT_COST = 10
+
+
+class TagQueryError(ValueError):
+    """Raised for a query that can't be parsed or is too expensive to run.  The
+    message is suitable for showing to the user.
+    """
+    pass
+
+
+### Syntax tree
+
+class Term(object):
+    """A name as written in the query: a tag, or a user with a relationship.
+    `rel` is None for tags.
+    """
+    __slots__ = ('rel', 'name')
+
+    def __init__(self, rel, name):
+        self.rel = rel
+        self.name = name
+
+    def __unicode__(self):
+        if self.rel:
+            return u'{0}:{1}'.format(self.rel, self.name)
+        return self.name
+
+class Ident(object):
+    """A resolved `Term`: a tag id, or a user id with a relationship."""
+    __slots__ = ('rel', 'id')
+
+    def __init__(self, rel, id):
+        self.rel = rel
+        self.id = id
+
+    def _key(self):
+        return self.rel, self.id
+
+    def __eq__(self, other):
+        return isinstance(other, Ident) and self._key() == other._key()
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self._key())
+
+class And(object):
+    __slots__ = ('children',)
+
+    def __init__(self, children):
+        self.children = children
+
+class Or(object):
+    __slots__ = ('children',)
+
+    def __init__(self, children):
+        self.children = children
+
+class Not(object):
+    __slots__ = ('child',)
+
+    def __init__(self, child):
+        self.child = child
+
+class _Constant(object):
+    def __init__(self, name):
+        self.name = name
+
+    def __repr__(self):
+        return self.name
+
+# What unknown names fold into: a positive unknown matches nothing, and a
+# negated one excludes nothing
+NOTHING = _Constant('NOTHING')
+EVERYTHING = _Constant('EVERYTHING')
+
+
+### Parsing
+
+_token_re = re.compile(ur"""
+    \s* (?:
+        (?P<op> [()|&!] | -(?=[^\s)|&]) )
+      | (?P<word> [^\s()|&!]+ )
+    )
+""", re.UNICODE | re.VERBOSE)
+
+_keyword_ops = {u'AND': u'&', u'OR': u'|', u'NOT': u'!'}
+
+def tokenize(query):
+    """Splits a query into operators and words.  Keywords are translated into
+    their symbols; everything else is a word.
+    """
+    tokens = []
+    pos = 0
+    query = query.strip()
+    while pos < len(query):
+        match = _token_re.match(query, pos)
+        pos = match.end()
+        if match.group('op'):
+            op = match.group('op')
+            tokens.append(u'!' if op == u'-' else op)
+        else:
+            word = match.group('word')
+            tokens.append(_keyword_ops.get(word, word))
+
+    return tokens
+
+class _Parser(object):
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.pos = 0
+        self.term_count = 0
+
+    def peek(self):
+        if self.pos < len(self.tokens):
+            return self.tokens[self.pos]
+        return None
+
+    def advance(self):
+        token = self.peek()
+        self.pos += 1
+        return token
+
+    def parse(self):
+        node = self.parse_or(0)
+        token = self.peek()
+        if token is not None:
+            raise TagQueryError(u"Unexpected '{0}' in tag query".format(token))
+        return node
+
+    def parse_or(self, depth):
+        children = [self.parse_and(depth)]
+        while self.peek() == u'|':
+            self.advance()
+            children.append(self.parse_and(depth))
+
+        if len(children) == 1:
+            return children[0]
+        return Or(children)
+
+    def parse_and(self, depth):
+        children = [self.parse_not(depth)]
+        while True:
+            token = self.peek()
+            if token == u'&':
+                self.advance()
+            elif token in (None, u')', u'|'):
+                break
+            children.append(self.parse_not(depth))
+
+        if len(children) == 1:
+            return children[0]
+        return And(children)
+
+    def parse_not(self, depth):
+        if self.peek() == u'!':
+            self.advance()
+            return Not(self.parse_not(self.deeper(depth)))
+        return self.parse_atom(depth)
+
+    def parse_atom(self, depth):
+        token = self.advance()
+        if token is None:
+            raise TagQueryError(u"Tag query ends unexpectedly")
+        elif token == u'(':
+            node = self.parse_or(self.deeper(depth))
+            if self.advance() != u')':
+                raise TagQueryError(u"Missing ')' in tag query")
+            return node
+        elif token in (u')', u'|', u'&'):
+            raise TagQueryError(u"Unexpected '{0}' in tag query".format(token))
+
+        self.term_count += 1
+        if self.term_count > MAX_TERMS:
+            raise TagQueryError(
+                u"Tag queries are limited to {0} tags".format(MAX_TERMS))
+
+        rel, colon, name = token.partition(u':')
+        if not colon:
+            return Term(None, token)
+        elif rel not in model.user_artwork_types or not name:
+            raise TagQueryError(u"Don't know what '{0}' means".format(token))
+        return Term(rel, name)
+
+    def deeper(self, depth):
+        if depth >= MAX_DEPTH:
+            raise TagQueryError(u"Tag query is nested too deeply")
+        return depth + 1
+
+def parse(query):
+    """Parses a query string into a tree of `Term`, `And`, `Or`, and `Not`.
+    Raises `TagQueryError` if the query is malformed or too long.
+    """
+    if not query.strip():
+        raise TagQueryError(u"Tag query is empty")
+    return _Parser(tokenize(query)).parse()
+
+
+### Resolving
+
+def _terms(node):
+    if isinstance(node, (And, Or)):
+        for child in node.children:
+            for term in _terms(child):
+                yield term
+    elif isinstance(node, Not):
+        for term in _terms(node.child):
+            yield term
+    elif isinstance(node, Term):
+        yield node
+
+def simplify(node):
+    """Folds constants, flattens nested ANDs and ORs, and removes double
+    negation.  Returns a new tree, which may be `NOTHING` or `EVERYTHING`.
+    """
+    if isinstance(node, Not):
+        child = simplify(node.child)
+        if child is NOTHING:
+            return EVERYTHING
+        elif child is EVERYTHING:
+            return NOTHING
+        elif isinstance(child, Not):
+            return child.child
+        return Not(child)
+
+    elif isinstance(node, (And, Or)):
+        cls = type(node)
+        # For AND, NOTHING absorbs and EVERYTHING vanishes; OR is the reverse
+        if cls is And:
+            absorbing, identity = NOTHING, EVERYTHING
+        else:
+            absorbing, identity = EVERYTHING, NOTHING
+
+        children = []
+        for child in node.children:
+            child = simplify(child)
+            if child is absorbing:
+                return absorbing
+            elif child is identity:
+                continue
+            elif isinstance(child, cls):
+                children.extend(child.children)
+            elif child not in children:
+                children.append(child)
+
+        if not children:
+            return identity
+        elif len(children) == 1:
+            return children[0]
+        return cls(children)
+
+    return node
+
+def resolve(session, node):
+    """Looks up every name in the tree, with one query for all the tags and
+    one for all the users, plus one for any tag aliases and one for the tags
+    implying the tags found.  Returns a tuple of the simplified tree, made of
+    `Ident`s instead of `Term`s, and a sorted list of names that don't exist.
+
+    A tag that other tags imply becomes an OR of all of them.
+    """
+    terms = list(_terms(node))
+    tag_names = set(term.name for term in terms if not term.rel)
+    user_names = set(term.name for term in terms if term.rel)
+
+    tag_ids = {}
+    implying = {}
+    if tag_names:
+        tag_ids = dict(session.query(model.Tag.name, model.Tag.id)
+            .filter(model.Tag.name.in_(tag_names)))
+        missing = tag_names - set(tag_ids)
+        if missing:
+            tag_ids.update(
+                session.query(model.TagAlias.name, model.TagAlias.tag_id)
+                .filter(model.TagAlias.name.in_(missing)))
+        implying = tagrules.implying_tag_ids(session, tag_ids.values())
+    user_ids = {}
+    if user_names:
+        user_ids = dict(session.query(model.User.name, model.User.id)
+            .filter(model.User.name.in_(user_names)))
+
+    unknown = set()
+    def replace(node):
+        if isinstance(node, Term):
+            ids = user_ids if node.rel else tag_ids
+            if node.name not in ids:
+                unknown.add(unicode(node))
+                return NOTHING
+            ident_id = ids[node.name]
+            if not node.rel and ident_id in implying:
+                return Or([Ident(None, tag_id) for tag_id in
+                    sorted(implying[ident_id] | set([ident_id]))])
+            return Ident(node.rel, ident_id)
+        elif isinstance(node, Not):
+            return Not(replace(node.child))
+        elif isinstance(node, (And, Or)):
+            return type(node)([replace(child) for child in node.children])
+        return node
+
+    return simplify(replace(node)), sorted(unknown)
+
+def conjunction(node):
+    """If the tree is a plain AND of tags and users, with no ORs or NOTs,
+    returns the list of `Ident`s.  Otherwise returns None.
+
+    Such queries are the common case, and the gallery can answer them from the
+    posting index without going through `compile`.
+    """
+    if isinstance(node, Ident):
+        return [node]
+    elif isinstance(node, And) and all(
+            isinstance(child, Ident) for child in node.children):
+        return list(node.children)
+    return None
+
+def canonical(node):
+    """Returns a string describing a resolved tree, which is the same for any
+    two trees that differ only in the order of their ANDs and ORs.  Suitable
+    for a cache key.
+    """
+    if isinstance(node, Ident):
+        return u'{0}:{1:d}'.format(node.rel or u'tag', node.id)
+    elif isinstance(node, Not):
+        return u'-' + canonical(node.child)
+    elif isinstance(node, (And, Or)):
+        joiner = u' & ' if isinstance(node, And) else u' | '
+        return u'(' + joiner.join(
+            sorted(canonical(child) for child in node.children)) + u')'
+    return repr(node)
+
+
+### Compiling
+
+def cost(node):
+    """Estimates the work a resolved tree will take, as a count of scans and
+    set operations.  Runs of idents under the same AND or OR share one grouped
+    scan per kind.
+    """
+    if isinstance(node, Ident):
+        return 1
+    elif isinstance(node, Not):
+        return COMPLEMENT_COST + cost(node.child)
+    elif isinstance(node, (And, Or)):
+        total = 0
+        kinds = set()
+        for child in node.children:
+            if isinstance(child, Ident):
+                kinds.add(child.rel is None)
+            elif isinstance(node, And) and isinstance(child, Not):
+                # a AND NOT b is an EXCEPT, not a complement
+                total += 1 + cost(child.child)
+            else:
+                total += 1 + cost(child)
+        return total + len(kinds)
+    return 0
+
+def _ident_select(idents, require_all):
+    """Builds a SELECT of artwork ids matching any of the given idents, which
+    must be all tags or all users.  If `require_all` is set, only artwork
+    matching every ident is returned, via GROUP BY and HAVING COUNT.
+    """
+    if idents[0].rel is None:
+        table = model.artwork_tags
+        column = table.c.artwork_id
+        if len(idents) == 1:
+            where = table.c.tag_id == idents[0].id
+        else:
+            where = table.c.tag_id.in_([ident.id for ident in idents])
+    else:
+        table = model.UserArtwork.__table__
+        column = table.c.artwork_id
+        where = or_(*[
+            and_(table.c.user_id == ident.id,
+                table.c.relationship_type == ident.rel)
+            for ident in idents
+        ])
+
+    query = select([column.label('artwork_id')], where)
+    if require_all and len(idents) > 1:
+        query = query.group_by(column) \
+            .having(func.count() == len(idents))
+    elif len(idents) > 1:
+        query = query.distinct()
+    return query
+
+def _all_artwork():
+    return select([model.Artwork.id.label('artwork_id')])
+
+def _wrap(compound):
+    """Turns a compound select back into a plain one.  Some databases (SQLite)
+    won't nest compound selects directly.
+    """
+    subq = compound.alias()
+    return select([subq.c.artwork_id])
+
+def _compile_idents(idents, require_all):
+    """Compiles a run of idents into at most one select per kind."""
+    tags = [ident for ident in idents if ident.rel is None]
+    users = [ident for ident in idents if ident.rel is not None]
+    return [_ident_select(group, require_all) for group in (tags, users) if group]
+
+def _combine(selects, op):
+    if len(selects) == 1:
+        return selects[0]
+    return _wrap(op(*selects))
+
+def _compile(node):
+    if isinstance(node, Ident):
+        return _ident_select([node], True)
+
+    elif isinstance(node, Not):
+        return _wrap(except_(_all_artwork(), _compile(node.child)))
+
+    elif isinstance(node, Or):
+        idents = [child for child in node.children if isinstance(child, Ident)]
+        selects = _compile_idents(idents, False)
+        selects.extend(_compile(child) for child in node.children
+            if not isinstance(child, Ident))
+        return _combine(selects, union)
+
+    elif isinstance(node, And):
+        idents = [child for child in node.children if isinstance(child, Ident)]
+        negated = [child.child for child in node.children
+            if isinstance(child, Not)]
+        selects = _compile_idents(idents, True)
+        selects.extend(_compile(child) for child in node.children
+            if not isinstance(child, (Ident, Not)))
+
+        if selects:
+            positive = _combine(selects, intersect)
+        else:
+            positive = _all_artwork()
+
+        if not negated:
+            return positive
+        elif len(negated) == 1:
+            negative = _compile(negated[0])
+        else:
+            negative = _compile(Or(negated))
+        return _wrap(except_(positive, negative))
+
+    raise TypeError("Can't compile {0!r}".format(node))
+
+def compile(node):
+    """Compiles a resolved tree into a SELECT with a single `artwork_id`
+    column, suitable for an IN clause.  The tree must not be a constant.
+    Raises `TagQueryError` if the query would be too expensive.
+    """
+    if cost(node) > MAX_COST:
+        raise TagQueryError(u"Tag query is too complicated")
+    return _compile(node)
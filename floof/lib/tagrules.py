@@ -0,0 +1,189 @@
+"""Tag aliases and implications.
+
+An alias is another name for a tag: tagging something "kitty" tags it "cat"
+instead, and searching for "kitty" searches for "cat".
+
+An implication says that one tag is a kind of another: if "cat" implies
+"animal", a search for "animal" also finds art only tagged "cat".  Chains of
+implications are followed all the way, so with "tabby" implying "cat" it finds
+tabbies too.  Rather than walking the chains for every search, the
+tag_implication_closure table lists every (implied tag, implying tag) pair,
+direct or not, so expanding a tag is a single indexed lookup.
+
+Adding an implication updates the closure in place.  Removing one recomputes
+the closure for the tags it affected, and the rebuild-tag-closure batch job
+recomputes the whole thing, in case anything has drifted.
+
+Implications may not form cycles; two tags that imply each other should be
+one tag and an alias.  Changing either kind of rule changes what searches
+return, so callers should also invalidate the 'tags' gallery cache scope.
+"""
+from collections import defaultdict
+
+from sqlalchemy.sql import and_, exists, select
+
+from floof import model
+
+
+### Aliases
+
+def add_alias(session, name, tag):
+    """Makes `name` another name for `tag`.  Raises ValueError if `name` is
+    already a tag or an alias.
+    """
+    if session.query(model.Tag).filter_by(name=name).count():
+        raise ValueError(u"There's already a tag called \"{0}\"".format(name))
+    if session.query(model.TagAlias).get(name):
+        raise ValueError(u"\"{0}\" is already an alias".format(name))
+
+    session.add(model.TagAlias(name=name, tag_id=tag.id))
+    session.flush()
+
+def remove_alias(session, name, tag):
+    """Undoes `add_alias`.  Raises ValueError if `name` isn't an alias for
+    `tag`.
+    """
+    alias = session.query(model.TagAlias).get(name)
+    if alias is None or alias.tag_id != tag.id:
+        raise ValueError(u"\"{0}\" isn't an alias for \"{1}\"".format(
+            name, tag.name))
+
+    session.delete(alias)
+    session.flush()
+
+def canonical_names(session, names):
+    """Replaces any aliases in a list of tag names with the real names, and
+    drops any duplicates this causes, keeping the original order.
+    """
+    aliases = {}
+    if names:
+        aliases = dict(session.query(model.TagAlias.name, model.Tag.name)
+            .join(model.TagAlias.tag)
+            .filter(model.TagAlias.name.in_(set(names))))
+
+    seen = set()
+    result = []
+    for name in names:
+        name = aliases.get(name, name)
+        if name not in seen:
+            seen.add(name)
+            result.append(name)
+    return result
+
+
+### Implications
+
+def implying_tag_ids(session, tag_ids):
+    """Returns a dict mapping each of `tag_ids` to the set of ids of every
+    tag that implies it, directly or not.  Tags that nothing implies are left
+    out.
+    """
+    result = defaultdict(set)
+    if not tag_ids:
+        return result
+
+    closure = model.tag_implication_closure
+    for implied_tag_id, tag_id in session.execute(
+            select([closure.c.implied_tag_id, closure.c.tag_id],
+                closure.c.implied_tag_id.in_(set(tag_ids)))):
+        result[implied_tag_id].add(tag_id)
+    return result
+
+def implied_tag_ids(session, tag_id):
+    """Returns the set of ids of every tag that `tag_id` implies, directly or
+    not.
+    """
+    closure = model.tag_implication_closure
+    return set(row.implied_tag_id for row in session.execute(
+        select([closure.c.implied_tag_id], closure.c.tag_id == tag_id)))
+
+def add_implication(session, tag, implied_tag):
+    """Declares that anything tagged `tag` is also implicitly tagged
+    `implied_tag`.  Raises ValueError if that would make a cycle.
+    """
+    if tag.id == implied_tag.id or tag.id in implied_tag_ids(
+            session, implied_tag.id):
+        raise ValueError(u"\"{0}\" already implies \"{1}\"".format(
+            implied_tag.name, tag.name))
+
+    edges = model.tag_implications
+    if session.execute(select([exists().where(and_(
+            edges.c.tag_id == tag.id,
+            edges.c.implied_tag_id == implied_tag.id))])).scalar():
+        return
+    session.execute(edges.insert().values(
+        tag_id=tag.id, implied_tag_id=implied_tag.id))
+
+    # Everything that implies `tag` now implies everything `implied_tag`
+    # implies; add whichever of those pairs are new
+    lower = implying_tag_ids(session, [tag.id])[tag.id] | set([tag.id])
+    upper = implied_tag_ids(session, implied_tag.id) | set([implied_tag.id])
+
+    closure = model.tag_implication_closure
+    existing = set(session.execute(
+        select([closure.c.tag_id, closure.c.implied_tag_id], and_(
+            closure.c.tag_id.in_(lower),
+            closure.c.implied_tag_id.in_(upper)))).fetchall())
+    new_pairs = [
+        dict(tag_id=lower_id, implied_tag_id=upper_id)
+        for lower_id in lower for upper_id in upper
+        if (lower_id, upper_id) not in existing]
+    if new_pairs:
+        session.execute(closure.insert(), new_pairs)
+
+def remove_implication(session, tag, implied_tag):
+    """Undoes `add_implication`.  Other implications may still connect the two
+    tags indirectly.  Raises ValueError if `tag` doesn't directly imply
+    `implied_tag`.
+    """
+    edges = model.tag_implications
+    deleted = session.execute(edges.delete().where(and_(
+        edges.c.tag_id == tag.id,
+        edges.c.implied_tag_id == implied_tag.id))).rowcount
+    if not deleted:
+        raise ValueError(u"\"{0}\" doesn't imply \"{1}\"".format(
+            tag.name, implied_tag.name))
+
+    # Only the tags that implied `tag` can have lost anything
+    affected = implying_tag_ids(session, [tag.id])[tag.id] | set([tag.id])
+    _rebuild_closure_for(session, affected)
+
+def _reachable(edges, tag_id):
+    """Returns every tag id reachable from `tag_id` in a dict of edge sets."""
+    seen = set()
+    pending = [tag_id]
+    while pending:
+        for implied_id in edges.get(pending.pop(), ()):
+            if implied_id not in seen:
+                seen.add(implied_id)
+                pending.append(implied_id)
+    seen.discard(tag_id)
+    return seen
+
+def _rebuild_closure_for(session, tag_ids):
+    """Recomputes the closure rows for the implications of `tag_ids`, or for
+    every tag if `tag_ids` is None.
+    """
+    table = model.tag_implications
+    edges = defaultdict(set)
+    for tag_id, implied_tag_id in session.execute(
+            select([table.c.tag_id, table.c.implied_tag_id])):
+        edges[tag_id].add(implied_tag_id)
+
+    closure = model.tag_implication_closure
+    if tag_ids is None:
+        tag_ids = list(edges)
+        session.execute(closure.delete())
+    elif tag_ids:
+        session.execute(closure.delete().where(closure.c.tag_id.in_(tag_ids)))
+
+    pairs = [
+        dict(tag_id=tag_id, implied_tag_id=implied_tag_id)
+        for tag_id in tag_ids
+        for implied_tag_id in _reachable(edges, tag_id)]
+    if pairs:
+        session.execute(closure.insert(), pairs)
+
+def rebuild_closure(session):
+    """Recomputes the whole closure table from the direct implications."""
+    _rebuild_closure_for(session, None)
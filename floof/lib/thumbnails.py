@@ -0,0 +1,312 @@
+"""Making thumbnails, out of the way of the request that uploaded the art.
+
+Decoding and shrinking a big image can take seconds, so `upload` doesn't wait
+for it.  `generate_later` queues the thumbnail to be made once the upload's
+transaction commits, by a pool of worker processes -- processes rather than
+threads, so several uploads at once actually use several cores.  Each job
+fetches the original back out of the filestore and stores the thumbnail
+through a filestore of its own.
+
+Until a thumbnail exists, the filestore view serves a placeholder and calls
+`ensure`, which queues the thumbnail again; that also covers jobs lost to a
+restart.  Each process only has one job per artwork queued at a time.  The
+generate-thumbnails batch job makes any that are missing.
+
+The pool has `thumbnail.workers` processes, by default one per CPU, and is
+started along with the app; see `start`.  With zero, or in a process that
+never starts it, thumbnails are made by the process itself, right after the
+commit.
+Other jobs can use the pool too, through `run`; see `floof.lib.renditions`.
+"""
+from __future__ import absolute_import, division
+
+from contextlib import closing
+from cStringIO import StringIO
+import logging
+import multiprocessing
+import shutil
+import tempfile
+import threading
+import traceback
+import urllib2
+
+try:
+    import Image
+except ImportError:
+    from PIL import Image
+import transaction
+
+from floof import model
+from floof.model.filestore import get_storage_factory
+
+log = logging.getLogger(__name__)
+
+FORMATS = {
+    u'image/png': 'PNG',
+    u'image/gif': 'GIF',
+    u'image/jpeg': 'JPEG',
+}
+# To avoid super-skinny thumbnails, don't let the aspect ratio go beyond this
+MAX_ASPECT_RATIO = 2
+# Images with more pixels than this aren't accepted at all; override with the
+# `thumbnail.max_pixels` setting
+MAX_PIXELS = 100000000
+# How much of an original to hold in memory at once while fetching it
+CHUNK_SIZE = 64 * 1024
+
+_settings = None
+_workers = 0
+_pool = None
+_pending = set()
+_lock = threading.Lock()
+
+def configure(settings):
+    """Remembers the filestore and thumbnail settings, to be handed to each
+    job.  Call once at startup.
+    """
+    global _settings, _workers
+
+    _settings = dict((key, value) for key, value in settings.iteritems()
+        if key == 'filestore' or key.startswith('filestore.'))
+    _settings['thumbnail_size'] = int(settings['thumbnail_size'])
+    _settings['max_pixels'] = int(
+        settings.get('thumbnail.max_pixels', MAX_PIXELS))
+
+    # Newer PILs have a decompression bomb check of their own, which raises
+    # from Image.open itself past twice its limit.  Everything in floof that
+    # opens an image checks `too_many_pixels` first instead, which follows the
+    # setting and lets uploads be rejected politely
+    if hasattr(Image, 'MAX_IMAGE_PIXELS'):
+        Image.MAX_IMAGE_PIXELS = None
+
+    workers = settings.get('thumbnail.workers')
+    if workers is None:
+        _workers = multiprocessing.cpu_count()
+    else:
+        _workers = int(workers)
+
+
+### Making them
+
+def fetch(url, directory=None):
+    """Copies the file at `url` into a temporary file in `directory`, a chunk
+    at a time, and returns it rewound.  Originals can be far bigger than
+    anything worth holding in memory.
+    """
+    fileobj = tempfile.TemporaryFile(dir=directory)
+    try:
+        shutil.copyfileobj(urllib2.urlopen(url), fileobj, CHUNK_SIZE)
+    except:
+        fileobj.close()
+        raise
+    fileobj.seek(0)
+    return fileobj
+
+def too_many_pixels(image, max_pixels=None):
+    """Returns whether `image` has more pixels than `max_pixels`, by default
+    the `thumbnail.max_pixels` setting.  This only needs the header, so check
+    it before anything decodes the image; a small file can claim to be huge.
+    """
+    if max_pixels is None:
+        max_pixels = _settings['max_pixels'] if _settings else MAX_PIXELS
+    width, height = image.size
+    return width * height > max_pixels
+
+def shrink(image, box, new_size):
+    """Crops `image` to `box`, a (width, height) from the top left corner,
+    then resizes it to `new_size`.  Returns a new image.
+
+    Pass an image straight from `Image.open`, before it's been decoded, so
+    that big JPEGs can be decoded at reduced size.
+    """
+    full_width, full_height = image.size
+    width, height = box
+
+    # JPEG can decode at 1/2, 1/4 or 1/8 scale for next to nothing; this gets
+    # the smallest of those that's still no smaller than we need.  Other
+    # formats ignore it
+    image.draft(image.mode, (
+        -(-full_width * new_size[0] // width),
+        -(-full_height * new_size[1] // height)))
+    x_scale = image.size[0] / full_width
+    y_scale = image.size[1] / full_height
+
+    # crop() takes left, top, right, bottom.  It makes a copy, so skip it if
+    # it wouldn't do anything
+    box = (0, 0,
+        min(image.size[0], int(round(width * x_scale))),
+        min(image.size[1], int(round(height * y_scale))))
+    if box[2:] != image.size:
+        image = image.crop(box)
+
+    if image.size != new_size:
+        image = image.resize(new_size, Image.ANTIALIAS)
+    return image
+
+def make_thumbnail(image, size):
+    """Crops `image` to a sane aspect ratio and shrinks it to fit in a square
+    of `size` pixels.  Returns a new image.
+    """
+    full_width, full_height = image.size
+    height = min(full_height, full_width * MAX_ASPECT_RATIO)
+    width = min(full_width, height * MAX_ASPECT_RATIO)
+
+    if width > size or height > size:
+        if width > height:
+            new_size = (size, height * size // width)
+        else:
+            new_size = (width * size // height, size)
+    else:
+        new_size = (width, height)
+
+    return shrink(image, (width, height), new_size)
+
+def generate(settings, hash, mimetype):
+    """Makes and stores the thumbnail for the artwork with this `hash`, unless
+    it already exists.  Returns True if it made one.
+
+    This runs in a pool process, so it takes the settings it needs rather than
+    relying on `configure`.
+    """
+    storage_factory = get_storage_factory(settings)
+    if storage_factory().exists(u'thumbnail', hash):
+        return False
+
+    url = storage_factory().url(u'artwork', hash)
+    if url is None:
+        raise IOError("Artwork {0} is missing from storage".format(hash))
+    with closing(fetch(url, storage_factory().spool_directory)) as original:
+        image = Image.open(original)
+        if too_many_pixels(image, settings['max_pixels']):
+            raise ValueError("Artwork {0} is too big to decode".format(hash))
+
+        buf = StringIO()
+        make_thumbnail(image, settings['thumbnail_size']) \
+            .save(buf, FORMATS[mimetype])
+    buf.seek(0)
+    return store(storage_factory, u'thumbnail', hash, buf)
+
+def store(storage_factory, class_, key, fileobj):
+    """Stores a freshly made file, in a transaction of its own, since in a web
+    process the request's may be finishing around us.  Returns False if
+    someone else stored it first.
+
+    Only one job per file runs at a time in each process, but another process
+    can still get there while this one is working; either copy will do.
+    """
+    manager = transaction.TransactionManager()
+    storage = storage_factory()
+    manager.begin().join(storage)
+    storage.put(class_, key, fileobj)
+    try:
+        manager.commit()
+    except IOError:
+        # The local filestore refuses to overwrite
+        manager.abort()
+        if storage_factory().exists(class_, key):
+            return False
+        raise
+    return True
+
+def _run(settings, hash, mimetype):
+    """Runs one job in a pool process.  Returns the `hash` and a traceback if
+    it failed, since the pool can't report errors to a callback itself.
+    """
+    try:
+        generate(settings, hash, mimetype)
+    except Exception:
+        return hash, traceback.format_exc()
+    return hash, None
+
+
+### Queueing them
+
+def start():
+    """Starts this process's pool, if it's to have one.  Call once at startup,
+    after `configure` and before opening any connections or serving anything:
+    Python 2 can only fork the pool, and a fork from a busy threaded server
+    copies whatever locks and sockets it holds.  Without a pool, jobs run
+    right where they're asked for, as batch jobs want.
+    """
+    global _pool
+
+    if _workers and _pool is None:
+        _pool = multiprocessing.Pool(_workers)
+
+def _finished(result):
+    hash, error = result
+    if error:
+        log.error("Couldn't make a thumbnail for {0}:\n{1}".format(
+            hash, error))
+
+    with _lock:
+        _pending.discard(hash)
+
+def ensure(hash, mimetype):
+    """Queues the thumbnail for the artwork with this `hash` right away,
+    unless it's already queued.
+    """
+    with _lock:
+        if hash in _pending:
+            return
+        _pending.add(hash)
+
+        args = (_settings, hash, mimetype)
+        if _pool is not None:
+            _pool.apply_async(_run, args, callback=_finished)
+            return
+
+    _finished(_run(*args))
+
+def run(function, *args):
+    """Calls `function` with the job settings and `args` on the pool, and
+    waits for its result.  `function` must be importable by name.
+    """
+    args = (_settings,) + args
+    if _pool is not None:
+        return _pool.apply(function, args)
+    return function(*args)
+
+def submit(function, callback, *args):
+    """Like `run`, but doesn't wait: `callback` gets the result, once there
+    is one.  `function` should catch its own errors and return them, since the
+    pool can't report them to the callback.
+    """
+    args = (_settings,) + args
+    if _pool is not None:
+        _pool.apply_async(function, args, callback=callback)
+    else:
+        callback(function(*args))
+
+def generate_later(hash, mimetype):
+    """Queues the thumbnail for the artwork with this `hash` once the current
+    transaction commits; until then, the original isn't in the filestore.
+    """
+    def hook(success):
+        if success:
+            ensure(hash, mimetype)
+
+    transaction.get().addAfterCommitHook(hook)
+
+
+### Catching up
+
+def _run_job(job):
+    return _run(*job)
+
+def backfill(session, processes=None):
+    """Makes every missing thumbnail, across a pool of `processes` processes
+    (by default, one per CPU).
+    """
+    jobs = [(_settings, hash, mimetype) for hash, mimetype in
+        session.query(model.Artwork.hash, model.Artwork.mime_type)]
+
+    pool = multiprocessing.Pool(processes)
+    try:
+        for hash, error in pool.imap_unordered(_run_job, jobs, 16):
+            if error:
+                log.warning("Couldn't make a thumbnail for {0}:\n{1}".format(
+                    hash, error))
+    finally:
+        pool.close()
+        pool.join()
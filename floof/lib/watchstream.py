@@ -0,0 +1,96 @@
+"""Maintenance of the materialized watchstream inbox.
+
+Every user's watchstream lives in the `watchstream_entries` table, one row per
+(watcher, artwork).  Rows are fanned out when art is uploaded, and a user's
+rows are rebuilt from scratch whenever they change a watch.  `backfill` will
+rebuild every user's inbox, for populating the table from existing data.
+"""
+from sqlalchemy.sql import and_, case, or_
+
+from floof import model
+
+def _watched_artwork_ids(session, user_id):
+    """Returns the set of artwork ids that ought to appear in the given user's
+    watchstream, computed the slow way from the watch and artwork tables.
+    """
+    # Check for by/for/of watching
+    related = session.query(model.UserArtwork.artwork_id) \
+        .join((model.UserWatch,
+            model.UserArtwork.user_id == model.UserWatch.other_user_id)) \
+        .filter(model.UserWatch.user_id == user_id) \
+        .filter(case(
+            value=model.UserArtwork.relationship_type,
+            whens={
+                u'by': model.UserWatch.watch_by,
+                u'for': model.UserWatch.watch_for,
+                u'of': model.UserWatch.watch_of,
+            },
+        ))
+
+    # Check for upload watching
+    uploaded = session.query(model.Artwork.id) \
+        .join((model.UserWatch,
+            model.Artwork.uploader_user_id == model.UserWatch.other_user_id)) \
+        .filter(model.UserWatch.user_id == user_id) \
+        .filter(model.UserWatch.watch_upload == True)  # gross
+
+    return set(id for (id,) in related) | set(id for (id,) in uploaded)
+
+def _insert_entries(session, rows):
+    if rows:
+        session.execute(model.WatchstreamEntry.__table__.insert(), rows)
+
+def fan_out(session, artwork):
+    """Adds `artwork` to the watchstream of everyone watching its uploader or
+    any of its related users.  Call this after the artwork and its
+    `user_artwork` rows have been flushed.
+    """
+    watch_flags = {
+        u'by': model.UserWatch.watch_by,
+        u'for': model.UserWatch.watch_for,
+        u'of': model.UserWatch.watch_of,
+    }
+
+    clauses = [and_(
+        model.UserWatch.other_user_id == artwork.uploader_user_id,
+        model.UserWatch.watch_upload == True,
+    )]
+    for user_artwork in artwork.user_artwork:
+        clauses.append(and_(
+            model.UserWatch.other_user_id == user_artwork.user_id,
+            watch_flags[user_artwork.relationship_type] == True,
+        ))
+
+    watcher_ids = set(id for (id,) in
+        session.query(model.UserWatch.user_id).filter(or_(*clauses)))
+    existing_ids = set(id for (id,) in
+        session.query(model.WatchstreamEntry.user_id)
+            .filter_by(artwork_id=artwork.id))
+
+    _insert_entries(session, [
+        dict(user_id=user_id, artwork_id=artwork.id)
+        for user_id in watcher_ids - existing_ids
+    ])
+
+def _rebuild(session, user_id):
+    session.query(model.WatchstreamEntry) \
+        .filter_by(user_id=user_id) \
+        .delete(synchronize_session=False)
+
+    _insert_entries(session, [
+        dict(user_id=user_id, artwork_id=artwork_id)
+        for artwork_id in _watched_artwork_ids(session, user_id)
+    ])
+
+def rebuild(session, user):
+    """Recomputes `user`'s entire watchstream.  Call this after changing any
+    of their watches.
+    """
+    session.flush()
+    _rebuild(session, user.id)
+
+def backfill(session):
+    """Rebuilds the watchstream of every user who is watching anyone."""
+    user_ids = session.query(model.UserWatch.user_id).distinct().all()
+    for (user_id,) in user_ids:
+        _rebuild(session, user_id)
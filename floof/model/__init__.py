@@ -8,7 +8,7 @@ import random
 import re
 import string
 
-from sqlalchemy import Column, ForeignKey, MetaData, Table, and_
+from sqlalchemy import Column, ForeignKey, Index, MetaData, Table, and_
 from sqlalchemy.ext.associationproxy import association_proxy
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import backref, class_mapper, relation, subqueryload, validates
@@ -33,6 +33,7 @@ def initialize(engine, extension=None):
     session.configure(bind=engine, extension=extension)
     TableBase.metadata.bind = engine
     #TableBase.metadata.create_all()
+    add_sqlite_functions(engine)
 
 
 def now():
@@ -210,6 +211,7 @@ class Artwork(TableBase):
     rating_count = Column(Integer, nullable=False, default=0)
     rating_sum = Column(Float, nullable=False, default=0)
     rating_score = Column(Float, nullable=True, default=None)
+    hot_score = Column(Float, nullable=False, default=default_hot_score)
     # TODO should this (and the comment prose) be a special column type?
     remark = Column(UnicodeText, nullable=False, default=u'')
 
@@ -250,6 +252,18 @@ class Artwork(TableBase):
 
         return u'.'.join(filename_parts)
 
+# Composite indexes matching GallerySieve's sort orders: each is descending by
+# one column, then by id to break ties.  These let keyset paging seek directly
+# to any page
+Index('ix_artwork_uploaded_time_id',
+    Artwork.__table__.c.uploaded_time, Artwork.__table__.c.id)
+Index('ix_artwork_rating_score_id',
+    Artwork.__table__.c.rating_score, Artwork.__table__.c.id)
+Index('ix_artwork_rating_count_id',
+    Artwork.__table__.c.rating_count, Artwork.__table__.c.id)
+Index('ix_artwork_hot_score_id',
+    Artwork.__table__.c.hot_score, Artwork.__table__.c.id)
+
 
 # Dynamic subclasses of the 'artwork' table for storing metadata for different
 # types of media
@@ -265,6 +279,8 @@ class MediaImage(Artwork):
     length = Column(Time, nullable=True)
     # jpeg only
     quality = Column(Integer, nullable=True)
+    # Perceptual hash, for spotting reposts; see floof.lib.imagehash
+    dhash = Column(Unicode(16), nullable=True)
 
 class MediaText(Artwork):
     __tablename__ = 'media_text'
@@ -281,6 +297,44 @@ class UserArtwork(TableBase):
     artwork_id = Column(Integer, ForeignKey('artwork.id'), primary_key=True, nullable=False)
     relationship_type = Column(Enum(*user_artwork_types, name='user_artwork_relationship_type'), primary_key=True, nullable=False)
 
+class WatchstreamEntry(TableBase):
+    """A single piece of art in a single user's watchstream.
+
+    This is a materialized copy of what joining `user_watches` to
+    `user_artwork` would produce, so reading a watchstream is a range scan over
+    one user's rows.  It's filled in by floof.lib.watchstream whenever art is
+    uploaded or a watch changes.
+    """
+    __tablename__ = 'watchstream_entries'
+    user_id = Column(Integer, ForeignKey('users.id'), primary_key=True, nullable=False)
+    artwork_id = Column(Integer, ForeignKey('artwork.id'), primary_key=True, nullable=False, index=True)
+
+class GalleryCount(TableBase):
+    """The number of artworks matching a single gallery filter, such as one tag
+    or one user relationship, so countable galleries needn't COUNT on every
+    page view.  Kept up to date by floof.lib.counts.
+    """
+    __tablename__ = 'gallery_counts'
+    key = Column(Unicode(64), primary_key=True, nullable=False)
+    count = Column(Integer, nullable=False)
+    # When a new count is to be checked, in case it raced with a write
+    recount_time = Column(TZDateTime)
+
+class RatingLeaderboard(TableBase):
+    """One entry in the top-rated art for a time window, such as the last
+    week, so sorting by rating is an index scan over one window's rows.  Kept
+    up to date by floof.lib.leaderboards.
+    """
+    __tablename__ = 'rating_leaderboards'
+    window = Column(Unicode(8), primary_key=True, nullable=False)
+    artwork_id = Column(Integer, ForeignKey('artwork.id'), primary_key=True, nullable=False)
+    rating_score = Column(Float, nullable=False)
+
+Index('ix_rating_leaderboards_window_rating_score',
+    RatingLeaderboard.__table__.c.window,
+    RatingLeaderboard.__table__.c.rating_score,
+    RatingLeaderboard.__table__.c.artwork_id)
+
 class ArtworkRating(TableBase):
     """The rating that a single user has given a single piece of art"""
     __tablename__ = 'artwork_ratings'
@@ -541,10 +595,15 @@ class Tag(TableBase):
     __tablename__ = 'tags'
     id = Column(Integer, primary_key=True)
     name = Column(Unicode(64), unique=True)
+    # Number of artworks with this tag.  Kept up to date by floof.lib.counts.
+    usage_count = Column(Integer, nullable=False, default=0)
 
     def __init__(self, name):
         self.name = name
 
+Index('ix_tags_usage_count_id',
+    Tag.__table__.c.usage_count, Tag.__table__.c.id)
+
 class Label(TableBase):
     __tablename__ = 'labels'
     id = Column(Integer, primary_key=True)
@@ -557,6 +616,28 @@ artwork_tags = Table('artwork_tags', TableBase.metadata,
     Column('tag_id', Integer, ForeignKey('tags.id'), primary_key=True),
 )
 
+class TagAlias(TableBase):
+    """Another name for a tag, which is quietly replaced by the real one."""
+    __tablename__ = 'tag_aliases'
+    name = Column(Unicode(64), primary_key=True, nullable=False)
+    tag_id = Column(Integer, ForeignKey('tags.id'), nullable=False)
+
+# Direct implications, as entered: tag_id implies implied_tag_id
+tag_implications = Table('tag_implications', TableBase.metadata,
+    Column('tag_id', Integer, ForeignKey('tags.id'), primary_key=True),
+    Column('implied_tag_id', Integer, ForeignKey('tags.id'), primary_key=True),
+)
+
+# Transitive closure of the above, maintained by floof.lib.tagrules.  The key
+# leads with the implied tag, so finding everything that implies a tag is a
+# single range scan
+tag_implication_closure = Table('tag_implication_closure', TableBase.metadata,
+    Column('implied_tag_id', Integer, ForeignKey('tags.id'), primary_key=True),
+    Column('tag_id', Integer, ForeignKey('tags.id'), primary_key=True),
+)
+Index('ix_tag_implication_closure_tag_id',
+    tag_implication_closure.c.tag_id)
+
 artwork_labels = Table('artwork_labels', TableBase.metadata,
     Column('artwork_id', Integer, ForeignKey('artwork.id'), primary_key=True),
     Column('label_id', Integer, ForeignKey('labels.id'), primary_key=True),
@@ -618,6 +699,14 @@ UserProfileRevision.updated_by = relation(User, innerjoin=True,
 #Artwork.discussion = relation(Discussion, backref='artwork')
 Artwork.tag_objs = relation(Tag, secondary=artwork_tags, backref=backref('artwork', innerjoin=True))
 Artwork.tags = association_proxy('tag_objs', 'name', creator=get_or_create_tag)
+
+# Tags
+Tag.aliases = relation(TagAlias, order_by=TagAlias.name,
+    backref=backref('tag', innerjoin=True))
+Tag.implies = relation(Tag, secondary=tag_implications,
+    primaryjoin=Tag.id == tag_implications.c.tag_id,
+    secondaryjoin=Tag.id == tag_implications.c.implied_tag_id,
+    order_by=Tag.name, backref=backref('implied_by', order_by=Tag.name))
 Artwork.uploader = relation(User, innerjoin=True,
     backref='uploaded_artwork')
 Artwork.user_artwork = relation(UserArtwork,
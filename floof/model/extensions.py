@@ -1,9 +1,18 @@
 # encoding: utf8
 from __future__ import division
 
-from math import sqrt
+import calendar
+import datetime
+from math import log, sqrt
 
+import pytz
+
+from sqlalchemy import event
+from sqlalchemy.ext.compiler import compiles
 from sqlalchemy.orm.interfaces import AttributeExtension
+from sqlalchemy.sql import func
+from sqlalchemy.sql.expression import FunctionElement
+from sqlalchemy.types import Float
 
 def wilson_score(n, total):
     """Given a number of normalized [-1, 1] ratings and their total, calculates
@@ -33,6 +42,95 @@ def recalc_wilson_score(artwork):
     else:
         artwork.rating_score = None
 
+# Popularity halves in this many seconds, as far as "trending" is concerned
+HOT_HALF_LIFE = 86400
+
+def hot_score(rating_count, rating_score, uploaded_time):
+    """Calculates how "hot" a piece of art is: its popularity, halved for
+    every `HOT_HALF_LIFE` of its age.
+
+    Decaying by age would mean rescoring everything constantly, so this is
+    the log of that instead, with the current time dropped -- it's the same
+    for everything, so the order comes out the same.  That leaves log2 of
+    popularity plus upload time in half-lives, which only changes with the
+    ratings.
+    """
+    # Roughly the number of positive ratings, plus one so the log is defined
+    popularity = 1 + rating_count * (1 + (rating_score or 0)) / 2
+    uploaded = calendar.timegm(uploaded_time.utctimetuple())
+    return log(popularity, 2) + uploaded / HOT_HALF_LIFE
+
+def recalc_hot_score(artwork):
+    artwork.hot_score = hot_score(artwork.rating_count, artwork.rating_score,
+        artwork.uploaded_time or datetime.datetime.now(pytz.utc))
+
+def default_hot_score(context):
+    """Column default for new art, which has no ratings yet."""
+    uploaded_time = context.current_parameters.get('uploaded_time') \
+        or datetime.datetime.now(pytz.utc)
+    return hot_score(0, None, uploaded_time)
+
+def recalc_rating_scores(artwork):
+    recalc_wilson_score(artwork)
+    recalc_hot_score(artwork)
+
+class epoch_seconds(FunctionElement):
+    """SQL for the seconds between the epoch and a naive UTC timestamp, like
+    `calendar.timegm`.  Every database spells this differently.
+    """
+    type = Float()
+    name = 'epoch_seconds'
+
+@compiles(epoch_seconds)
+def _compile_epoch_seconds(element, compiler, **kw):
+    # SQLite
+    return "CAST(strftime('%s', {0}) AS FLOAT)".format(
+        compiler.process(element.clauses))
+
+@compiles(epoch_seconds, 'postgresql')
+def _compile_epoch_seconds_postgresql(element, compiler, **kw):
+    return "EXTRACT(EPOCH FROM {0})".format(compiler.process(element.clauses))
+
+@compiles(epoch_seconds, 'mysql')
+def _compile_epoch_seconds_mysql(element, compiler, **kw):
+    return "TIMESTAMPDIFF(SECOND, '1970-01-01', {0})".format(
+        compiler.process(element.clauses))
+
+def _sqlite_ln(x):
+    if x is None or x <= 0:
+        return None
+    return log(x)
+
+def add_sqlite_functions(engine):
+    """SQLite only has ln() when it's built with its math functions, which
+    many aren't.  Gives every new connection to `engine` one of our own, for
+    `hot_score_clause`.  Other databases are left alone.
+    """
+    if engine.dialect.name != 'sqlite':
+        return
+
+    def connect(dbapi_connection, connection_record):
+        dbapi_connection.create_function('ln', 1, _sqlite_ln)
+
+    event.listen(engine, 'connect', connect)
+
+def hot_score_clause(rating_count, rating_score, uploaded_time):
+    """`hot_score`, as SQL over the given columns."""
+    popularity = 1 + rating_count * (1 + func.coalesce(rating_score, 0)) / 2
+    return func.ln(popularity) / log(2) \
+        + epoch_seconds(uploaded_time) / HOT_HALF_LIFE
+
+def recompute_hot_scores(bind, table):
+    """Recomputes the "trending" score of every artwork in `table`, in one
+    UPDATE.
+
+    Rating changes keep each score current, and the scores don't decay with
+    time, so this only needs running after the formula changes or to mop up
+    any drift.
+    """
+    bind.execute(table.update().values(hot_score=hot_score_clause(
+        table.c.rating_count, table.c.rating_score, table.c.uploaded_time)))
+
 class RatingAttributeExtension(AttributeExtension):
     """AttributeExtension to act on the change of a rating.  Updates
        the rating_sum of the artwork"""
@@ -51,7 +149,7 @@ class RatingAttributeExtension(AttributeExtension):
         artwork = rating_obj.artwork
         if artwork:
             artwork.rating_sum = artwork.rating_sum - oldrating + rating
-            recalc_wilson_score(artwork)
+            recalc_rating_scores(artwork)
         return rating
 
 class ArtworkRatingsAttributeExtension(AttributeExtension):
@@ -64,7 +162,7 @@ class ArtworkRatingsAttributeExtension(AttributeExtension):
         artwork = state.obj()
         artwork.rating_count += 1
         artwork.rating_sum += rating_obj.rating
-        recalc_wilson_score(artwork)
+        recalc_rating_scores(artwork)
 
         return rating_obj
 
@@ -72,7 +170,7 @@ class ArtworkRatingsAttributeExtension(AttributeExtension):
         artwork = state.obj()
         artwork.rating_count -= 1
         artwork.rating_sum -= rating_obj.rating
-        recalc_wilson_score(artwork)
+        recalc_rating_scores(artwork)
 
         return rating_obj
 
@@ -80,7 +178,7 @@ class ArtworkRatingsAttributeExtension(AttributeExtension):
         artwork = state.obj()
         artwork.rating_sum = (
             artwork.rating_sum - oldrating_obj.rating + rating_obj.rating)
-        recalc_wilson_score(artwork)
+        recalc_rating_scores(artwork)
 
         return rating_obj
 
@@ -14,12 +14,21 @@ A storage object factory can be retrieved through :func:`get_storage_factory`.
 """
 
 from __future__ import absolute_import
-from cStringIO import StringIO
+import errno
+import logging
+import os
 import shutil
+import tempfile
 
 from pyramid.util import DottedNameResolver
 import transaction
 
+log = logging.getLogger(__name__)
+
+# Staged files bigger than this many bytes are spooled to disk rather than
+# kept in memory; override with the `filestore.spool_threshold` setting
+SPOOL_THRESHOLD = 1048576  # 1 MiB
+
 
 def get_storage_factory(settings, prefix='filestore'):
     """Uses a Pyramid deployment settings dictionary to construct and return
@@ -62,8 +71,10 @@ def get_storage_factory(settings, prefix='filestore'):
 # 3. add notion of file class for all filestorages; local can either ignore or use subdirectories
 # fix this impl-per-module nonsense
 class FileStorage(object):
-    """Implements a staging dictionary to temporarily hold in StringIO objects
-    copies of all file objects that are passed to :meth`put`.
+    """Implements a staging dictionary to temporarily hold copies of all file
+    objects that are passed to :meth:`put`.  Small files are held in memory
+    and big ones spooled to disk.  Files that are already on disk can be
+    staged with :meth:`put_path` instead, which avoids copying them at all.
 
     Child classes must implement :meth:`url` and the Zope transaction `data
     manager` methods according to their actual backends.
@@ -71,21 +82,73 @@ class FileStorage(object):
     See: http://www.zodb.org/zodbbook/transactions.html
 
     """
-    def __init__(self, transaction_manager, **kwargs):
+    # Where callers should spool incoming files that are headed for this
+    # storage; None means the system default temporary directory
+    spool_directory = None
+
+    def __init__(self, transaction_manager, spool_threshold=SPOOL_THRESHOLD,
+            **kwargs):
         self.transaction_manager = transaction_manager
+        self.spool_threshold = int(spool_threshold)
         self.stage = {}
+        # Files staged by `put_path`, by staging index; these are our own
+        # links, removed when the transaction finishes unless a subclass has
+        # moved them somewhere already
+        self.staged_paths = {}
 
     def put(self, class_, key, fileobj):
         """Stages the data in the `fileobj` for subsequent commital under the
         given `class_` and `key`."""
 
-        stageobj = StringIO()
+        stageobj = tempfile.SpooledTemporaryFile(
+            max_size=self.spool_threshold, dir=self.spool_directory)
         shutil.copyfileobj(fileobj, stageobj)
         fileobj.seek(0)
         stageobj.seek(0)
 
+        self._stage(class_, key, stageobj)
+
+    def put_path(self, class_, key, path):
+        """Stages the file at `path`, like :meth:`put`, but without reading
+        it.  The file is hard-linked into :attr:`spool_directory` (or copied,
+        if that's on another filesystem), so the caller may go on to delete
+        its own copy.
+        """
+        fd, staged_path = tempfile.mkstemp(dir=self.spool_directory)
+        os.close(fd)
+        try:
+            # Swap the placeholder for a second name for the same file
+            link_path = staged_path + '.link'
+            os.link(path, link_path)
+            os.rename(link_path, staged_path)
+        except OSError:
+            shutil.copyfile(path, staged_path)
+
+        idx = self._stage(class_, key, open(staged_path, 'rb'))
+        self.staged_paths[idx] = staged_path
+
+    def _stage(self, class_, key, stageobj):
+        """Adds a file object to the stage, replacing anything already staged
+        under the same name.  Returns the staging index."""
         idx = self._idx(class_, key)
+        self._unstage(idx)
         self.stage[idx] = (class_, key, stageobj)
+        return idx
+
+    def _unstage(self, idx):
+        """Closes and forgets one staged file, deleting it if it was staged
+        by path."""
+        if idx in self.stage:
+            self.stage.pop(idx)[2].close()
+
+        path = self.staged_paths.pop(idx, None)
+        if path is None:
+            return
+        try:
+            os.remove(path)
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                log.error("Failed to delete staged file '{0}'".format(path))
 
     def _idx(self, class_, key):
         """Index for use in the staging dict."""
@@ -98,7 +161,10 @@ class FileStorage(object):
         outcome.  (i.e. at the end of :meth:`abort`, :meth:`tpc_finish` and
         :meth:`tpc_abort`.)
         """
+        for idx in list(self.stage):
+            self._unstage(idx)
         self.stage = {}
+        self.staged_paths = {}
 
     def sortKey(self):
         """Return a string by which to sort the commit order for transactions
@@ -113,6 +179,35 @@ class FileStorage(object):
         """
         raise NotImplementedError
 
+    def committed_url(self, class_, key):
+        """Returns a URL for this file if it has been committed to storage, or
+        None.  Where :meth:`url` can already tell, this is the same lookup;
+        use it rather than :meth:`exists` followed by :meth:`url`.
+        """
+        return self.url(class_, key)
+
+    def exists(self, class_, key):
+        """Returns whether this file has been committed to storage."""
+        return self.committed_url(class_, key) is not None
+
+    ### Cache management
+    # These act immediately rather than at commit, and are meant for classes
+    # of file that only cache something else, such as renditions
+
+    def touch(self, class_, key):
+        """Records that this file was just used, for :meth:`usage`.  Storages
+        that can't track this may ignore it."""
+        pass
+
+    def usage(self, class_):
+        """Yields a (key, size in bytes, time last used as a timestamp) tuple
+        for every file of this class."""
+        raise NotImplementedError
+
+    def delete(self, class_, key):
+        """Deletes this file, if it exists."""
+        raise NotImplementedError
+
     def abort(self, transaction):
         """Run if the transaction is aborted before the two-stage commit
         process begins."""
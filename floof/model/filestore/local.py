@@ -2,6 +2,7 @@
 
 from __future__ import absolute_import
 
+import errno
 import logging
 import os
 import shutil
@@ -42,12 +43,48 @@ class FileStorage(BaseFileStorage):
                 if not os.path.isdir(self.tempdir):
                     raise IOError("Unable to make temporary directory '{0}'"
                                   .format(self.tempdir))
+        # Same filesystem as the destination, so spooled files can be moved
+        # into place cheaply
+        self.spool_directory = self.tempdir
 
         self.tempfiles = {}
 
     def url(self, class_, key):
         return 'file://' + self._path(self.directory, class_, key).encode('utf8')
 
+    def committed_url(self, class_, key):
+        # url() can't tell; it always returns a path
+        if os.path.isfile(self._path(self.directory, class_, key)):
+            return self.url(class_, key)
+        return None
+
+    def touch(self, class_, key):
+        # The modification time stands in for the access time, which is too
+        # often turned off
+        try:
+            os.utime(self._path(self.directory, class_, key), None)
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+
+    def usage(self, class_):
+        root = os.path.join(self.directory, class_)
+        for dirpath, dirnames, filenames in os.walk(root):
+            for filename in filenames:
+                try:
+                    stat = os.stat(os.path.join(dirpath, filename))
+                except OSError:
+                    # Deleted since the listing
+                    continue
+                yield filename, stat.st_size, stat.st_mtime
+
+    def delete(self, class_, key):
+        try:
+            os.remove(self._path(self.directory, class_, key))
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+
     def _path(self, prefix, class_, key):
         """Store the file under class/k/e/y/key."""
         long_key = key + '__'
@@ -70,6 +107,12 @@ class FileStorage(BaseFileStorage):
         permission errors and filesystem capacity errors."""
 
         for idx, (class_, key, stageobj) in self.stage.iteritems():
+            if idx in self.staged_paths:
+                # Already a file of its own in the temporary directory; it
+                # only needs moving into place
+                self.tempfiles[idx] = self.staged_paths[idx]
+                continue
+
             fd, path = tempfile.mkstemp(dir=self.tempdir)
             self.tempfiles[idx] = path
             fileobj = os.fdopen(fd, 'w')
@@ -40,6 +40,9 @@ class FileStorage(BaseFileStorage):
         else:
             return None
 
+    def delete(self, class_, key):
+        self.client.delete(self._identifier(class_, key))
+
     def _identifier(self, class_, key):
         """Use class:key as the identifier within mogile."""
         return u':'.join((class_, key))
@@ -0,0 +1,42 @@
+// Suggest existing tags while typing into any input with a data-complete-url.
+// Inputs hold several space-separated tags, so only the last one is completed.
+$(document).ready(function() {
+    $('input[data-complete-url]').each(function() {
+        var input = $(this);
+        var url = input.attr('data-complete-url');
+
+        var last_word = function(value) {
+            var words = value.split(/\s+/);
+            return words[words.length - 1];
+        };
+
+        input.autocomplete({
+            minLength: 1,
+            source: function(request, response) {
+                var q = last_word(request.term);
+                if (!q) {
+                    response([]);
+                    return;
+                }
+                $.getJSON(url, { q: q }, function(data) {
+                    response($.map(data.tags, function(tag) {
+                        return {
+                            label: tag.name + ' (' + tag.count + ')',
+                            value: tag.name
+                        };
+                    }));
+                });
+            },
+            // Don't replace the whole input with the highlighted tag
+            focus: function() {
+                return false;
+            },
+            select: function(event, ui) {
+                var words = this.value.split(/\s+/);
+                words[words.length - 1] = ui.item.value;
+                this.value = words.join(' ') + ' ';
+                return false;
+            }
+        });
+    });
+});
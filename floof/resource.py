@@ -28,7 +28,7 @@ ROOT_ACL = (
     (Allow, 'trusted_for:auth', (
         'auth.method', 'auth.certificates', 'auth.openid', 'auth.browserid')),
 
-    (Allow, 'trusted_for:admin', ('admin.view')),
+    (Allow, 'trusted_for:admin', ('admin.view', 'tags.manage')),
 )
 """The root ACL attached to instances of :class:`FloofRoot`.
 
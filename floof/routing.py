@@ -74,6 +74,7 @@ def configure_routing(config):
     r('users.art_by_label', '/users/{name}/art/{label}', **kw)
     r('users.profile', '/users/{name}/profile', **kw)
     r('users.watchstream', '/users/{name}/watchstream', **kw)
+    r('users.watch_network', '/users/{name}/watchstream/network', **kw)
     r('labels.user_index', '/users/{name}/labels', **kw)
 
     # Artwork
@@ -81,6 +82,7 @@ def configure_routing(config):
     kw['pregenerator'] = artwork_pregenerator
     r('art.browse', '/art')
     r('art.upload', '/art/upload')
+    r('art.random', '/art/random')
     r('art.view', r'/art/{id:\d+}{title:(-.+)?}', **kw)
     r('art.add_tags', r'/art/{id:\d+}/add_tags', **kw)
     r('art.remove_tags', r'/art/{id:\d+}/remove_tags', **kw)
@@ -91,8 +93,13 @@ def configure_routing(config):
     # XXX should the regex be checked in the 'factory' instead?  way easier that way...
     kw = sqla_route_options('tag', 'name', model.Tag.name)
     r('tags.list', '/tags')
+    r('tags.complete', '/tags/complete.json')
     r('tags.view', '/tags/{name}', **kw)
     r('tags.artwork', '/tags/{name}/artwork', **kw)
+    r('tags.add_alias', '/tags/{name}/add_alias', **kw)
+    r('tags.add_implication', '/tags/{name}/add_implication', **kw)
+    r('tags.remove_alias', '/tags/{name}/remove_alias', **kw)
+    r('tags.remove_implication', '/tags/{name}/remove_implication', **kw)
 
     # Labels
     # XXX well this is getting complicated!  needs to check user, needs to check id, needs to generate correctly, needs a title like art has
@@ -306,7 +313,8 @@ def sqla_route_options(url_key, match_key, sqla_column):
     def pregenerator(request, elements, kw):
         # Get the row object, and get the property from it
         row = kw.pop(url_key)
-        kw[match_key] = sqla_column.__get__(row, type(row))
+        # Not necessarily a real ORM object; gallery rows are plain tuples
+        kw[match_key] = getattr(row, sqla_column.key)
         return elements, kw
 
     def factory(request):
@@ -17,3 +17,16 @@
 % else:
 <p>Nobody.</p>
 % endif
+
+% if suggested_users:
+<h2>Watched by people you watch</h2>
+<table class="user-list">
+    % for user in suggested_users:
+    <tr>
+        <td>${lib.user_link(user)}</td>
+        <td><a href="${request.route_url('controls.rels.watch', _query=dict(target_user=user.name))}">Watch</a></td>
+    </tr>
+    % endfor
+</table>
+<p><a href="${request.route_url('users.watch_network', user=request.user)}">See their art</a></p>
+% endif
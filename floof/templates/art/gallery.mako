@@ -22,5 +22,7 @@
     ${h.end_form()}
 </div>
 
+<p><a href="${request.route_url('art.random', _query=request.GET)}">${lib.icon('arrow-switch')} Pick one at random</a></p>
+
 ${artlib.render_gallery_sieve(gallery_sieve)}
 </section>
@@ -1,4 +1,5 @@
 <%namespace name="lib" file="/lib.mako" />
+<%! from floof.lib import leaderboards %>
 
 <%!
 def media_icon(type):
@@ -111,6 +112,17 @@ def media_icon(type):
 <%def name="render_gallery_sieve(gallery_sieve, filters_open=False)">
 ${gallery_sieve_form(gallery_sieve.form)}
 <% pager = gallery_sieve.evaluate() %>\
+<% refinements = gallery_sieve.refinements() %>\
+
+% if refinements:
+<p class="art-refinements">
+    Narrow it down:
+    % for name in refinements:
+    <a href="${h.update_params(request.url, skip=None, seek=None, \
+        tags=u' '.join([gallery_sieve.form.tags.data or u'', name]).strip())}">${name}</a>
+    % endfor
+</p>
+% endif
 
 % if not pager.items:
 <p>Nothing found.</p>
@@ -123,9 +135,21 @@ ${detailed_table(pager)}
 % endif
 
 % if pager.pager_type == 'discrete':
-${lib.discrete_pager(pager, temporal_column_name=gallery_sieve.temporal_column_name)}
-% elif pager.pager_type == 'temporal':
-${lib.temporal_pager(pager)}
+${lib.discrete_pager(pager)}
+% elif pager.pager_type == 'keyset':
+${lib.keyset_pager(pager)}
+% elif pager.pager_type == 'sample':
+${lib.sample_pager(pager)}
+% endif
+% if gallery_sieve.ranked_by_leaderboard and pager.is_last_page:
+<p class="art-leaderboard-end">
+    Only the top ${leaderboards.LEADERBOARD_SIZE} are ranked over this period.
+    Filter by tag or artist to rank the rest.
+</p>
+% elif gallery_sieve.rating_sort_limited:
+<p class="art-leaderboard-end">
+    Sorting this by rating only covers art uploaded in the last day.
+</p>
 % endif
 </%def>
 
@@ -137,6 +161,10 @@ ${lib.temporal_pager(pager)}
         <dl class="standard-form">
             ${lib.field(form.tags)}
             ${lib.field(form.time_radius)}
+            ${lib.field(form.uploaded_around, hint_text=u'YYYY-MM-DD')}
+            ${lib.field(form.around_radius)}
+            ${lib.field(form.uploaded_from, hint_text=u'YYYY-MM-DD')}
+            ${lib.field(form.uploaded_to)}
             % if request.user:
             ## Don't show a user-specific field for a non-user
             ${lib.field(form.my_rating)}
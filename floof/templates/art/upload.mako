@@ -3,6 +3,11 @@
 
 <%def name="title()">Upload - Artwork</%def>
 
+<%def name="script_dependencies()">
+    ${h.javascript_link(request.static_url('floof:public/js/lib/jquery.ui-1.8.7.js'))}
+    ${h.javascript_link(request.static_url('floof:public/js/tag-complete.js'))}
+</%def>
+
 <section>
 <h1>
     ${lib.icon('image--arrow')}
@@ -13,7 +18,8 @@ ${lib.secure_form(request.path_url, multipart=True)}
 <dl class="standard-form">
     ${lib.field(form.file)}
     ${lib.field(form.title, size=64, maxlength=133)}
-    ${lib.field(form.tags, size=64)}
+    ${lib.field(form.tags, size=64,
+        **{'data-complete-url': request.route_url('tags.complete')})}
 
     ## Relationship stuff
     % for field in form.relationship:
@@ -1,4 +1,5 @@
 <%inherit file="/base.mako" />
+<%! from floof.lib import renditions %>
 <%namespace name="lib" file="/lib.mako" />
 <%namespace name="artlib" file="/art/lib.mako" />
 <%namespace name="comments_lib" file="/comments/lib.mako" />
@@ -7,6 +8,7 @@
 <%def name="script_dependencies()">
     ${h.javascript_link(request.static_url('floof:public/js/lib/jquery.ui-1.8.7.js'))}
     ${h.javascript_link(request.static_url('floof:public/js/lib/jquery.ui.rater.js'))}
+    ${h.javascript_link(request.static_url('floof:public/js/tag-complete.js'))}
 </%def>
 
 <section class="neutral-background">
@@ -17,7 +19,9 @@
 
 ## Ye art itself
 <div class="artwork">
-    <img src="${request.route_url('filestore', class_=u'artwork', key=artwork.hash)}" alt="">
+    <img src="${request.route_url('filestore', class_=u'artwork', key=artwork.hash)}"
+        srcset="${renditions.srcset(request, artwork)}"
+        sizes="(max-width: ${artwork.width}px) 100vw, ${artwork.width}px" alt="">
 </div>
 
 ## Metadata and whatever
@@ -110,7 +114,11 @@
     ${lib.secure_form(request.route_url('art.' + action, artwork=artwork))}
     <p>
         ${form.tags.label()}:
+        % if action == 'add_tags':
+        ${form.tags(**{'data-complete-url': request.route_url('tags.complete')})}
+        % else:
         ${form.tags()}
+        % endif
         <button type="submit">Go</button>
     </p>
     ${h.end_form()}
@@ -149,6 +157,22 @@
 </div>
 
 
+% if related:
+<section>
+    <h1>
+        ${lib.icon('images')}
+        Art like this
+    </h1>
+    ${artlib.thumbnail_grid(related)}
+    <p class="standard-form-hint">
+        Found as of ${lib.time(related_index.built)}.
+        % if related_index.pending:
+        ${related_index.pending} artwork${'' if related_index.pending == 1 else 's'} changed since.
+        % endif
+    </p>
+</section>
+% endif
+
 <section>
     ## Comments
     <% comments = artwork.discussion.comments %>\
@@ -133,10 +133,7 @@ ${h.tags.hidden('csrf_token', value=request.session.get_csrf_token(), id=None)}
 
 
 ## Rendering for lib.pager.Pager objects
-<%def name="discrete_pager(pager, temporal_column_name=None)">
-## When `temporal_column_name` is given, discrete pagers that have reached
-## their maximum allowed limit will switch to temporal pagers.  Used for
-## GallerySieve
+<%def name="discrete_pager(pager)">
 <ol class="pager">
 % if pager.current_page > 0:
     <li class="pager-first">
@@ -166,7 +163,7 @@ ${h.tags.hidden('csrf_token', value=request.session.get_csrf_token(), id=None)}
         % else:
         ${pager.item_count}
         % endif
-        of ${pager.item_count}
+        of ${u'at most ' if pager.item_count_is_estimate else u''}${pager.item_count}
       % else:
         #${pager.skip + 1}–${pager.skip + pager.visible_count}
       % endif
@@ -181,12 +178,6 @@ ${h.tags.hidden('csrf_token', value=request.session.get_csrf_token(), id=None)}
     </li>
     % endif
 % endfor
-% if temporal_column_name and pager.is_last_allowable_page:
-<li>
-    <a href="${h.update_params(request.path_url, \
-        **pager.formdata_for_temporal(temporal_column_name))}">More →</a>
-</li>
-% endif
 % if pager.next_item:
     <li class="pager-last">
         <a href="${h.update_params(request.path_url, **pager.formdata_for(int(pager.current_page + 1) * pager.page_size))}">
@@ -208,26 +199,30 @@ ${h.tags.hidden('csrf_token', value=request.session.get_csrf_token(), id=None)}
 </ol>
 </%def>
 
-<%def name="temporal_pager(pager)">
+<%def name="sample_pager(pager)">
 <ol class="pager">
-    % if pager.timeskip:
+    <li>
+        <a href="${h.update_params(request.path_url, **pager.formdata)}">Pick again →</a>
+    </li>
+</ol>
+</%def>
+
+<%def name="keyset_pager(pager)">
+<ol class="pager">
+    % if pager.seek:
     <li>
         <a href="${h.update_params(request.path_url, \
-            **pager.formdata_for(None))}">⇤ Newest</a>
+            **pager.formdata_for(None))}">⇤ First</a>
     </li>
     <li class="elided">…</li>
-    <li class="current">
-        ${time(pager.timeskip)}<br>
-        and earlier
-    </li>
     % else:
-    <li>Newest</li>
+    <li>First</li>
     % endif
 
     % if not pager.is_last_page:
     <li>
         <a href="${h.update_params(request.path_url, \
-            **pager.formdata_for(pager.next_item_timeskip))}">More →</a>
+            **pager.formdata_for(pager.next_seek))}">More →</a>
     </li>
     % endif
 </ol>
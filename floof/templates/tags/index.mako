@@ -8,9 +8,24 @@
     Tags
 </h1>
 
-<ul>
+<p>
+    Sort by:
+    % for value, label in [(u'name', u'name'), (u'popular', u'most used')]:
+    % if sort == value:
+    <strong>${label}</strong>
+    % else:
+    <a href="${request.route_url('tags.list', _query=dict(sort=value))}">${label}</a>
+    % endif
+    % endfor
+</p>
+
+<ul class="tag-cloud">
 % for tag in tags:
-<li><a href="${request.route_url('tags.view', tag=tag)}">${tag.name}</a></li>
+<li class="weight-${weights[tag.id]}">
+    <a href="${request.route_url('tags.view', tag=tag)}" title="${tag.usage_count} artwork">${tag.name}</a>
+</li>
 % endfor
 </ul>
+
+${lib.keyset_pager(tags)}
 </section>
@@ -1,4 +1,5 @@
 <%inherit file="/base.mako"/>
+<%namespace name="lib" file="/lib.mako" />
 
 <%def name="title()">Tag "${tag.name}"</%def>
 
@@ -24,9 +25,80 @@
 <dt>etc.</dt>
 </dl>
 
+<h2>Aliases and implications</h2>
+
+<dl class="standard-form">
+<dt>Also known as</dt>
+<dd>
+    % for alias in tag.aliases:
+    ${alias.name}
+    ${remove_button('remove_alias', alias.name)}
+    % endfor
+    % if not tag.aliases:
+    —
+    % endif
+</dd>
+
+<dt>Implies</dt>
+<dd>
+    % for other in tag.implies:
+    <a href="${request.route_url('tags.view', tag=other)}">${other.name}</a>
+    ${remove_button('remove_implication', other.name)}
+    % endfor
+    % if not tag.implies:
+    —
+    % endif
+</dd>
+
+<dt>Implied by</dt>
+<dd>
+    % for other in tag.implied_by:
+    <a href="${request.route_url('tags.view', tag=other)}">${other.name}</a>
+    % endfor
+    % if not tag.implied_by:
+    —
+    % endif
+</dd>
+</dl>
+
+% if request.user.can('tags.manage', request.context):
+% for action, label, form in [ \
+    ('add_alias', u'Add an alias', add_alias_form), \
+    ('add_implication', u'Add an implied tag', add_implication_form), \
+]:
+${lib.secure_form(request.route_url('tags.' + action, tag=tag))}
+<p>
+    ${label}:
+    ${form.name()}
+    <button type="submit">Go</button>
+</p>
+${h.end_form()}
+% endfor
+% endif
+
+<%def name="remove_button(action, name)">
+% if request.user.can('tags.manage', request.context):
+${lib.secure_form(request.route_url('tags.' + action, tag=tag), style='display: inline;')}
+${h.hidden(name='name', value=name)}
+<button type="submit">Remove</button>
+${h.end_form()}
+% endif
+</%def>
+
 <h2>Similar tags</h2>
 
+% if related_tags:
+<ul>
+    % for other, count in related_tags:
+    <li>
+        <a href="${request.route_url('tags.view', tag=other)}">${other.name}</a>
+        (<a href="${request.route_url('tags.artwork', tag=tag, _query=dict(tags=other.name))}">${count} together</a>)
+    </li>
+    % endfor
+</ul>
+% else:
 <p>???</p>
+% endif
 
 <h2>Usage over time.</h2>
 
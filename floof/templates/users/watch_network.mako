@@ -0,0 +1,9 @@
+<%inherit file="/base.mako" />
+<%namespace name="lib" file="/lib.mako" />
+<%namespace name="artlib" file="/art/lib.mako" />
+
+<%def name="title()">Watched by ${target_user.display_name}'s watches</%def>
+
+<h1>${lib.user_link(target_user)} » <a href="${request.route_url('users.watchstream', user=target_user)}">Watchstream</a> » Network</h1>
+<p>Art by people that ${target_user.display_name}'s watches are watching.</p>
+${artlib.render_gallery_sieve(artwork)}
@@ -0,0 +1,75 @@
+import shutil
+import tempfile
+
+import pytest
+from webob.multidict import MultiDict
+
+from floof import model
+from floof.lib import indexes
+from floof.lib.gallery import GallerySieve
+from floof.lib.indexes import cooccurrence
+from floof.tests import UnitTests
+from floof.tests import sim
+
+numpy = pytest.importorskip('numpy')
+
+
+class TestCooccurrence(UnitTests):
+
+    def setUp(self):
+        super(TestCooccurrence, self).setUp()
+        self.directory = tempfile.mkdtemp()
+        indexes.configure({'index.directory': self.directory})
+
+        user = sim.sim_user(credentials=[])
+        self.tags = dict((name, model.Tag(name))
+            for name in [u'fox', u'wolf', u'snow', u'forest', u'lonely'])
+        for i, names in enumerate([
+                [u'fox', u'snow', u'forest'],
+                [u'fox', u'snow'],
+                [u'fox', u'forest'],
+                [u'wolf', u'snow'],
+                [u'wolf', u'snow', u'fox'],
+                [u'lonely']]):
+            artwork = sim.sim_artwork(user=user)
+            artwork.hash = u'cooccurrence-{0}'.format(i)
+            artwork.tag_objs.extend(self.tags[name] for name in names)
+        model.session.flush()
+
+    def tearDown(self):
+        indexes.configure({})
+        shutil.rmtree(self.directory)
+        super(TestCooccurrence, self).tearDown()
+
+    def test_count_pairs(self):
+        artwork_col = numpy.array([1, 1, 1, 2, 2, 3])
+        tag_col = numpy.array([0, 1, 2, 0, 1, 2])
+        old_chunk_size = cooccurrence.CHUNK_SIZE
+        cooccurrence.CHUNK_SIZE = 1
+        try:
+            first, second, together = cooccurrence.count_pairs(
+                artwork_col, tag_col, 3)
+        finally:
+            cooccurrence.CHUNK_SIZE = old_chunk_size
+
+        assert zip(first, second, together) == [
+            (0, 1, 2), (0, 2, 1), (1, 0, 2), (1, 2, 1), (2, 0, 1), (2, 1, 1)]
+
+    def test_related(self):
+        assert cooccurrence.get_index() is None
+        cooccurrence.rebuild(model.session)
+        index = cooccurrence.get_index()
+
+        tags = self.tags
+        # fox and snow: 3 together, of 4 and 4 -> 3/5; fox and forest: 2 of
+        # 4 and 2 -> 1/2; fox and wolf: 1 of 4 and 2 -> 1/5
+        assert index.related(tags[u'fox'].id) == [
+            (tags[u'snow'].id, 3), (tags[u'forest'].id, 2),
+            (tags[u'wolf'].id, 1)]
+        assert index.related(tags[u'fox'].id, limit=1) == \
+            [(tags[u'snow'].id, 3)]
+        assert index.related(tags[u'lonely'].id) == []
+
+        sieve = GallerySieve(session=model.session,
+            formdata=MultiDict(tags=u'fox snow'))
+        assert sieve.refinements() == [u'forest', u'wolf']
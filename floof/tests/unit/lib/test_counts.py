@@ -0,0 +1,115 @@
+from floof import model
+from floof.lib import counts
+from floof.lib import gallery
+from floof.lib.gallery import GallerySieve
+from floof.lib.indexes import postings
+from floof.tests import UnitTests
+from floof.tests import sim
+
+
+class TestCounts(UnitTests):
+
+    def setUp(self):
+        super(TestCounts, self).setUp()
+        self.user = sim.sim_user(credentials=[])
+        self.tag = model.Tag(u'counted')
+        model.session.add(self.tag)
+        for i in range(3):
+            artwork = sim.sim_artwork(user=self.user)
+            artwork.hash = u'counts{0}'.format(i)
+            artwork.tag_objs.append(self.tag)
+        model.session.flush()
+        self.key = postings.tag_key(self.tag.id)
+
+    def test_get_and_adjust(self):
+        # Nobody has asked yet, so there's nothing to adjust
+        counts.adjust(model.session, added_keys=[self.key])
+        assert counts.get(model.session, self.key) == 3
+
+        counts.adjust(model.session, added_keys=[self.key, counts.ALL_KEY])
+        counts.adjust(model.session, removed_keys=[self.key])
+        counts.adjust(model.session, added_keys=[self.key])
+        assert counts.get(model.session, self.key) == 4
+
+        counts.recount(model.session)
+        assert counts.get(model.session, self.key) == 3
+
+    def test_recount_new_key(self):
+        table = model.GalleryCount.__table__
+        assert counts.get(model.session, self.key) == 3
+
+        # A write that raced with the first count, so its adjust missed it
+        artwork = sim.sim_artwork(user=self.user)
+        artwork.hash = u'counts-late'
+        artwork.tag_objs.append(self.tag)
+        model.session.flush()
+        assert counts.get(model.session, self.key) == 3
+
+        # Put right once the new count is due to be checked, and only then
+        model.session.execute(table.update()
+            .where(table.c.key == self.key)
+            .values(recount_time=model.now()))
+        assert counts.get(model.session, self.key) == 4
+        counts.adjust(model.session, removed_keys=[self.key])
+        assert counts.get(model.session, self.key) == 3
+
+    def test_tag_usage_count(self):
+        def usage_count():
+            return model.session.query(model.Tag.usage_count) \
+                .filter_by(id=self.tag.id).scalar()
+
+        # Always kept, even before anyone asks for the gallery count
+        assert usage_count() == 0
+        counts.adjust(model.session, added_keys=[self.key, counts.ALL_KEY])
+        counts.adjust(model.session, added_keys=[self.key])
+        assert usage_count() == 2
+
+        counts.recount(model.session)
+        assert usage_count() == 3
+
+    def test_countable_gallery(self):
+        def evaluate(*filters):
+            sieve = GallerySieve(session=model.session, countable=True)
+            sieve.filter_by_tag(self.tag.name)
+            for f in filters:
+                f(sieve)
+            pager = sieve.evaluate()
+            return pager.item_count, pager.item_count_is_estimate
+
+        assert evaluate() == (3, False)
+
+        # The cached count is used as-is
+        counts.adjust(model.session, added_keys=[self.key])
+        assert evaluate() == (4, False)
+
+        # Other filters are counted, up to a point
+        recency = lambda sieve: sieve.filter_by_recency(
+            model.now() - model.now().replace(year=2000))
+        assert evaluate(recency) == (3, False)
+        old_limit = gallery.MAX_EXACT_COUNT
+        gallery.MAX_EXACT_COUNT = 1
+        try:
+            assert evaluate(recency) == (4, True)
+        finally:
+            gallery.MAX_EXACT_COUNT = old_limit
+
+    def test_posting_ids_with_label(self):
+        label = model.Label(name=u'counted', user_id=self.user.id,
+            encapsulation=u'public')
+        model.session.add(label)
+        artworks = model.session.query(model.Artwork) \
+            .filter(model.Artwork.hash.like(u'counts%')) \
+            .all()
+        artworks[0].labels.append(label)
+        model.session.flush()
+
+        sieve = GallerySieve(session=model.session, countable=True)
+        sieve.filter_by_tag(self.tag.name)
+        sieve.filter_by_label(label)
+        sieve._apply_posting_filters()
+        # As though the posting index had found the tag's artwork
+        sieve._posting_ids = set(artwork.id for artwork in artworks)
+        sieve._posting_keys = set([self.key])
+
+        # The label filters those further, so they aren't the answer
+        assert sieve._item_count(sieve.query) == (1, False)
@@ -0,0 +1,104 @@
+from cStringIO import StringIO
+import os
+import random
+import tempfile
+
+try:
+    import Image
+except ImportError:
+    from PIL import Image
+
+from floof import model
+from floof.lib import imagehash
+from floof.lib import thumbnails
+from floof.tests import UnitTests
+from floof.tests import sim
+
+
+def gradient(width, height):
+    image = Image.new('L', (width, height))
+    image.putdata([(x * 7 + y * 3) % 256
+        for y in range(height) for x in range(width)])
+    return image
+
+
+class TestImageHash(UnitTests):
+
+    def setUp(self):
+        super(TestImageHash, self).setUp()
+        # Every test gets its own database, so start from an empty tree
+        imagehash._tree = imagehash.BKTree()
+        imagehash._tree_last_id = 0
+
+    def test_dhash_survives_resizing(self):
+        image = gradient(200, 150)
+        value = imagehash.dhash(image)
+        resized = imagehash.dhash(image.resize((123, 97), Image.ANTIALIAS))
+        assert imagehash.distance(value, resized) <= imagehash.MAX_DISTANCE
+        assert imagehash.from_hex(imagehash.to_hex(value)) == value
+
+    def test_dhash_drafts_jpeg(self):
+        original = gradient(200, 150).resize((1600, 1200), Image.ANTIALIAS)
+        buf = StringIO()
+        original.save(buf, 'JPEG')
+        buf.seek(0)
+        image = Image.open(buf)
+        value = imagehash.dhash(image)
+
+        # Decoded at 1/8 scale, and hashes about the same as the original
+        assert image.size == (200, 150)
+        assert imagehash.distance(value, imagehash.dhash(original)) \
+            <= imagehash.MAX_DISTANCE
+
+    def test_hash_file(self):
+        image = gradient(200, 150)
+        fd, path = tempfile.mkstemp(suffix='.png')
+        os.close(fd)
+        image.save(path)
+        try:
+            assert imagehash.hash_file({}, path) == imagehash.dhash(image)
+        finally:
+            os.remove(path)
+
+    def test_hash_url_too_big(self):
+        image = gradient(200, 150)
+        fd, path = tempfile.mkstemp(suffix='.png')
+        os.close(fd)
+        image.save(path)
+        old_settings = thumbnails._settings
+        try:
+            job = (1, 'file://' + path)
+            thumbnails.configure({'thumbnail_size': '160',
+                'thumbnail.max_pixels': '10000', 'thumbnail.workers': '0'})
+            assert imagehash._hash_url(job) == (1, None)
+
+            thumbnails.configure({'thumbnail_size': '160',
+                'thumbnail.workers': '0'})
+            assert imagehash._hash_url(job) == (1, imagehash.dhash(image))
+        finally:
+            thumbnails._settings = old_settings
+            os.remove(path)
+
+    def test_bktree_matches_brute_force(self):
+        rng = random.Random(1)
+        values = [rng.getrandbits(64) for i in range(500)]
+        tree = imagehash.BKTree()
+        for i, value in enumerate(values):
+            tree.add(value, i)
+
+        target = values[0] ^ 0b10110
+        expected = sorted(
+            (imagehash.distance(target, value), i)
+            for i, value in enumerate(values)
+            if imagehash.distance(target, value) <= 10)
+        assert tree.search(target, 10) == expected
+        assert tree.search(target, 3)[0] == (3, 0)
+
+    def test_find_similar(self):
+        user = sim.sim_user(credentials=[])
+        artwork = sim.sim_artwork(user=user)
+        artwork.dhash = imagehash.to_hex(0xf0f0)
+        model.session.flush()
+
+        assert imagehash.find_similar(model.session, 0xf0f1) == [artwork.id]
+        assert imagehash.find_similar(model.session, 0x0f0f) == []
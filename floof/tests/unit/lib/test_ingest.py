@@ -0,0 +1,55 @@
+from cStringIO import StringIO
+import hashlib
+import os
+import shutil
+import tempfile
+
+try:
+    import Image
+except ImportError:
+    from PIL import Image
+
+from floof.lib import ingest
+from floof.tests import UnitTests
+
+
+class TestIngest(UnitTests):
+
+    def setUp(self):
+        super(TestIngest, self).setUp()
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+        super(TestIngest, self).tearDown()
+
+    def test_single_pass(self):
+        buf = StringIO()
+        Image.new('RGB', (300, 200), (0, 128, 255)).save(buf, 'PNG')
+        data = buf.getvalue()
+
+        class ReadOnce(object):
+            """A file that can't be rewound, like a request body."""
+            def __init__(self, data):
+                self.buf = StringIO(data)
+            def read(self, size):
+                return self.buf.read(size)
+
+        old_chunk_size = ingest.CHUNK_SIZE
+        ingest.CHUNK_SIZE = 100
+        try:
+            ingested = ingest.ingest(ReadOnce(data), self.directory)
+        finally:
+            ingest.CHUNK_SIZE = old_chunk_size
+
+        assert ingested.mimetype == u'image/png'
+        assert ingested.hash == hashlib.sha256(data).hexdigest()
+        assert ingested.size == len(data)
+        assert os.path.dirname(ingested.path) == self.directory
+        with open(ingested.path, 'rb') as f:
+            assert f.read() == data
+
+        ingested.discard()
+        assert not os.path.exists(ingested.path)
+        # Already gone is fine
+        ingested.discard()
@@ -0,0 +1,108 @@
+from datetime import timedelta
+
+from webob.multidict import MultiDict
+
+from floof import model
+from floof.lib import gallery
+from floof.lib import leaderboards
+from floof.lib.gallery import GallerySieve
+from floof.tests import UnitTests
+from floof.tests import sim
+
+
+class TestLeaderboards(UnitTests):
+
+    def setUp(self):
+        super(TestLeaderboards, self).setUp()
+        self.user = sim.sim_user(credentials=[])
+        self.raters = [sim.sim_user(credentials=[]) for i in range(3)]
+
+        self.old = sim.sim_artwork(user=self.user)
+        self.old.hash = u'leaderboard-old'
+        self.old.uploaded_time = model.now() - timedelta(days=2)
+        self.new = sim.sim_artwork(user=self.user)
+        self.new.hash = u'leaderboard-new'
+        self.unrated = sim.sim_artwork(user=self.user)
+        self.unrated.hash = u'leaderboard-unrated'
+        model.session.flush()
+
+        self.rate(self.old, 1.0, self.raters[:2])
+        self.rate(self.new, 0.0, self.raters)
+        model.session.flush()
+
+    def rate(self, artwork, rating, raters):
+        for rater in raters:
+            artwork.ratings.append(model.ArtworkRating(user=rater, rating=rating))
+
+    def top_rated(self, time_radius):
+        sieve = GallerySieve(session=model.session, formdata=MultiDict(
+            sort=u'rating', time_radius=time_radius))
+        return [artwork.id for artwork in sieve.evaluate().items]
+
+    def test_rating_sort(self):
+        # Without leaderboards, the artwork table is sorted directly, but only
+        # the last day of it
+        assert not leaderboards.is_built(model.session, u'all')
+        assert self.top_rated(u'all') == [self.new.id, self.unrated.id]
+
+        leaderboards.rebuild(model.session)
+        assert leaderboards.is_built(model.session, u'all')
+        assert self.top_rated(u'all') == [self.old.id, self.new.id]
+        assert self.top_rated(u'24h') == [self.new.id]
+
+        # So is a filtered gallery
+        sieve = GallerySieve(session=model.session, formdata=MultiDict(
+            sort=u'rating', time_radius=u'all'))
+        sieve.filter_by_upload_range(start=model.now() - timedelta(days=30))
+        assert [artwork.id for artwork in sieve.evaluate().items] == \
+            [self.new.id, self.unrated.id]
+        assert sieve.rating_sort_limited
+
+    def test_record_rating(self):
+        old_size = leaderboards.LEADERBOARD_SIZE
+        leaderboards.LEADERBOARD_SIZE = 1
+        try:
+            leaderboards.rebuild(model.session)
+            assert self.top_rated(u'all') == [self.old.id]
+
+            # Not good enough to make the board
+            self.rate(self.unrated, -1.0, self.raters)
+            model.session.flush()
+            leaderboards.record_rating(model.session, self.unrated)
+            assert self.top_rated(u'all') == [self.old.id]
+
+            # Good enough to bump the old favorite
+            for rating in self.new.ratings:
+                rating.rating = 1.0
+            model.session.flush()
+            leaderboards.record_rating(model.session, self.new)
+            assert self.top_rated(u'all') == [self.new.id]
+        finally:
+            leaderboards.LEADERBOARD_SIZE = old_size
+
+    def test_paging(self):
+        leaderboards.rebuild(model.session)
+        # The board's score and the artwork's own can disagree until the board
+        # catches up; paging goes by the board's
+        self.old.rating_score = -1.0
+        model.session.flush()
+
+        old_page_size = gallery.PAGE_SIZE
+        gallery.PAGE_SIZE = 1
+        try:
+            for projection in (False, True):
+                formdata = MultiDict(sort=u'rating', time_radius=u'all')
+                seen = []
+                while True:
+                    sieve = GallerySieve(session=model.session,
+                        formdata=formdata, projection=projection)
+                    pager = sieve.evaluate()
+                    assert sieve.ranked_by_leaderboard
+                    seen.extend(artwork.id for artwork in pager.items)
+                    if pager.is_last_page:
+                        break
+                    formdata = MultiDict(pager.formdata_for(pager.next_seek),
+                        sort=u'rating', time_radius=u'all')
+                assert seen == [self.old.id, self.new.id]
+        finally:
+            gallery.PAGE_SIZE = old_page_size
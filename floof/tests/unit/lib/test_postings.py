@@ -0,0 +1,71 @@
+import shutil
+import tempfile
+
+from floof import model
+from floof.lib import indexes
+from floof.lib.indexes import postings
+from floof.tests import UnitTests
+from floof.tests import sim
+
+
+class TestPostings(UnitTests):
+
+    def setUp(self):
+        super(TestPostings, self).setUp()
+        self.directory = tempfile.mkdtemp()
+        indexes.configure({'index.directory': self.directory})
+
+    def tearDown(self):
+        indexes.configure({})
+        shutil.rmtree(self.directory)
+        super(TestPostings, self).tearDown()
+
+    def test_codec_round_trip(self):
+        ids = [0, 1, 2, 127, 128, 300, 16384, 2 ** 31]
+        encoded = postings.encode_sorted(ids)
+        assert list(postings.decode_sorted(encoded)) == ids
+        # Small gaps take a single byte each
+        assert len(postings.encode_sorted(range(1000))) == 1000
+
+    def test_rebuild_and_journal(self):
+        user = sim.sim_user(credentials=[])
+        artwork = sim.sim_artwork(user=user)
+        tag = sim.sim_tag()
+        artwork.tag_objs.append(tag)
+        artwork.user_artwork.append(model.UserArtwork(
+            user_id=user.id, relationship_type=u'by'))
+        model.session.flush()
+
+        assert postings.get_index() is None
+        postings.rebuild(model.session)
+
+        index = postings.get_index()
+        key = postings.tag_key(tag.id)
+        by_key = postings.user_key(u'by', user.id)
+        assert index.get(key) == set([artwork.id])
+        assert index.intersect([key, by_key]) == set([artwork.id])
+
+        # Changes are picked up from the journal
+        indexes.append_journal(postings.NAME, [
+            '- {0} {1:d}'.format(key, artwork.id),
+            '+ {0} {1:d}'.format(key, artwork.id + 1),
+        ])
+        index = postings.get_index()
+        assert index.get(key) == set([artwork.id + 1])
+        assert index.intersect([key, by_key]) == set()
+
+        # Bigger lists than the caller can use aren't even decoded
+        indexes.append_journal(postings.NAME, [
+            '+ test:big {0:d}'.format(id) for id in range(1, 11)] + [
+            '+ test:small {0:d}'.format(id) for id in range(5, 8)])
+        index = postings.get_index()
+        assert index.intersect(['test:big', 'test:small'], 3) \
+            == set([5, 6, 7])
+        assert index.intersect(['test:big', 'test:small'], 2) is None
+        assert index.intersect(['test:big'], 9) is None
+
+        # A tuple of keys stands for their union
+        assert index.union(['test:big', 'test:small']) == set(range(1, 11))
+        assert index.intersect([('test:small', 'test:other'), 'test:big']) \
+            == set([5, 6, 7])
+        assert index.intersect([('test:small', 'test:big')], 9) is None
@@ -0,0 +1,110 @@
+from cStringIO import StringIO
+import os
+import shutil
+import tempfile
+import time
+
+try:
+    import Image
+except ImportError:
+    from PIL import Image
+import pytest
+import transaction
+
+from floof import model
+from floof.lib import renditions
+from floof.lib import thumbnails
+from floof.model.filestore import get_storage_factory
+from floof.tests import UnitTests
+
+
+class TestRenditions(UnitTests):
+
+    def setUp(self):
+        super(TestRenditions, self).setUp()
+        self.directory = tempfile.mkdtemp()
+        self.settings = {
+            'filestore': 'local',
+            'filestore.directory': self.directory,
+            'thumbnail_size': '160',
+            'thumbnail.workers': '0',
+        }
+        thumbnails.configure(self.settings)
+        self.storage = get_storage_factory(self.settings)()
+        self.cache = renditions.RenditionCache()
+
+        buf = StringIO()
+        Image.new('RGB', (1000, 750), (0, 128, 255)).save(buf, 'PNG')
+        buf.seek(0)
+        manager = transaction.TransactionManager()
+        storage = get_storage_factory(self.settings)()
+        manager.begin().join(storage)
+        storage.put(u'artwork', u'deadbeef', buf)
+        manager.commit()
+
+        self.artwork = model.MediaImage(hash=u'deadbeef',
+            mime_type=u'image/png', width=1000, height=750)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+        super(TestRenditions, self).tearDown()
+
+    def _path(self, key):
+        return self.storage._path(self.directory, renditions.CLASS, key)
+
+    def test_keys(self):
+        key = renditions.key_for(u'dead-beef', 320)
+        assert renditions.parse_key(key) == (u'dead-beef', 320)
+
+        for key in (u'deadbeef', u'deadbeef-', u'deadbeef-321', u'-320'):
+            with pytest.raises(ValueError):
+                renditions.parse_key(key)
+
+        assert renditions.widths_for(self.artwork) == [160, 320, 800]
+        gif = model.MediaImage(hash=u'deadbeef', mime_type=u'image/gif',
+            width=1000, height=750)
+        assert renditions.widths_for(gif) == []
+
+    def test_make_rendition(self):
+        image = Image.new('RGB', (1000, 3000))
+        assert renditions.make_rendition(image, 320).size == (320, 960)
+
+    def test_ensure(self):
+        assert self.cache.ensure(self.storage, self.artwork, 320)
+        assert Image.open(self._path(u'deadbeef-320')).size == (320, 240)
+
+        # Used again, not made again
+        os.utime(self._path(u'deadbeef-320'), (0, 0))
+        assert self.cache.ensure(self.storage, self.artwork, 320)
+        assert os.stat(self._path(u'deadbeef-320')).st_mtime > 0
+
+    def test_claims(self):
+        # Someone else is making it
+        claim = renditions._claim_path(self.storage, u'deadbeef-320')
+        open(claim, 'w').close()
+        assert not self.cache.ensure(self.storage, self.artwork, 320)
+        assert not self.storage.exists(renditions.CLASS, u'deadbeef-320')
+
+        # Until they seem to have given up
+        stale = time.time() - renditions.CLAIM_TIMEOUT - 1
+        os.utime(claim, (stale, stale))
+        assert self.cache.ensure(self.storage, self.artwork, 320)
+        assert not os.path.exists(claim)
+
+    def test_evict(self):
+        for n, width in enumerate(renditions.WIDTHS[:3]):
+            assert self.cache.ensure(self.storage, self.artwork, width)
+            os.utime(self._path(renditions.key_for(u'deadbeef', width)),
+                (n, n))
+        sizes = dict((key, size)
+            for key, size, used_at in self.storage.usage(renditions.CLASS))
+
+        # Everything fits
+        self.cache.max_bytes = sum(sizes.values())
+        assert self.cache.evict(self.storage) == 0
+
+        # The least recently used goes first
+        self.cache.max_bytes = sizes[u'deadbeef-800'] / renditions.LOW_WATER
+        assert self.cache.evict(self.storage) == 2
+        assert set(key for key, size, used_at
+            in self.storage.usage(renditions.CLASS)) == set([u'deadbeef-800'])
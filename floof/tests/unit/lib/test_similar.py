@@ -0,0 +1,77 @@
+import shutil
+import tempfile
+
+from floof import model
+from floof.lib import indexes
+from floof.lib.indexes import postings
+from floof.lib.indexes import similar
+from floof.tests import UnitTests
+from floof.tests import sim
+
+
+class TestSimilar(UnitTests):
+
+    def setUp(self):
+        super(TestSimilar, self).setUp()
+        self.directory = tempfile.mkdtemp()
+        indexes.configure({'index.directory': self.directory})
+
+    def tearDown(self):
+        indexes.configure({})
+        shutil.rmtree(self.directory)
+        super(TestSimilar, self).tearDown()
+
+    def test_signature(self):
+        keys = ['tag:{0}'.format(i) for i in range(20)]
+        sig = similar.signature(keys)
+        assert len(sig) == similar.NUM_HASHES
+        assert similar.signature(reversed(keys)) == sig
+        assert similar.similarity(sig, sig) == 1.0
+        assert similar.signature([]) is None
+
+    def test_rebuild_and_journal(self):
+        user = sim.sim_user(credentials=[])
+        tags = [model.Tag(u'similar{0}'.format(i)) for i in range(4)]
+        artworks = []
+        for i, tag_indices in enumerate([(0, 1, 2), (0, 1, 2), (0, 1), (3,)]):
+            artwork = sim.sim_artwork(user=user)
+            artwork.hash = u'similar{0}'.format(i)
+            artwork.tag_objs.extend(tags[j] for j in tag_indices)
+            artworks.append(artwork)
+        model.session.flush()
+        a, b, c, d = artworks
+
+        assert similar.get_index() is None
+        similar.rebuild(model.session)
+
+        index = similar.get_index()
+        assert index.built is not None
+        assert index.pending == 0
+        assert index.neighbours(a.id) == [b.id, c.id]
+        assert index.neighbours(d.id) == []
+
+        # A change nowhere near a leaves its stored neighbours as they were,
+        # without re-ranking
+        indexes.append_journal(similar.NAME,
+            [' '.join(['~', str(d.id)] + postings.artwork_keys(d))])
+        index = similar.get_index()
+        assert index.pending == 1
+        real_similarity = similar.similarity
+        def similarity(sig1, sig2):
+            raise AssertionError("Re-ranked")
+        similar.similarity = similarity
+        try:
+            assert index.neighbours(a.id) == [b.id, c.id]
+        finally:
+            similar.similarity = real_similarity
+
+        # d is retagged to look just like a
+        d.tag_objs[:] = tags[:3]
+        model.session.flush()
+        indexes.append_journal(similar.NAME,
+            [' '.join(['~', str(d.id)] + postings.artwork_keys(d))])
+
+        index = similar.get_index()
+        assert index.pending == 1
+        assert set(index.neighbours(d.id)[:2]) == set([a.id, b.id])
+        assert d.id in index.neighbours(a.id)
@@ -0,0 +1,81 @@
+import shutil
+import tempfile
+
+import pytest
+
+from floof import model
+from floof.lib import indexes
+from floof.lib.gallery import GallerySieve
+from floof.tests import UnitTests
+from floof.tests import sim
+
+suggest = pytest.importorskip('floof.lib.indexes.suggest')
+
+
+class TestSuggest(UnitTests):
+
+    def setUp(self):
+        super(TestSuggest, self).setUp()
+        self.directory = tempfile.mkdtemp()
+        indexes.configure({'index.directory': self.directory})
+
+        # Two groups of users with opposite tastes in two groups of art
+        self.users = [sim.sim_user(credentials=[]) for i in range(5)]
+        self.artworks = []
+        for i in range(4):
+            artwork = sim.sim_artwork(user=self.users[0])
+            artwork.hash = u'suggest{0}'.format(i)
+            self.artworks.append(artwork)
+        model.session.flush()
+
+        a, b, c, d = self.artworks
+        self.rate(self.users[0], {a: 1, c: -1})
+        self.rate(self.users[1], {a: 1, b: 1, c: -1, d: -1})
+        self.rate(self.users[2], {a: 1, b: 1, c: -1, d: -1})
+        self.rate(self.users[3], {a: -1, b: -1, c: 1, d: 1})
+        model.session.flush()
+
+    def tearDown(self):
+        indexes.configure({})
+        shutil.rmtree(self.directory)
+        super(TestSuggest, self).tearDown()
+
+    def rate(self, user, ratings):
+        for artwork, rating in ratings.items():
+            model.session.add(model.ArtworkRating(
+                artwork=artwork, user=user, rating=rating))
+
+    def test_scores(self):
+        a, b, c, d = self.artworks
+        assert suggest.get_index() is None
+        suggest.rebuild(model.session)
+
+        index = suggest.get_index()
+        scores = index.scores(self.users[0].id, [b.id, d.id, d.id + 100])
+        assert scores[0] > 0 > scores[1]
+        assert scores[2] == 0
+        # Nothing is known about someone who hasn't rated anything
+        assert index.scores(self.users[4].id, [a.id]) is None
+
+        # A warm rebuild keeps the same tastes
+        suggest.rebuild(model.session)
+        index = suggest.get_index()
+        scores = index.scores(self.users[0].id, [b.id, d.id])
+        assert scores[0] > 0 > scores[1]
+
+    def test_gallery_order(self):
+        a, b, c, d = self.artworks
+        suggest.rebuild(model.session)
+
+        def ordered_ids(user):
+            sieve = GallerySieve(session=model.session, user=user)
+            sieve.order_by('suggest')
+            return [artwork.id for artwork in sieve.evaluate().items]
+
+        ids = ordered_ids(self.users[0])
+        assert set(ids[:2]) == set([a.id, b.id])
+        assert set(ids[2:]) == set([c.id, d.id])
+
+        # Unknown users get the newest art first
+        ids = ordered_ids(self.users[4])
+        assert ids == sorted(ids, reverse=True)
@@ -0,0 +1,80 @@
+import shutil
+import tempfile
+
+import transaction
+
+from floof import model
+from floof.lib import counts
+from floof.lib import indexes
+from floof.lib.indexes import postings
+from floof.lib.indexes import tagcomplete
+from floof.tests import UnitTests
+from floof.tests import sim
+
+
+class TestTagComplete(UnitTests):
+
+    def setUp(self):
+        super(TestTagComplete, self).setUp()
+        self.directory = tempfile.mkdtemp()
+        indexes.configure({'index.directory': self.directory})
+
+        user = sim.sim_user(credentials=[])
+        self.tags = dict((name, model.Tag(name))
+            for name in [u'cat', u'catgirl', u'cattle', u'dog'])
+        for tag in self.tags.values():
+            tag.usage_count = 0
+        for i, names in enumerate([
+                [u'catgirl', u'dog'], [u'catgirl'], [u'cattle']]):
+            artwork = sim.sim_artwork(user=user)
+            artwork.hash = u'tagcomplete-{0}'.format(i)
+            artwork.tag_objs.extend(self.tags[name] for name in names)
+            for name in names:
+                self.tags[name].usage_count += 1
+        model.session.add_all(self.tags.values())
+        model.session.flush()
+
+    def tearDown(self):
+        indexes.configure({})
+        shutil.rmtree(self.directory)
+        super(TestTagComplete, self).tearDown()
+
+    def test_complete(self):
+        # Straight from the database until the index is built
+        assert tagcomplete.get_index() is None
+        assert tagcomplete.complete(model.session, u'cat') == \
+            [(u'catgirl', 2), (u'cattle', 1), (u'cat', 0)]
+
+        tagcomplete.rebuild(model.session)
+        index = tagcomplete.get_index()
+        assert index.complete(u'cat') == \
+            [(u'catgirl', 2), (u'cattle', 1), (u'cat', 0)]
+        assert index.complete(u'catt') == [(u'cattle', 1)]
+        assert index.complete(u'ca', limit=1) == [(u'catgirl', 2)]
+        assert index.complete(u'x') == []
+
+    def test_journal(self):
+        tagcomplete.rebuild(model.session)
+        # Warm the short prefix cache, so it has to be cleared
+        assert [name for name, count in tagcomplete.complete(
+            model.session, u'c')] == [u'catgirl', u'cattle', u'cat']
+
+        # Tagged as in the views, then committed
+        cat_key = postings.tag_key(self.tags[u'cat'].id)
+        counts.adjust(model.session, added_keys=[cat_key])
+        counts.adjust(model.session, added_keys=[cat_key])
+        caterpillar = model.Tag(u'caterpillar')
+        caterpillar.usage_count = 3
+        model.session.add(caterpillar)
+        model.session.flush()
+        tagcomplete.record_usage(model.session,
+            [u'cat', u'caterpillar', u'cat'])
+        assert len(tagcomplete.complete(model.session, u'c')) == 3
+        for hook, args, kwargs in transaction.get().getAfterCommitHooks():
+            hook(True, *args, **kwargs)
+
+        assert tagcomplete.complete(model.session, u'c') == [
+            (u'caterpillar', 3), (u'cat', 2), (u'catgirl', 2),
+            (u'cattle', 1)]
+        assert tagcomplete.complete(model.session, u'cate') == \
+            [(u'caterpillar', 3)]
@@ -0,0 +1,76 @@
+import pytest
+
+from floof import model
+from floof.lib import tagquery
+from floof.lib.gallery import GallerySieve
+from floof.tests import UnitTests
+from floof.tests import sim
+
+
+class TestTagQuery(UnitTests):
+
+    def setUp(self):
+        super(TestTagQuery, self).setUp()
+        self.user = sim.sim_user(credentials=[])
+        self.tags = {}
+        for name in (u'dragon', u'fox', u'wolf'):
+            self.tags[name] = model.Tag(name)
+            model.session.add(self.tags[name])
+
+        # One artwork per combination of tags that matters below
+        self.art = {}
+        for i, names in enumerate([
+                (u'dragon',), (u'fox',), (u'dragon', u'fox'),
+                (u'dragon', u'fox', u'wolf'), ()]):
+            artwork = sim.sim_artwork(user=self.user)
+            artwork.hash = u'tagquery{0}'.format(i)
+            artwork.tag_objs.extend(self.tags[name] for name in names)
+            self.art[names] = artwork
+        self.art[(u'dragon',)].user_artwork.append(model.UserArtwork(
+            user_id=self.user.id, relationship_type=u'by'))
+        model.session.flush()
+
+    def matching(self, query):
+        sieve = GallerySieve(session=model.session)
+        unknown = sieve.filter_by_tag_query(query)
+        sieve._apply_posting_filters()
+        found = set(sieve.query)
+        return set(names for names, artwork in self.art.items()
+            if artwork in found), unknown
+
+    def test_parse_errors(self):
+        for query in [u'', u'(dragon', u'dragon)', u'dragon |', u'& fox',
+                u'who:dragon', u'by:']:
+            with pytest.raises(tagquery.TagQueryError):
+                tagquery.parse(query)
+
+        too_long = u' '.join([u'dragon'] * (tagquery.MAX_TERMS + 1))
+        with pytest.raises(tagquery.TagQueryError):
+            tagquery.parse(too_long)
+        too_deep = u'(' * (tagquery.MAX_DEPTH + 1) + u'dragon' \
+            + u')' * (tagquery.MAX_DEPTH + 1)
+        with pytest.raises(tagquery.TagQueryError):
+            tagquery.parse(too_deep)
+
+    def test_boolean_queries(self):
+        D, F, W = u'dragon', u'fox', u'wolf'
+        expected = {
+            u'dragon fox': set([(D, F), (D, F, W)]),
+            u'dragon AND fox': set([(D, F), (D, F, W)]),
+            u'dragon & fox -wolf': set([(D, F)]),
+            u'dragon | fox': set([(D,), (F,), (D, F), (D, F, W)]),
+            u'wolf OR (fox !dragon)': set([(F,), (D, F, W)]),
+            u'NOT dragon': set([(F,), ()]),
+            u'-dragon -fox': set([()]),
+            u'--wolf': set([(D, F, W)]),
+            u'by:{0} | wolf'.format(self.user.name): set([(D,), (D, F, W)]),
+            u'by:{0} fox'.format(self.user.name): set(),
+        }
+        for query, art in expected.items():
+            assert self.matching(query) == (art, []), query
+
+    def test_unknown_names(self):
+        assert self.matching(u'dragon bogus') == (set(), [u'bogus'])
+        assert self.matching(u'dragon -bogus')[0] \
+            == set([(u'dragon',), (u'dragon', u'fox'), (u'dragon', u'fox', u'wolf')])
+        assert self.matching(u'fox | of:nobody')[1] == [u'of:nobody']
@@ -0,0 +1,128 @@
+import shutil
+import tempfile
+
+import pytest
+
+from floof import model
+from floof.forms import MultiTagField
+from floof.lib import indexes
+from floof.lib import tagrules
+from floof.lib.gallery import GallerySieve
+from floof.lib.indexes import postings
+from floof.tests import UnitTests
+from floof.tests import sim
+
+
+class TestTagRules(UnitTests):
+
+    def setUp(self):
+        super(TestTagRules, self).setUp()
+        self.tags = {}
+        for name in (u'tabby', u'cat', u'feline', u'animal', u'dog'):
+            self.tags[name] = model.Tag(name)
+            model.session.add(self.tags[name])
+
+        user = sim.sim_user(credentials=[])
+        self.art = {}
+        for name in (u'tabby', u'cat', u'dog', u'animal'):
+            artwork = sim.sim_artwork(user=user)
+            artwork.hash = u'tagrules-' + name
+            artwork.tag_objs.append(self.tags[name])
+            self.art[name] = artwork
+        model.session.flush()
+
+    def implies(self, name, implied_name):
+        tagrules.add_implication(model.session,
+            self.tags[name], self.tags[implied_name])
+
+    def implying(self, name):
+        tag_id = self.tags[name].id
+        ids = tagrules.implying_tag_ids(model.session, [tag_id])[tag_id]
+        return set(tag.name for tag in self.tags.values() if tag.id in ids)
+
+    def tagged(self, name):
+        sieve = GallerySieve(session=model.session)
+        sieve.filter_by_tag(name)
+        sieve._apply_posting_filters()
+        found = set(sieve.query)
+        return set(key for key, artwork in self.art.items()
+            if artwork in found)
+
+    def test_closure(self):
+        # Built up out of order, so both ends of the chain have to be joined
+        self.implies(u'tabby', u'cat')
+        self.implies(u'feline', u'animal')
+        self.implies(u'cat', u'feline')
+        self.implies(u'dog', u'animal')
+        assert self.implying(u'animal') == \
+            set([u'tabby', u'cat', u'feline', u'dog'])
+        assert self.implying(u'cat') == set([u'tabby'])
+
+        assert self.tagged(u'animal') == \
+            set([u'tabby', u'cat', u'dog', u'animal'])
+        assert self.tagged(u'cat') == set([u'tabby', u'cat'])
+        assert self.tagged(u'tabby') == set([u'tabby'])
+
+        with pytest.raises(ValueError):
+            self.implies(u'animal', u'tabby')
+        with pytest.raises(ValueError):
+            self.implies(u'cat', u'cat')
+
+        tagrules.remove_implication(model.session,
+            self.tags[u'cat'], self.tags[u'feline'])
+        assert self.implying(u'animal') == set([u'feline', u'dog'])
+        assert self.tagged(u'animal') == set([u'dog', u'animal'])
+        with pytest.raises(ValueError):
+            tagrules.remove_implication(model.session,
+                self.tags[u'cat'], self.tags[u'feline'])
+
+        self.implies(u'cat', u'feline')
+        before = self.implying(u'animal')
+        tagrules.rebuild_closure(model.session)
+        assert self.implying(u'animal') == before
+
+    def test_implied_through_postings(self):
+        self.implies(u'tabby', u'cat')
+        directory = tempfile.mkdtemp()
+        indexes.configure({'index.directory': directory})
+        try:
+            postings.rebuild(model.session)
+            sieve = GallerySieve(session=model.session, countable=True)
+            sieve.filter_by_tag(u'cat')
+            pager = sieve.evaluate()
+
+            # One union of the two lists, which counts itself
+            expected = set([self.art[u'tabby'].id, self.art[u'cat'].id])
+            assert sieve._posting_ids == expected
+            assert (pager.item_count, pager.item_count_is_estimate) \
+                == (2, False)
+        finally:
+            indexes.configure({})
+            shutil.rmtree(directory)
+
+    def test_aliases(self):
+        tagrules.add_alias(model.session, u'kitty', self.tags[u'cat'])
+        with pytest.raises(ValueError):
+            tagrules.add_alias(model.session, u'dog', self.tags[u'cat'])
+        with pytest.raises(ValueError):
+            tagrules.add_alias(model.session, u'kitty', self.tags[u'dog'])
+
+        assert tagrules.canonical_names(model.session,
+            [u'kitty', u'dog', u'cat']) == [u'cat', u'dog']
+
+        field = MultiTagField().bind(None, 'tags')
+        field.process_formdata([u'kitty dog'])
+        assert field.data == [u'cat', u'dog']
+
+        self.implies(u'tabby', u'cat')
+        sieve = GallerySieve(session=model.session)
+        sieve.filter_by_tag_query(u'kitty')
+        sieve._apply_posting_filters()
+        found = set(sieve.query)
+        assert found == set([self.art[u'tabby'], self.art[u'cat']])
+
+        with pytest.raises(ValueError):
+            tagrules.remove_alias(model.session, u'kitty', self.tags[u'dog'])
+        tagrules.remove_alias(model.session, u'kitty', self.tags[u'cat'])
+        assert tagrules.canonical_names(model.session, [u'kitty']) \
+            == [u'kitty']
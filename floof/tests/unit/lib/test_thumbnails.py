@@ -0,0 +1,137 @@
+from cStringIO import StringIO
+import shutil
+import tempfile
+
+try:
+    import Image
+except ImportError:
+    from PIL import Image
+import transaction
+
+from floof.lib import thumbnails
+from floof.model.filestore import get_storage_factory
+from floof.tests import UnitTests
+
+
+class TestThumbnails(UnitTests):
+
+    def setUp(self):
+        super(TestThumbnails, self).setUp()
+        self.directory = tempfile.mkdtemp()
+        self.settings = {
+            'filestore': 'local',
+            'filestore.directory': self.directory,
+            'thumbnail_size': '160',
+            'thumbnail.workers': '0',
+        }
+        thumbnails.configure(self.settings)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+        super(TestThumbnails, self).tearDown()
+
+    def _store_original(self, size):
+        buf = StringIO()
+        Image.new('RGB', size, (0, 128, 255)).save(buf, 'PNG')
+        buf.seek(0)
+
+        manager = transaction.TransactionManager()
+        storage = get_storage_factory(self.settings)()
+        manager.begin().join(storage)
+        storage.put(u'artwork', u'deadbeef', buf)
+        manager.commit()
+        return storage
+
+    def _thumbnail_size(self, storage):
+        path = storage._path(self.directory, u'thumbnail', u'deadbeef')
+        return Image.open(path).size
+
+    def test_make_thumbnail(self):
+        image = Image.new('RGB', (1000, 200))
+        # Cropped to 2:1, then shrunk to fit
+        assert thumbnails.make_thumbnail(image, 160).size == (160, 80)
+
+        image = Image.new('RGB', (100, 50))
+        assert thumbnails.make_thumbnail(image, 160).size == (100, 50)
+
+    def test_make_thumbnail_draft(self):
+        buf = StringIO()
+        Image.new('RGB', (4000, 1500), (0, 128, 255)).save(buf, 'JPEG')
+        buf.seek(0)
+        image = Image.open(buf)
+
+        # Decoded at 1/8 scale, cropped to 2:1, then shrunk to fit
+        thumbnail = thumbnails.make_thumbnail(image, 160)
+        assert image.size == (500, 188)
+        assert thumbnail.size == (160, 80)
+        assert thumbnail.getpixel((80, 40)) == image.getpixel((0, 0))
+
+    def test_too_many_pixels(self):
+        image = Image.new('L', (1000, 1000))
+        assert not thumbnails.too_many_pixels(image, 1000000)
+        assert thumbnails.too_many_pixels(image, 999999)
+
+        self.settings['thumbnail.max_pixels'] = '500000'
+        thumbnails.configure(self.settings)
+        assert thumbnails.too_many_pixels(image)
+
+        # Even somewhere that never configured it
+        thumbnails._settings = None
+        assert not thumbnails.too_many_pixels(image)
+        assert thumbnails.too_many_pixels(
+            Image.new('1', (thumbnails.MAX_PIXELS + 1, 1)))
+
+    def test_generate(self):
+        storage = self._store_original((640, 480))
+        assert not storage.exists(u'thumbnail', u'deadbeef')
+
+        assert thumbnails.generate(thumbnails._settings, u'deadbeef',
+            u'image/png')
+        assert storage.exists(u'thumbnail', u'deadbeef')
+        assert self._thumbnail_size(storage) == (160, 120)
+
+        # Only made once
+        assert not thumbnails.generate(thumbnails._settings, u'deadbeef',
+            u'image/png')
+
+        # Another process storing it first isn't an error
+        assert not thumbnails.store(get_storage_factory(self.settings),
+            u'thumbnail', u'deadbeef', StringIO('elsewhere'))
+        assert self._thumbnail_size(storage) == (160, 120)
+
+    def test_generate_after_commit(self):
+        storage = self._store_original((640, 480))
+
+        thumbnails.generate_later(u'deadbeef', u'image/png')
+        assert not storage.exists(u'thumbnail', u'deadbeef')
+
+        transaction.commit()
+        assert self._thumbnail_size(storage) == (160, 120)
+        assert not thumbnails._pending
+
+    def test_not_after_abort(self):
+        storage = self._store_original((640, 480))
+
+        thumbnails.generate_later(u'deadbeef', u'image/png')
+        transaction.abort()
+        assert not storage.exists(u'thumbnail', u'deadbeef')
+
+    def test_pool(self):
+        storage = self._store_original((640, 480))
+        self.settings['thumbnail.workers'] = '1'
+        thumbnails.configure(self.settings)
+        thumbnails.start()
+        try:
+            thumbnails.ensure(u'deadbeef', u'image/png')
+            # Already queued
+            thumbnails.ensure(u'deadbeef', u'image/png')
+            assert thumbnails._pending == set([u'deadbeef'])
+
+            pool = thumbnails._pool
+            pool.close()
+            pool.join()
+        finally:
+            thumbnails._pool = None
+
+        assert self._thumbnail_size(storage) == (160, 120)
+        assert not thumbnails._pending
@@ -0,0 +1,87 @@
+import shutil
+import tempfile
+
+from floof import model
+from floof.lib import gallery
+from floof.lib import indexes
+from floof.lib.gallery import GallerySieve
+from floof.lib.indexes import watchgraph
+from floof.tests import UnitTests
+from floof.tests import sim
+
+
+class TestWatchGraph(UnitTests):
+
+    def setUp(self):
+        super(TestWatchGraph, self).setUp()
+        self.directory = tempfile.mkdtemp()
+        indexes.configure({'index.directory': self.directory})
+
+        # a watches b and c; b and c both watch d; b also watches a and c
+        self.a, self.b, self.c, self.d, self.e = users = \
+            [sim.sim_user(credentials=[]) for i in range(5)]
+        for watcher, watched in [
+                (self.a, self.b), (self.a, self.c),
+                (self.b, self.d), (self.c, self.d),
+                (self.b, self.a), (self.b, self.c), (self.c, self.e)]:
+            model.session.add(model.UserWatch(user=watcher, other_user=watched))
+
+        self.artworks = {}
+        for user in users:
+            artwork = sim.sim_artwork(user=user)
+            artwork.hash = u'watchgraph-' + user.name
+            artwork.user_artwork.append(model.UserArtwork(
+                user=user, relationship_type=u'by'))
+            self.artworks[user] = artwork
+        model.session.flush()
+
+    def tearDown(self):
+        indexes.configure({})
+        shutil.rmtree(self.directory)
+        super(TestWatchGraph, self).tearDown()
+
+    def network_art(self):
+        sieve = GallerySieve(session=model.session)
+        sieve.filter_by_friends_of_friends(self.a)
+        return set(artwork.id for artwork in sieve.evaluate().items)
+
+    def test_graph(self):
+        # Without the index, SQL gets the same answer
+        expected = set([self.artworks[self.d].id, self.artworks[self.e].id])
+        assert self.network_art() == expected
+
+        watchgraph.rebuild(model.session)
+        index = watchgraph.get_index()
+        assert index.watched(self.a.id) == set([self.b.id, self.c.id])
+        assert index.friends_of_friends(self.a.id) == \
+            set([self.d.id, self.e.id])
+        assert index.suggestions(self.a.id) == [self.d.id, self.e.id]
+        assert self.network_art() == expected
+
+        # Watches are picked up from the journal
+        indexes.append_journal(watchgraph.NAME, [
+            '- {0:d} {1:d}'.format(self.a.id, self.c.id),
+            '+ {0:d} {1:d}'.format(self.a.id, self.e.id),
+        ])
+        index = watchgraph.get_index()
+        assert index.watched(self.a.id) == set([self.b.id, self.e.id])
+        assert index.friends_of_friends(self.a.id) == \
+            set([self.c.id, self.d.id])
+
+    def test_gallery_limits(self):
+        watchgraph.rebuild(model.session)
+        expected = set([self.artworks[self.d].id, self.artworks[self.e].id])
+
+        # Too many friends of friends to list are left to the database
+        old_limit = gallery.MAX_FRIENDS_OF_FRIENDS
+        gallery.MAX_FRIENDS_OF_FRIENDS = 1
+        try:
+            assert self.network_art() == expected
+        finally:
+            gallery.MAX_FRIENDS_OF_FRIENDS = old_limit
+
+        # Nobody at all is just nothing
+        sieve = GallerySieve(session=model.session)
+        sieve.filter_by_friends_of_friends(self.e)
+        assert ('nothing',) in sieve._cache_parts
+        assert sieve.evaluate().items == []
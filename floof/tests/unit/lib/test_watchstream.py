@@ -0,0 +1,54 @@
+from floof import model
+from floof.lib import watchstream
+from floof.tests import UnitTests
+from floof.tests import sim
+
+
+class TestWatchstream(UnitTests):
+
+    def setUp(self):
+        super(TestWatchstream, self).setUp()
+        self.watcher = sim.sim_user(credentials=[])
+        self.artist = sim.sim_user(credentials=[])
+
+    def _watch(self, **flags):
+        watch = model.UserWatch(user=self.watcher, other_user=self.artist,
+            **flags)
+        model.session.add(watch)
+        model.session.flush()
+        return watch
+
+    def _entries(self):
+        return set(artwork_id for (artwork_id,) in
+            model.session.query(model.WatchstreamEntry.artwork_id)
+                .filter_by(user_id=self.watcher.id))
+
+    def test_fan_out_upload(self):
+        self._watch(watch_upload=True)
+        artwork = sim.sim_artwork(user=self.artist)
+        model.session.flush()
+
+        watchstream.fan_out(model.session, artwork)
+        assert self._entries() == set([artwork.id])
+
+    def test_fan_out_ignores_unwatched_relationship(self):
+        self._watch(watch_by=True)
+        artwork = sim.sim_artwork(user=self.artist)
+        model.session.flush()
+
+        watchstream.fan_out(model.session, artwork)
+        assert self._entries() == set()
+
+    def test_rebuild(self):
+        artwork = sim.sim_artwork(user=self.watcher)
+        artwork.user_artwork.append(model.UserArtwork(
+            user_id=self.artist.id, relationship_type=u'by'))
+        model.session.flush()
+
+        watch = self._watch(watch_by=True)
+        watchstream.rebuild(model.session, self.watcher)
+        assert self._entries() == set([artwork.id])
+
+        watch.watch_by = False
+        watchstream.rebuild(model.session, self.watcher)
+        assert self._entries() == set()
@@ -10,6 +10,7 @@ from floof.model.filestore import get_storage_factory
 from floof.tests import UnitTests
 from floof.tests.unit.model.filestore import AlwaysFailDataManager
 from floof.tests.unit.model.filestore import IntentionalError
+from floof.tests.unit.model.filestore import make_key
 from floof.tests.unit.model.filestore import storage_put, storage_put_tester
 
 
@@ -67,6 +68,19 @@ class TestLocalFileStore(UnitTests):
         fetched = urllib2.urlopen(url, timeout=5)
         assert fetched.read() == data.read()
 
+    def test_committed_url(self):
+        storage = self._get_storage()
+        cls, key, data = storage_put(storage)
+
+        # Unlike url(), nothing until it's really there
+        assert storage.committed_url(cls, key) is None
+        assert not storage.exists(cls, key)
+
+        transaction.commit()
+
+        assert storage.committed_url(cls, key) == storage.url(cls, key)
+        assert storage.exists(cls, key)
+
     def test_commit_process(self):
         storage = self._get_storage()
         cls, key, data = storage_put(storage)
@@ -106,3 +120,54 @@ class TestLocalFileStore(UnitTests):
         # The tempfiles should have been cleaned up on failure
         assert os.path.exists(self.tempdir)
         assert not os.listdir(self.tempdir)
+
+    def _write_source(self, data):
+        path = os.path.join(self.directory, 'source')
+        with open(path, 'wb') as f:
+            f.write(data)
+        return path
+
+    def test_put_path(self):
+        storage = self._get_storage()
+        source = self._write_source('x' * 1000)
+        key = make_key()
+        storage.put_path('artwork', key, source)
+
+        # The staged file is another name for the source, not a copy, and
+        # survives the source being deleted
+        staged = storage.staged_paths[storage._idx('artwork', key)]
+        assert os.path.dirname(staged) == self.tempdir
+        assert os.stat(staged).st_ino == os.stat(source).st_ino
+        os.remove(source)
+
+        transaction.commit()
+
+        destpath = storage._path(self.directory, 'artwork', key)
+        with open(destpath, 'rb') as f:
+            assert f.read() == 'x' * 1000
+        assert not os.listdir(self.tempdir)
+
+    def test_put_path_abort(self):
+        storage = self._get_storage()
+        source = self._write_source('x' * 1000)
+        storage.put_path('artwork', make_key(), source)
+        assert os.listdir(self.tempdir)
+
+        transaction.abort()
+
+        assert not os.listdir(self.tempdir)
+        assert os.path.isfile(source)
+
+    def test_put_spools(self):
+        storage = self._get_storage()
+        storage.spool_threshold = 100
+        cls, key, data = storage_put(storage, data='y' * 1000)
+
+        # Too big to keep in memory
+        stageobj = storage.stage[storage._idx(cls, key)][2]
+        assert stageobj._rolled
+
+        transaction.commit()
+
+        with open(storage._path(self.directory, cls, key), 'rb') as f:
+            assert f.read() == 'y' * 1000
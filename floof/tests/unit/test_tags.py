@@ -30,10 +30,8 @@ class TestTagViews(UnitTests):
 
         render_dict = index(None, request)
 
-        # ['tags'] is a query on the Tag table
-        q = render_dict['tags'].filter_by(name=tag.name)
-
-        assert q.one().name == tag.name
+        # ['tags'] is a pager over the Tag table
+        assert tag in list(render_dict['tags'])
 
     def test_view(self):
         """Test that the tag view page exists."""
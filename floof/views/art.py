@@ -1,18 +1,25 @@
 # encoding: utf8
 from __future__ import division
-from cStringIO import StringIO
-import hashlib
 import logging
 
-import magic
 from pyramid.httpexceptions import HTTPBadRequest, HTTPSeeOther
 from pyramid.view import view_config
+from sqlalchemy.orm import joinedload
 import wtforms.form, wtforms.fields, wtforms.validators
 from wtforms.ext.sqlalchemy.fields import QuerySelectMultipleField
 
 from floof import model
 from floof.forms import MultiCheckboxField, MultiTagField, QueryMultiCheckboxField
-from floof.lib.gallery import GallerySieve
+from floof.lib import counts
+from floof.lib import imagehash
+from floof.lib import leaderboards
+from floof.lib import thumbnails
+from floof.lib import watchstream
+from floof.lib.gallery import GallerySieve, invalidate_cache
+from floof.lib.ingest import ingest
+from floof.lib.indexes import postings
+from floof.lib.indexes import similar
+from floof.lib.indexes import tagcomplete
 
 # XXX import from somewhere
 class CommentForm(wtforms.form.Form):
@@ -26,9 +33,6 @@ except ImportError:
 
 log = logging.getLogger(__name__)
 
-HASH_BUFFER_SIZE = 524288  # .5 MiB
-MAX_ASPECT_RATIO = 2
-
 def get_number_of_colors(image):
     """Does what it says on the tin.
 
@@ -109,25 +113,33 @@ def upload(context, request):
         form.file.errors.append("Please select a file to upload!")
         return ret
 
-    # Figure out mimetype (and if we even support it)
-    mimetype = magic.Magic(mime=True).from_buffer(fileobj.read(1024)) \
-        .decode('ascii')
+    # Read the whole thing in once: sniff, hash, count, and spool it
+    ingested = ingest(fileobj, storage.spool_directory)
+    try:
+        return _store_upload(request, form, uploaded_file, ingested)
+    finally:
+        ingested.discard()
+
+def _store_upload(request, form, uploaded_file, ingested):
+    """The rest of `upload`, once the file has been read in."""
+    storage = request.storage
+    ret = dict(form=form)
+
+    # Check the mimetype (and if we even support it)
+    mimetype = ingested.mimetype
     if mimetype not in (u'image/png', u'image/gif', u'image/jpeg'):
         form.file.errors.append("Only PNG, GIF, and JPEG are supported at the moment.")
         return ret
 
-    # Hash the thing
-    hasher = hashlib.sha256()
-    file_size = 0
-    fileobj.seek(0)
-    while True:
-        buffer = fileobj.read(HASH_BUFFER_SIZE)
-        if not buffer:
-            break
+    # Only the header is read here; check it claims a sane size before
+    # anything decodes it
+    image = Image.open(ingested.path)
+    if thumbnails.too_many_pixels(image):
+        form.file.errors.append("That image is too big.  Please upload something smaller.")
+        return ret
 
-        file_size += len(buffer)
-        hasher.update(buffer)
-    hash = hasher.hexdigest().decode('ascii')
+    hash = ingested.hash
+    file_size = ingested.size
 
     # Assert that the thing is unique
     existing_artwork = model.session.query(model.Artwork) \
@@ -141,47 +153,25 @@ def upload(context, request):
 
     ### By now, all error-checking should be done.
 
-    # OK, store the file.  Reset the file object first!
-    fileobj.seek(0)
-    storage.put(u'artwork', hash, fileobj)
+    # OK, store the file.  Staging by path links the spooled copy rather
+    # than reading it yet again
+    storage.put_path(u'artwork', hash, ingested.path)
 
-    # Open the image, determine its size, and generate a thumbnail
-    fileobj.seek(0)
-    image = Image.open(fileobj)
     width, height = image.size
 
-    # Thumbnailin'
-    thumbnail_size = int(request.registry.settings['thumbnail_size'])
-    # To avoid super-skinny thumbnails, don't let the aspect ratio go
-    # beyond 2
-    height = min(height, width * MAX_ASPECT_RATIO)
-    width = min(width, height * MAX_ASPECT_RATIO)
-    # crop() takes left, top, right, bottom
-    cropped_image = image.crop((0, 0, width, height))
-    # And resize...  if necessary
-    if width > thumbnail_size or height > thumbnail_size:
-        if width > height:
-            new_size = (thumbnail_size, height * thumbnail_size // width)
-        else:
-            new_size = (width * thumbnail_size // height, thumbnail_size)
-
-        thumbnail_image = cropped_image.resize(
-            new_size, Image.ANTIALIAS)
+    # Byte-identical files were caught above; this catches re-encodes.  Big
+    # PNGs and GIFs have to be decoded in full for it, so that happens on the
+    # thumbnail pool rather than in here
+    image_hash = thumbnails.run(imagehash.hash_file, ingested.path)
+    similar_ids = imagehash.find_similar(model.session, image_hash)
 
-    else:
-        thumbnail_image = cropped_image
-
-    # Dump the thumbnail in a buffer and save it, too
-    buf = StringIO()
-    if mimetype == u'image/png':
-        thumbnail_format = 'PNG'
-    elif mimetype == u'image/gif':
-        thumbnail_format = 'GIF'
-    elif mimetype == u'image/jpeg':
-        thumbnail_format = 'JPEG'
-    thumbnail_image.save(buf, thumbnail_format)
-    buf.seek(0)
-    storage.put(u'thumbnail', hash, buf)
+    # The recorded size is cropped just like the thumbnail
+    height = min(height, width * thumbnails.MAX_ASPECT_RATIO)
+    width = min(width, height * thumbnails.MAX_ASPECT_RATIO)
+
+    # Thumbnailing can take a while, so it happens in the background once
+    # the original is committed
+    thumbnails.generate_later(hash, mimetype)
 
     # Deal with user-supplied metadata
     # nb: it's perfectly valid to have no title or remark
@@ -205,6 +195,7 @@ def upload(context, request):
         height = height,
         width = width,
         number_of_colors = get_number_of_colors(image),
+        dhash = imagehash.to_hex(image_hash),
         **general_data
     )
 
@@ -229,7 +220,25 @@ def upload(context, request):
     model.session.add_all([artwork, discussion, resource])
     model.session.flush()  # for primary keys
 
+    watchstream.fan_out(model.session, artwork)
+    postings.record_changes(artwork.id, postings.artwork_keys(artwork))
+    similar.record_changes(artwork)
+    counts.adjust(model.session, counts.artwork_keys(artwork))
+    tagcomplete.record_usage(model.session, form.tags.data)
+    invalidate_cache('artwork')
+
     request.session.flash(u'Uploaded!', level=u'success', icon=u'image--plus')
+    # Closest first; one may have been deleted since this worker saw it
+    for similar_id in similar_ids:
+        original = model.session.query(model.Artwork).get(similar_id)
+        if original:
+            request.session.flash(
+                u'This looks a lot like <a href="{0}">something already '
+                u'uploaded</a>.'.format(
+                    request.route_url('art.view', artwork=original)),
+                level=u'warning', icon=u'image-import', html_escape=False)
+            break
+
     return HTTPSeeOther(location=request.route_url('art.view', artwork=artwork))
 
 
@@ -241,9 +250,29 @@ def browse(context, request):
     """Main gallery; provides browsing through absolutely everything we've
     got.
     """
-    gallery_sieve = GallerySieve(user=request.user, formdata=request.GET)
+    gallery_sieve = GallerySieve(user=request.user, formdata=request.GET,
+        projection=True)
     return dict(gallery_sieve=gallery_sieve)
 
+@view_config(
+    route_name='art.random',
+    request_method='GET')
+def random_artwork(context, request):
+    """Sends the user to a random piece of art, out of whatever the usual
+    gallery filters would show.
+    """
+    gallery_sieve = GallerySieve(user=request.user, formdata=request.GET)
+    ids = gallery_sieve.sample_ids(1)
+    if not ids:
+        request.session.flash(u"There's no art like that to pick from",
+            level=u'error')
+        return HTTPSeeOther(location=request.route_url('art.browse',
+            _query=request.GET))
+
+    artwork = model.session.query(model.Artwork).get(ids[0])
+    return HTTPSeeOther(
+        location=request.route_url('art.view', artwork=artwork))
+
 @view_config(
     route_name='art.view',
     request_method='GET',
@@ -260,9 +289,25 @@ def view(artwork, request):
         if rating_obj:
             current_rating = rating_obj.rating
 
+    # "Art like this", if the similarity index has been built
+    related = []
+    related_index = similar.get_index()
+    if related_index is not None:
+        related_ids = related_index.neighbours(artwork.id)
+        if related_ids:
+            related_by_id = dict(
+                (related_artwork.id, related_artwork)
+                for related_artwork in model.session.query(model.Artwork)
+                    .filter(model.Artwork.id.in_(related_ids))
+                    .options(joinedload('uploader')))
+            related = [related_by_id[related_id] for related_id in related_ids
+                if related_id in related_by_id]
+
     return dict(
         artwork=artwork,
         current_rating=current_rating,
+        related=related,
+        related_index=related_index,
         comment_form=CommentForm(),
         add_tag_form=AddTagForm(),
         remove_tag_form=RemoveTagForm(),
@@ -304,6 +349,9 @@ def rate(artwork, request):
         )
         model.session.add(rating_obj)
 
+    leaderboards.record_rating(model.session, artwork)
+    invalidate_cache('ratings')
+
     # If the request has the asynchronous parameter, we return the number/sum
     # of ratings to update the widget
     if request.is_xhr:
@@ -347,6 +395,15 @@ def add_tags(artwork, request):
     for tag in form.tags.data:
         artwork.tags.append(tag)
 
+    model.session.flush()  # for new tags' ids
+    added_keys = [postings.tag_key(tag_obj.id)
+        for tag_obj in artwork.tag_objs if tag_obj.name in form.tags.data]
+    postings.record_changes(artwork.id, added_keys=added_keys)
+    similar.record_changes(artwork)
+    counts.adjust(model.session, added_keys=added_keys)
+    tagcomplete.record_usage(model.session, form.tags.data)
+    invalidate_cache('tags')
+
     if len(form.tags.data) == 1:
         request.session.flash(u"Tag \"{0}\" has been added".format(tag))
     else:
@@ -381,8 +438,16 @@ def remove_tags(artwork, request):
         # FIXME when the final UI is figured out
         return HTTPBadRequest()
 
+    removed_keys = [postings.tag_key(tag_obj.id)
+        for tag_obj in artwork.tag_objs if tag_obj.name in form.tags.data]
+    postings.record_changes(artwork.id, removed_keys=removed_keys)
+    counts.adjust(model.session, removed_keys=removed_keys)
+    invalidate_cache('tags')
+
     for tag in form.tags.data:
         artwork.tags.remove(tag)
+    similar.record_changes(artwork)
+    tagcomplete.record_usage(model.session, form.tags.data)
 
     if len(form.tags.data) == 1:
         request.session.flash(u"Tag \"{0}\" has been removed".format(tag))
@@ -7,6 +7,9 @@ from pyramid.view import view_config
 import wtforms
 
 from floof import model
+from floof.lib import watchstream
+from floof.lib.gallery import invalidate_cache
+from floof.lib.indexes import watchgraph
 
 log = logging.getLogger(__name__)
 
@@ -25,8 +28,21 @@ def relationships(context, request):
         .order_by(model.UserWatch.created_time.desc())
     watches = q.all()
 
+    # People watched by the people you watch
+    suggested_users = []
+    index = watchgraph.get_index()
+    if index is not None:
+        suggested_ids = index.suggestions(request.user.id)
+        if suggested_ids:
+            users_by_id = dict((user.id, user) for user in
+                model.session.query(model.User)
+                    .filter(model.User.id.in_(suggested_ids)))
+            suggested_users = [users_by_id[user_id]
+                for user_id in suggested_ids if user_id in users_by_id]
+
     return {
         'watches': q.all(),
+        'suggested_users': suggested_users,
     }
 
 class WatchForm(wtforms.form.Form):
@@ -94,6 +110,9 @@ def relationships_watch_commit(context, request):
     watch.watch_of = watch_form.watch_of.data
 
     model.session.add(watch)
+    watchstream.rebuild(model.session, request.user)
+    watchgraph.record_watch(request.user.id, target_user.id)
+    invalidate_cache('watches')
 
     # XXX where should this redirect?
     request.session.flash(
@@ -124,6 +143,9 @@ def relationships_unwatch_commit(context, request):
     model.session.query(model.UserWatch) \
         .filter_by(user=request.user, other_user=target_user) \
         .delete()
+    watchstream.rebuild(model.session, request.user)
+    watchgraph.record_watch(request.user.id, target_user.id, watching=False)
+    invalidate_cache('watches')
 
     # XXX where should this redirect?
     request.session.flash(
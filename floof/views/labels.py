@@ -28,7 +28,8 @@ def index_per_user(user, request):
     renderer='labels/artwork.mako')
 def artwork(label, request):
     """Show a gallery of artwork for this label."""
-    gallery_sieve = GallerySieve(user=request.user, formdata=request.params)
+    gallery_sieve = GallerySieve(user=request.user, formdata=request.params,
+        projection=True)
     gallery_sieve.filter_by_label(label)
 
     return dict(
@@ -8,6 +8,8 @@ from pyramid.response import Response
 from pyramid.view import view_config
 
 from floof import model
+from floof.lib import renditions
+from floof.lib import thumbnails
 
 log = logging.getLogger(__name__)
 
@@ -44,9 +46,42 @@ def filestore(context, request):
     """
     class_ = request.matchdict['class_']
     key = request.matchdict['key']
+    hash = key
 
     storage = request.storage
-    storage_url = storage.url(class_, key)
+    if class_ == renditions.CLASS:
+        # Queued on first request; see renditions.ensure
+        try:
+            hash, width = renditions.parse_key(key)
+        except ValueError:
+            raise NotFound()
+        artwork = model.session.query(model.MediaImage) \
+            .filter_by(hash=hash) \
+            .first()
+        if not artwork:
+            raise NotFound()
+
+        if width not in renditions.widths_for(artwork) \
+                or not renditions.ensure(storage, artwork, width):
+            # Not worth making, or not made yet; the original will do
+            return HTTPSeeOther(location=request.route_url(
+                'filestore', class_=u'artwork', key=artwork.hash))
+
+    # One lookup, since with MogileFS each is a round trip to the tracker
+    storage_url = storage.committed_url(class_, key)
+    if class_ == u'thumbnail' and not storage_url:
+        # Probably still being made; make sure it's on its way, and show a
+        # placeholder for now.  A redirect, so it isn't cached in its place
+        artwork = model.session.query(model.Artwork) \
+            .filter_by(hash=key) \
+            .first()
+        if not artwork:
+            raise NotFound()
+
+        thumbnails.ensure(artwork.hash, artwork.mime_type)
+        return HTTPSeeOther(location=request.static_url(
+            'floof:public/images/thumbnail-pending.png'))
+
     if not storage_url:
         # No such file, oh dear
         log.warn("File {0}:{1} is missing".format(class_, key))
@@ -55,17 +90,17 @@ def filestore(context, request):
     # Get the MIME type and a filename
     # TODO this is surely not the most reliable way of doing this.
     headerlist = []
-    if class_ in (u'thumbnail', u'artwork'):
+    if class_ in (u'thumbnail', u'artwork', renditions.CLASS):
         try:
             artwork = model.session.query(model.Artwork) \
-                .filter_by(hash=key) \
+                .filter_by(hash=hash) \
                 .one()
         except NoResultFound:
             raise NotFound()
 
         headerlist.append(('Content-Type', artwork.mime_type))
 
-        # Don't bother setting disposition for thumbnails
+        # Don't bother setting disposition for thumbnails or renditions
         if class_ == u'artwork':
             mtime_rfc822 = artwork.uploaded_time.strftime(
                 "%a, %d %b %Y %H:%M:%S %Z")
@@ -1,30 +1,103 @@
 # encoding: utf8
 import logging
+import math
 
+from pyramid.httpexceptions import HTTPBadRequest, HTTPSeeOther
 from pyramid.view import view_config
+import wtforms.form, wtforms.fields, wtforms.validators
 
 from floof import model
-from floof.lib.gallery import GallerySieve
+from floof.lib import tagrules
+from floof.lib.gallery import GallerySieve, invalidate_cache
+from floof.lib.indexes import cooccurrence
+from floof.lib.indexes import tagcomplete
+from floof.lib.pager import KeysetPager
 
 log = logging.getLogger(__name__)
 
+TAG_PAGE_SIZE = 200
+# Number of distinct sizes in the tag cloud
+CLOUD_WEIGHTS = 5
+RELATED_TAG_COUNT = 20
+
 @view_config(
     route_name='tags.list',
     request_method='GET',
     renderer='tags/index.mako')
 def index(context, request):
-    q = model.session.query(model.Tag).order_by(model.Tag.name)
+    """Every tag, a page at a time, alphabetically or most used first."""
+    sort = request.GET.get('sort')
+    if sort != u'popular':
+        sort = u'name'
+
+    q = model.session.query(model.Tag)
+    if sort == u'popular':
+        q = q.order_by(model.Tag.usage_count.desc(), model.Tag.id.desc())
+        pager = KeysetPager(q, TAG_PAGE_SIZE,
+            model.Tag.usage_count, model.Tag.id, formdata=request.GET)
+    else:
+        q = q.order_by(model.Tag.name, model.Tag.id)
+        pager = KeysetPager(q, TAG_PAGE_SIZE,
+            model.Tag.name, model.Tag.id, formdata=request.GET,
+            descending=False)
+
+    # Scale each tag's size to its usage, relative to the rest of the page
+    most_used = max([tag.usage_count for tag in pager] or [0])
+    weights = dict(
+        (tag.id, _cloud_weight(tag.usage_count, most_used))
+        for tag in pager)
+
     return dict(
-        tags=q,
+        tags=pager,
+        sort=sort,
+        weights=weights,
     )
 
+def _cloud_weight(usage_count, most_used):
+    """Returns a size from 1 to `CLOUD_WEIGHTS`, on a log scale."""
+    if most_used <= 1 or usage_count <= 1:
+        return 1
+    return 1 + int((CLOUD_WEIGHTS - 1) *
+        math.log(usage_count) / math.log(most_used))
+
+
+@view_config(
+    route_name='tags.complete',
+    request_method='GET',
+    renderer='json')
+def complete(context, request):
+    """Suggest existing tags starting with the last word of `q`."""
+    words = request.GET.get('q', u'').lower().split()
+    if not words:
+        return dict(tags=[])
+
+    return dict(tags=[
+        dict(name=name, count=count)
+        for name, count in tagcomplete.complete(model.session, words[-1])])
+
 
 @view_config(
     route_name='tags.view',
     request_method='GET',
     renderer='tags/view.mako')
 def view(tag, request):
-    return dict(tag=tag)
+    related_tags = []
+    index = cooccurrence.get_index()
+    if index is not None:
+        pairs = index.related(tag.id, RELATED_TAG_COUNT)
+        if pairs:
+            tags = dict((other.id, other) for other in
+                model.session.query(model.Tag)
+                .filter(model.Tag.id.in_([tag_id for tag_id, count in pairs])))
+            related_tags = [(tags[tag_id], count)
+                for tag_id, count in pairs if tag_id in tags]
+
+    return dict(
+        tag=tag,
+        related_tags=related_tags,
+        add_alias_form=TagRuleForm(),
+        add_implication_form=TagRuleForm(),
+    )
 
 
 @view_config(
@@ -33,10 +106,118 @@ def view(tag, request):
     renderer='tags/artwork.mako')
 def artwork(tag, request):
     """Show a gallery of artwork for this tag."""
-    gallery_sieve = GallerySieve(user=request.user, formdata=request.params)
+    gallery_sieve = GallerySieve(user=request.user, formdata=request.params,
+        projection=True)
     gallery_sieve.filter_by_tag(tag.name)  # XXX this seems inefficient.
 
     return dict(
         tag=tag,
         gallery_sieve=gallery_sieve,
     )
+
+
+class TagRuleForm(wtforms.form.Form):
+    name = wtforms.fields.TextField(u'Tag', [
+        wtforms.validators.Required(),
+        wtforms.validators.Regexp(r'^[a-z0-9]+$',
+            message=u"Tags must be lowercase and alphanumeric"),
+    ])
+
+@view_config(
+    route_name='tags.add_alias',
+    permission='tags.manage',
+    request_method='POST')
+def add_alias(tag, request):
+    form = TagRuleForm(request.POST)
+    if not form.validate():
+        # FIXME when the final UI is figured out
+        return HTTPBadRequest()
+
+    try:
+        tagrules.add_alias(model.session, form.name.data, tag)
+    except ValueError as e:
+        request.session.flash(unicode(e), level=u'error')
+    else:
+        invalidate_cache('tags')
+        request.session.flash(u"\"{0}\" is now an alias for \"{1}\"".format(
+            form.name.data, tag.name))
+
+    return HTTPSeeOther(location=request.route_url('tags.view', tag=tag))
+
+@view_config(
+    route_name='tags.add_implication',
+    permission='tags.manage',
+    request_method='POST')
+def add_implication(tag, request):
+    form = TagRuleForm(request.POST)
+    if not form.validate():
+        # FIXME when the final UI is figured out
+        return HTTPBadRequest()
+
+    implied_tag = model.session.query(model.Tag) \
+        .filter_by(name=form.name.data).first()
+    if implied_tag is None:
+        request.session.flash(u"No such tag \"{0}\"".format(form.name.data),
+            level=u'error')
+        return HTTPSeeOther(location=request.route_url('tags.view', tag=tag))
+
+    try:
+        tagrules.add_implication(model.session, tag, implied_tag)
+    except ValueError as e:
+        request.session.flash(unicode(e), level=u'error')
+    else:
+        invalidate_cache('tags')
+        request.session.flash(u"\"{0}\" now implies \"{1}\"".format(
+            tag.name, implied_tag.name))
+
+    return HTTPSeeOther(location=request.route_url('tags.view', tag=tag))
+
+@view_config(
+    route_name='tags.remove_alias',
+    permission='tags.manage',
+    request_method='POST')
+def remove_alias(tag, request):
+    form = TagRuleForm(request.POST)
+    if not form.validate():
+        # FIXME when the final UI is figured out
+        return HTTPBadRequest()
+
+    try:
+        tagrules.remove_alias(model.session, form.name.data, tag)
+    except ValueError as e:
+        request.session.flash(unicode(e), level=u'error')
+    else:
+        invalidate_cache('tags')
+        request.session.flash(
+            u"\"{0}\" is no longer an alias for \"{1}\"".format(
+                form.name.data, tag.name))
+
+    return HTTPSeeOther(location=request.route_url('tags.view', tag=tag))
+
+@view_config(
+    route_name='tags.remove_implication',
+    permission='tags.manage',
+    request_method='POST')
+def remove_implication(tag, request):
+    form = TagRuleForm(request.POST)
+    if not form.validate():
+        # FIXME when the final UI is figured out
+        return HTTPBadRequest()
+
+    implied_tag = model.session.query(model.Tag) \
+        .filter_by(name=form.name.data).first()
+    if implied_tag is None:
+        request.session.flash(u"No such tag \"{0}\"".format(form.name.data),
+            level=u'error')
+        return HTTPSeeOther(location=request.route_url('tags.view', tag=tag))
+
+    try:
+        tagrules.remove_implication(model.session, tag, implied_tag)
+    except ValueError as e:
+        request.session.flash(unicode(e), level=u'error')
+    else:
+        invalidate_cache('tags')
+        request.session.flash(u"\"{0}\" no longer implies \"{1}\"".format(
+            tag.name, implied_tag.name))
+
+    return HTTPSeeOther(location=request.route_url('tags.view', tag=tag))
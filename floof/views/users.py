@@ -35,7 +35,7 @@ def profile(target_user, request):
     request_method='GET',
     renderer='users/watchstream.mako')
 def watchstream(target_user, request):
-    artwork = GallerySieve(user=request.user)
+    artwork = GallerySieve(user=request.user, projection=True)
     artwork.filter_by_watches(target_user)
 
     return dict(
@@ -44,6 +44,20 @@ def watchstream(target_user, request):
     )
 
 
+@view_config(
+    route_name='users.watch_network',
+    request_method='GET',
+    renderer='users/watch_network.mako')
+def watch_network(target_user, request):
+    artwork = GallerySieve(user=request.user, projection=True)
+    artwork.filter_by_friends_of_friends(target_user)
+
+    return dict(
+        artwork=artwork,
+        target_user=target_user,
+    )
+
+
 @view_config(
     route_name='users.art_by_label',
     request_method='GET',
@@ -53,7 +67,8 @@ def art_by_label(target_user, request):
         raise NotImplementedError  # XXX
 
     rel = request.matchdict['label']
-    gallery_sieve = GallerySieve(user=request.user, formdata=request.GET, countable=True)
+    gallery_sieve = GallerySieve(user=request.user, formdata=request.GET,
+        countable=True, projection=True)
     gallery_sieve.filter_by_user(rel, target_user)
 
     return dict(
@@ -0,0 +1,32 @@
+from sqlalchemy import *
+from migrate import *
+
+from sqlalchemy.ext.declarative import declarative_base
+TableBase = declarative_base()
+
+# Stub tables
+class Artwork(TableBase):
+    __tablename__ = 'artwork'
+    id = Column(Integer, primary_key=True, nullable=False)
+    uploaded_time = Column(DateTime, nullable=False)
+    rating_count = Column(Integer, nullable=False)
+    rating_score = Column(Float, nullable=True)
+
+ix_uploaded_time_id = Index('ix_artwork_uploaded_time_id',
+    Artwork.__table__.c.uploaded_time, Artwork.__table__.c.id)
+ix_rating_score_id = Index('ix_artwork_rating_score_id',
+    Artwork.__table__.c.rating_score, Artwork.__table__.c.id)
+ix_rating_count_id = Index('ix_artwork_rating_count_id',
+    Artwork.__table__.c.rating_count, Artwork.__table__.c.id)
+
+def upgrade(migrate_engine):
+    TableBase.metadata.bind = migrate_engine
+    ix_uploaded_time_id.create()
+    ix_rating_score_id.create()
+    ix_rating_count_id.create()
+
+def downgrade(migrate_engine):
+    TableBase.metadata.bind = migrate_engine
+    ix_uploaded_time_id.drop()
+    ix_rating_score_id.drop()
+    ix_rating_count_id.drop()
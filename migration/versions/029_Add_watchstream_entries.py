@@ -0,0 +1,34 @@
+from sqlalchemy import *
+from migrate import *
+
+from sqlalchemy.ext.declarative import declarative_base
+TableBase = declarative_base()
+
+
+# Stub tables
+class User(TableBase):
+    __tablename__ = 'users'
+    id = Column(Integer, primary_key=True, nullable=False)
+
+class Artwork(TableBase):
+    __tablename__ = 'artwork'
+    id = Column(Integer, primary_key=True, nullable=False)
+
+
+# New tables
+class WatchstreamEntry(TableBase):
+    __tablename__ = 'watchstream_entries'
+    user_id = Column(Integer, ForeignKey('users.id'), primary_key=True, nullable=False)
+    artwork_id = Column(Integer, ForeignKey('artwork.id'), primary_key=True, nullable=False, index=True)
+
+
+def upgrade(migrate_engine):
+    # Run `bin/floof-batch.py ... backfill-watchstream` afterwards to fill
+    # in everyone's existing watchstream
+    TableBase.metadata.bind = migrate_engine
+    WatchstreamEntry.__table__.create()
+
+
+def downgrade(migrate_engine):
+    TableBase.metadata.bind = migrate_engine
+    WatchstreamEntry.__table__.drop()
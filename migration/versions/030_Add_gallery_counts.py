@@ -0,0 +1,23 @@
+from sqlalchemy import *
+from migrate import *
+
+from sqlalchemy.ext.declarative import declarative_base
+TableBase = declarative_base()
+
+
+# New tables
+class GalleryCount(TableBase):
+    __tablename__ = 'gallery_counts'
+    key = Column(Unicode(64), primary_key=True, nullable=False)
+    count = Column(Integer, nullable=False)
+
+
+def upgrade(migrate_engine):
+    # Starts empty; counts are filled in as galleries are viewed
+    TableBase.metadata.bind = migrate_engine
+    GalleryCount.__table__.create()
+
+
+def downgrade(migrate_engine):
+    TableBase.metadata.bind = migrate_engine
+    GalleryCount.__table__.drop()
@@ -0,0 +1,21 @@
+from sqlalchemy import *
+from migrate import *
+import migrate.changeset  # monkeypatches Column
+
+from sqlalchemy.ext.declarative import declarative_base
+TableBase = declarative_base()
+
+class MediaImage(TableBase):
+    __tablename__ = 'media_images'
+    id = Column(Integer, primary_key=True, nullable=False)
+    dhash = Column(Unicode(16), nullable=True)
+
+
+def upgrade(migrate_engine):
+    # Existing images are filled in by the backfill-dhashes batch job
+    TableBase.metadata.bind = migrate_engine
+    MediaImage.__table__.c.dhash.create()
+
+def downgrade(migrate_engine):
+    TableBase.metadata.bind = migrate_engine
+    MediaImage.__table__.c.dhash.drop()
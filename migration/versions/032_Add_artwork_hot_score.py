@@ -0,0 +1,34 @@
+from sqlalchemy import *
+from migrate import *
+import migrate.changeset  # monkeypatches Column
+
+from floof.model.extensions import add_sqlite_functions, recompute_hot_scores
+from floof.model.types import TZDateTime
+
+from sqlalchemy.ext.declarative import declarative_base
+TableBase = declarative_base()
+
+# Stub tables
+class Artwork(TableBase):
+    __tablename__ = 'artwork'
+    id = Column(Integer, primary_key=True, nullable=False)
+    uploaded_time = Column(TZDateTime, nullable=False)
+    rating_count = Column(Integer, nullable=False)
+    rating_score = Column(Float, nullable=True)
+    hot_score = Column(Float, nullable=False, server_default='0')
+
+ix_hot_score_id = Index('ix_artwork_hot_score_id',
+    Artwork.__table__.c.hot_score, Artwork.__table__.c.id)
+
+def upgrade(migrate_engine):
+    add_sqlite_functions(migrate_engine)
+    TableBase.metadata.bind = migrate_engine
+    Artwork.__table__.c.hot_score.create()
+    Artwork.__table__.c.hot_score.alter(server_default=None)
+    recompute_hot_scores(migrate_engine, Artwork.__table__)
+    ix_hot_score_id.create()
+
+def downgrade(migrate_engine):
+    TableBase.metadata.bind = migrate_engine
+    ix_hot_score_id.drop()
+    Artwork.__table__.c.hot_score.drop()
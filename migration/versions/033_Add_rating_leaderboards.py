@@ -0,0 +1,35 @@
+from sqlalchemy import *
+from migrate import *
+
+from sqlalchemy.ext.declarative import declarative_base
+TableBase = declarative_base()
+
+
+# Stub tables
+class Artwork(TableBase):
+    __tablename__ = 'artwork'
+    id = Column(Integer, primary_key=True, nullable=False)
+
+# New tables
+class RatingLeaderboard(TableBase):
+    __tablename__ = 'rating_leaderboards'
+    window = Column(Unicode(8), primary_key=True, nullable=False)
+    artwork_id = Column(Integer, ForeignKey('artwork.id'), primary_key=True, nullable=False)
+    rating_score = Column(Float, nullable=False)
+
+ix_window_rating_score = Index('ix_rating_leaderboards_window_rating_score',
+    RatingLeaderboard.__table__.c.window,
+    RatingLeaderboard.__table__.c.rating_score,
+    RatingLeaderboard.__table__.c.artwork_id)
+
+
+def upgrade(migrate_engine):
+    # Starts empty; fill it with the rebuild-leaderboards batch job.  Until
+    # then, the rating sort queries the artwork table directly
+    TableBase.metadata.bind = migrate_engine
+    RatingLeaderboard.__table__.create()
+
+
+def downgrade(migrate_engine):
+    TableBase.metadata.bind = migrate_engine
+    RatingLeaderboard.__table__.drop()
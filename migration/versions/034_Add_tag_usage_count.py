@@ -0,0 +1,36 @@
+from sqlalchemy import *
+from migrate import *
+import migrate.changeset  # monkeypatches Column
+
+from sqlalchemy.ext.declarative import declarative_base
+TableBase = declarative_base()
+
+# Stub tables
+class Tag(TableBase):
+    __tablename__ = 'tags'
+    id = Column(Integer, primary_key=True, nullable=False)
+    usage_count = Column(Integer, nullable=False, server_default='0')
+
+artwork_tags = Table('artwork_tags', TableBase.metadata,
+    Column('artwork_id', Integer, primary_key=True, nullable=False),
+    Column('tag_id', Integer, ForeignKey('tags.id'), primary_key=True, nullable=False),
+)
+
+ix_usage_count_id = Index('ix_tags_usage_count_id',
+    Tag.__table__.c.usage_count, Tag.__table__.c.id)
+
+def upgrade(migrate_engine):
+    TableBase.metadata.bind = migrate_engine
+    tags = Tag.__table__
+    tags.c.usage_count.create()
+    tags.c.usage_count.alter(server_default=None)
+
+    migrate_engine.execute(tags.update().values(usage_count=
+        select([func.count(artwork_tags.c.artwork_id)],
+            artwork_tags.c.tag_id == tags.c.id).as_scalar()))
+    ix_usage_count_id.create()
+
+def downgrade(migrate_engine):
+    TableBase.metadata.bind = migrate_engine
+    ix_usage_count_id.drop()
+    Tag.__table__.c.usage_count.drop()
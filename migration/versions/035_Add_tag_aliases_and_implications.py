@@ -0,0 +1,44 @@
+from sqlalchemy import *
+from migrate import *
+
+from sqlalchemy.ext.declarative import declarative_base
+TableBase = declarative_base()
+
+
+# Stub tables
+class Tag(TableBase):
+    __tablename__ = 'tags'
+    id = Column(Integer, primary_key=True, nullable=False)
+
+# New tables
+class TagAlias(TableBase):
+    __tablename__ = 'tag_aliases'
+    name = Column(Unicode(64), primary_key=True, nullable=False)
+    tag_id = Column(Integer, ForeignKey('tags.id'), nullable=False)
+
+tag_implications = Table('tag_implications', TableBase.metadata,
+    Column('tag_id', Integer, ForeignKey('tags.id'), primary_key=True, nullable=False),
+    Column('implied_tag_id', Integer, ForeignKey('tags.id'), primary_key=True, nullable=False),
+)
+
+tag_implication_closure = Table('tag_implication_closure', TableBase.metadata,
+    Column('implied_tag_id', Integer, ForeignKey('tags.id'), primary_key=True, nullable=False),
+    Column('tag_id', Integer, ForeignKey('tags.id'), primary_key=True, nullable=False),
+)
+
+ix_closure_tag_id = Index('ix_tag_implication_closure_tag_id',
+    tag_implication_closure.c.tag_id)
+
+
+def upgrade(migrate_engine):
+    TableBase.metadata.bind = migrate_engine
+    TagAlias.__table__.create()
+    tag_implications.create()
+    tag_implication_closure.create()
+
+
+def downgrade(migrate_engine):
+    TableBase.metadata.bind = migrate_engine
+    tag_implication_closure.drop()
+    tag_implications.drop()
+    TagAlias.__table__.drop()
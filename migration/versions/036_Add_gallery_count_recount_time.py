@@ -0,0 +1,24 @@
+from sqlalchemy import *
+from migrate import *
+import migrate.changeset  # monkeypatches Column
+
+from sqlalchemy.ext.declarative import declarative_base
+TableBase = declarative_base()
+
+from floof.model.types import TZDateTime
+
+# Stub tables
+class GalleryCount(TableBase):
+    __tablename__ = 'gallery_counts'
+    key = Column(Unicode(64), primary_key=True, nullable=False)
+    count = Column(Integer, nullable=False)
+    recount_time = Column(TZDateTime)
+
+def upgrade(migrate_engine):
+    # Existing counts are left alone; recount-galleries checks those
+    TableBase.metadata.bind = migrate_engine
+    GalleryCount.__table__.c.recount_time.create()
+
+def downgrade(migrate_engine):
+    TableBase.metadata.bind = migrate_engine
+    GalleryCount.__table__.c.recount_time.drop()